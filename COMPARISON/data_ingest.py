@@ -4,215 +4,151 @@ A simple script for reading the CSV file exports from Medidata rave for the COMP
 and mapping key fields to the CanDIGv1 clinical/phenotypic data model
 """
 import argparse
+import functools
 import os
 import os.path
 import sys
-import csv
-import json
-from datetime import datetime
-from collections import defaultdict
-from dateutil import relativedelta
 
-def date_from_datetime(datetime_str):
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from ingest_common.accumulator import dump_metadata
+from ingest_common.columnar import write_tables
+from ingest_common.mapping import load_engine, MappingSpecError
+from ingest_common.profiling import Profiler
+from ingest_common.progress import Progress, STATE_FAILED, to_stderr
+from ingest_common.schema import count_incomplete, load_checked_engine, load_schema_index, NO_FIELD_NAMES
+from ingest_common.shards import write_shards
+from ingest_common.pipeline import batched, pipeline
+from ingest_common.scan import read_batches, total_size, ROWS, PATIENTS, ERROR
+from ingest_common.streams import input_files_in, open_output
+from ingest_common.survival import BATCH_SIZE as SURVIVAL_BATCH_SIZE, SurvivalBatch, parse_date
+from ingest_common.transforms import date_from_datetime
+from ingest_common.watch import watch_inputs
+
+# The mappings from the CSV files to the elements of the CanDIGv1 data model
+# live in mapping.json next to this script; see ingest_common/mapping.py for
+# the spec format.
+DEFAULT_MAPPING = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mapping.json')
+
+# the tables finalize_vital_status() reads; it only writes Outcome
+FINALIZED_TABLES = ("Patient", "Outcome", "Diagnosis")
+
+
+def outcome_label(engine, patient_id, increment=False):
     """
-    Give an string YY/MM/DD HH:MM:SS, return just the date string.
+    Generates current outcome label, using the Outcome counters
+    of the mapping engine
     """
-    # doing this in the simplest possible way now - just returning
-    # the first part of the string split at whitespace.  No validation
-    # done.
-    words = datetime_str.split()
-    if not words:
-        return ""
-    return words[0]
-
-def province_from_site(site_str):
-    """
-    Infers the province from the site string
-    """
-    site_mapping = {"BCCA Vancouver Cancer Centre": "British Columbia",
-                    "Princess Margaret Cancer Centre": "Ontario"}
-
-    result = "Unknown"
-    site = site_str.strip()
-    if site in site_mapping:
-        result = site_mapping[site]
-
-    return result
-
-def outcome_label(patient_id, increment=False):
-    """
-    Generates current outcome label, using the global
-    table_to_counts
-    """
-    global table_to_counts
-
     # inside the reading loop, incrementing is handled
     # automatically; but to add final vital status, we
     # need to explicilty increment
     if increment:
-        table_to_counts["Outcome"][patient_id] += 1
+        engine.increment(patient_id, "Outcome")
 
-    count = table_to_counts["Outcome"][patient_id]
+    if engine.stable_ids:
+        count = engine.stable_id(patient_id, "Outcome", "vital status")
+    else:
+        count = engine.count(patient_id, "Outcome")
     return f"{patient_id}_outcome_{count}"
 
-# Below are the mappings from the CSV files to the elements of the CanDIGv1 data model
-# The dictionary has keys for each of the relevant csv files (the DataPageName from
-# medidata rave).  Then item is a list of tuples of CanDIGv1 table name, and then mapping
-# fields.  E.g.:
-#
-#    "demographics": [
-#        ("Patient", {
-#            "patientId": "Subject"
-#            "gender": "GENDER_CODE"
-#         })]
-#
-# means that in the medidata rave files, demographics.GENDER_CODE -> Patient.gender
-#
-# Also, rather than a field name like "Subject", the item to map can be a tuple,
-# consisting of a function and a number of fields it takes as parameters:  e.g.
-#
-#        ("Diagnosis", {
-#           "patientId": "Subject",
-#           "cancerType": (lambda s: s.lower(), "MALIGNANCY"),
-#        })
-#
-# means that the results in the field MALIGNINANCY are lowercased and then placed into
-# Diagnosis.cancerType.  Functions with zero arguments can be useful for setting constants:
-#
-#             "vitalStatus": (lambda : "Dead",),
-#
-# will always set the vitalStatus field to "Dead" for patients in that table
-
 
-section_to_mapping_types = {
-    "demographics": [
-        ("Patient", {
-            "patientId": "Subject",
-            "gender": "GENDER_CODE",
-            "dateOfBirth": (date_from_datetime, "BIRTH_DATE_YM_INT"),
-            "ethnicity": "ETHNICITY_CODE",
-            "provinceOfResidence": (province_from_site, "Site")
-        }),
-        ("Enrollment", {
-            "patientId": "Subject",
-            "ageAtEnrollment": "WEC_AGE"
-        })],
-
-    "diagnosis": [
-        ("Diagnosis", {
-            "patientId": "Subject",
-            "diagnosisDate": (date_from_datetime, "DIAG_PA"),
-            "cancerType": (lambda s: s.lower(), "MALIGNANCY"),
-            "histology": (lambda s: s.lower(), "HISTO_CYTO_DIAG"),
-            "tumorGrade": "GRADE_DIAG",
-            "specificStage": "STAGE_DIAG"
-        })
-    ],
-
-    "systemic therapy log": [
-        ("Treatment", {
-            "patientId": "Subject",
-            "therapeuticModality": (lambda s: s.lower(), "THER_TX_NAME"),
-            "startDate": (date_from_datetime, "STRT_DT"),
-            "stopDate": (date_from_datetime, "LAST_DATE"),
-            "responseToTreatment": "THER_BR"
-        })
-    ],
-
-    "follow-up patient status": [
-        ("Outcome", {
-            "patientId": "Subject",
-            "dateOfAssessment": (date_from_datetime, "FU_STATUS_DT"),
-            "diseaseResponseOrStatus": (lambda s: s.strip('"'), "DISEASE_STATUS"),
-            "localId": (outcome_label, "Subject")
-        })
-    ],
-
-    "tissue collection": [
-        ("Sample", {
-            "patientId": "Subject",
-            "sampleId": "SAMPLE_ID",
-            "collectionDate": (date_from_datetime, "SURG_DT"),
-            "sampleType": "ARCH_TMR_SITE",
-            "cancerType": (lambda s: s.lower(), "CANCER_TYPE_LONG")
-        })
-    ],
-
-    "death": [
-        ("Patient", {
-            "patientId": "Subject",
-            "dateOfDeath": (date_from_datetime, "DTH_DT")
-        }),
-        ("Outcome", {
-            "patientId": "Subject",
-            "vitalStatus": (lambda : "Dead",),
-            "dateOfAssessment": (date_from_datetime, "DTH_DT"),
-            "localId": (outcome_label, "Subject")
-        })
-    ]
-}
-
-table_to_counts = {"Treatment": defaultdict(int),
-                   "Diagnosis": defaultdict(int),
-                   "Enrollment": defaultdict(int),
-                   "Outcome": defaultdict(int)}
-patient_to_data = {}
+def read_input_files(engine, inputs, prefilter=True, pipelined=True, progress=None):
+    """
+    Maps every row of the given CSV InputFiles with <engine>.  With
+    <prefilter>, exports of pages the mapping doesn't use are skipped
+    without being parsed.  With <pipelined>, the files are read and parsed
+    in a background thread while the rows read so far are mapped.  A
+    <progress> is told how far through the inputs the reading is.
+    """
+    batches = read_batches(engine, inputs, prefilter, progress=progress)
+    if pipelined:
+        batches = pipeline(batches)
+    map_batches(engine, batches, progress)
 
 
-def update_patient_data(row):
+def map_batches(engine, batches, progress=None):
     """
-    Updates a patient's data with information provided in <row>.
-
-    :param dict[str, str] row: maps each CSV fieldname to its value in a CSV row
-    :return: None
+    Maps the (input_file, kind, items) batches of scan.read_batches() with
+    <engine>.
     """
-    section = row["DataPageName"].strip().lower()
-    if not section in section_to_mapping_types:
-        return
+    for input_file, kind, items in batches:
+        if kind == ROWS:
+            for row in items:
+                engine.update(row)
+        elif kind == PATIENTS:
+            for patient_id in items:
+                engine.add_patient(patient_id)
+        elif kind == ERROR:
+            print(f'Error opening {input_file.name}: ', items)
+            if progress:
+                progress.finish(STATE_FAILED)
+            sys.exit(1)
+
+
+def finalize_remapped(engine, patients, schema_index=None):
+    """
+    Finalizes the patients --watch just mapped again.
+    """
+    finalize_vital_status(engine, patients)
+    if schema_index:
+        warn_incomplete(schema_index, (engine.patient_data(patient_id) for patient_id in patients))
 
-    mapping_types = section_to_mapping_types[section]
 
-    patient_id = row["Subject"]
-    if patient_id not in patient_to_data:
-        patient_to_data[patient_id] = {
-            "Patient": {
-                "patientId": patient_id
-            }
-        }
-    curr_patient_data = patient_to_data[patient_id]
+def finalize_vital_status(engine, patients=None):
+    """
+    Adds the final vital status Outcome of every patient, and the overall
+    survival of those who died, computed a batch of patients at a time.
 
-    for mapping_type in mapping_types:
-        mapping_name = mapping_type[0]
-        mapping_dict = mapping_type[1]
+    :param patients: the patients to finalize, e.g. those touched by an
+        incremental refresh; all of them by default
+    """
+    if patients is None:
+        patients = engine.patient_ids()
+    for batch in batched(patients, SURVIVAL_BATCH_SIZE):
+        patient_data = {patient_id: engine.patient_data(patient_id, FINALIZED_TABLES) for patient_id in batch}
+        survival = SurvivalBatch()
+        for patient_id, data in patient_data.items():
+            if "dateOfDeath" in data["Patient"] and "Diagnosis" in data and\
+                    len(data["Diagnosis"]["diagnosisDate"]) > 0:
+                survival.add(patient_id, data["Diagnosis"]["diagnosisDate"], data["Patient"]["dateOfDeath"])
+        survival_in_months = survival.months()
+
+        # update vital status and keys that depend on same
+        for patient_id, data in patient_data.items():
+            new_local_id = outcome_label(engine, patient_id, increment=True)
+            if not "dateOfDeath" in data["Patient"]:
+                if not "Outcome" in data:
+                    data["Outcome"] = {"localId": new_local_id, "patientId": patient_id}
+
+                outcomes = data["Outcome"]
+                if isinstance(outcomes, dict):
+                    data["Outcome"]["vitalStatus"] = "Alive"
+                elif isinstance(outcomes, list):
+                    data["Outcome"][-1]["vitalStatus"] = "Alive"
+            else:
+                new_dict = {"vitalStatus": "Dead", "localId": new_local_id, "patientId": patient_id}
+                if patient_id in survival_in_months:
+                    death_date = parse_date(data["Patient"]["dateOfDeath"])
+                    new_dict["dateOfAssessment"] = date_from_datetime(str(death_date))
+                    new_dict["overallSurvivalInMonths"] = str(survival_in_months[patient_id])
 
-        counter = None
-        if mapping_name in table_to_counts:
-            counter = table_to_counts[mapping_name]
-            counter[patient_id] += 1
+                if not "Outcome" in data:
+                    data["Outcome"] = new_dict
+                elif isinstance(data["Outcome"], dict):
+                    data["Outcome"]["overallSurvivalInMonths"] = new_dict["overallSurvivalInMonths"]
+                elif isinstance(data["Outcome"], list):
+                    data["Outcome"][-1]["overallSurvivalInMonths"] = new_dict["overallSurvivalInMonths"]
 
-        new_dict = {}
-        for key in mapping_dict:
-            if isinstance(mapping_dict[key], str):
-                new_dict[key] = row[mapping_dict[key]]
-            else:  # if the value of the key is of a tuple,
-                # function and argument namees
-                t = mapping_dict[key]
-                function, argitems = t[0], t[1:]
-                args = (row[item] for item in argitems if item in row)
-                new_dict[key] = function(*args)
+            engine.update_patient_data(patient_id, {"Outcome": data["Outcome"]})
 
-        if counter:
-            new_dict["localId"] = f"{patient_id}_{mapping_name.lower()}_{counter[patient_id]}"
 
-        if mapping_name in curr_patient_data:
-            if mapping_name == "Patient":
-                curr_patient_data[mapping_name] = {**curr_patient_data[mapping_name], **new_dict}
-            elif isinstance(curr_patient_data[mapping_name], list):
-                curr_patient_data[mapping_name].append(new_dict)
-            else:
-                curr_patient_data[mapping_name] = [curr_patient_data[mapping_name], new_dict]
-        else:
-            curr_patient_data[mapping_name] = new_dict
+def warn_incomplete(schema_index, entries):
+    """
+    Warns about the mapped records validate.py would skip for lack of the
+    fields their localId is built from.
+    """
+    for table, count in count_incomplete(schema_index, entries).items():
+        print(f'Warning: {count} {table} records have an empty localId field and will be skipped '
+              f'by validate.py', file=sys.stderr)
 
 
 def main():
@@ -221,58 +157,132 @@ def main():
     a JSON file containing the clin/phen data in CanDIGv1 format
     """
     parser = argparse.ArgumentParser()
-    parser.add_argument('inputdir', help='path to directory containing input files in CSV format')
-    parser.add_argument('output', help='path to output file in JSON format',
-                        type=argparse.FileType('w'), default=sys.stdout)
+    parser.add_argument('inputdir', help='path to directory or zip bundle containing input files in CSV format, '
+                                         'optionally gzip or zstd compressed')
+    parser.add_argument('output', help='path to output file in JSON format; compressed if it ends in .gz or .zst, '
+                                       '"-" for standard output')
+    parser.add_argument('--mapping', default=DEFAULT_MAPPING,
+                        help='path to the mapping spec (default: mapping.json next to this script)')
+    parser.add_argument('--no-prefilter', action='store_true',
+                        help='parse every input file, even exports of pages the mapping does not use')
+    parser.add_argument('--no-pipeline', action='store_true',
+                        help='read the input files in the main thread instead of a background one')
+    parser.add_argument('--shards', type=int, default=0, metavar='N',
+                        help='split the output into N shards by patient, writing a shard manifest '
+                             'to the output path')
+    parser.add_argument('--columnar', action='store_true',
+                        help='write one file per table to the output path, which is then a directory, '
+                             'instead of a single JSON document')
+    parser.add_argument('--schema-index', metavar='PATH',
+                        help='check the mapping against this schema index instead of the one '
+                             'read from the installed candig')
+    parser.add_argument('--no-schema-check', action='store_true',
+                        help='run the mapping without checking it against the CanDIG schema')
+    parser.add_argument('--strict-schema', action='store_true',
+                        help='stop, rather than only check the localId fields, when the field names of the '
+                             'CanDIG tables are unknown')
+    parser.add_argument('--stable-ids', action='store_true',
+                        help='derive record localIds from the rows they come from rather than counting '
+                             'records, so that they do not depend on the order the rows are read in')
+    parser.add_argument('--profile', metavar='REPORT_DIR',
+                        help='profile the run and write the reports to REPORT_DIR; implies --no-pipeline, '
+                             'as cProfile only sees the main thread')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running, mapping the input directory again whenever files are dropped into, '
+                             'changed in or removed from it, and replacing the output each time; only the '
+                             'files added or changed are read again and only the patients they have rows for '
+                             'mapped again, but the rows of every file are kept in memory')
+    parser.add_argument('--progress', action='store_true',
+                        help='report progress, throughput, ETA and memory use on standard error')
+    parser.add_argument('--status-file', metavar='PATH',
+                        help='keep a JSON status of the run, as --progress reports it, in PATH')
     args = parser.parse_args()
+    if args.columnar and args.shards:
+        parser.error('--columnar and --shards are mutually exclusive')
+    if args.watch and (args.shards or args.columnar or args.output == '-'):
+        parser.error('--watch writes a single JSON document to an output path')
+    if (args.shards or args.columnar) and args.output == '-':
+        parser.error('--shards and --columnar need an output path')
+
+    profiler = None
+    if args.profile:
+        profiler = Profiler(args.profile)
+        profiler.start()
 
     input_files_dir = args.inputdir
-    outfile = args.output
 
     try:
-        input_files = os.listdir(input_files_dir)
+        inputs = input_files_in(input_files_dir)
+        total = total_size(inputs) if args.progress or args.status_file else None
     except OSError as e:
         print(f'Error accessing {input_files_dir}: ', e)
         sys.exit(1)
 
-    for input_file in input_files:
-        with open(os.path.join(input_files_dir, input_file), 'r') as csv_file:
-            reader = csv.DictReader(csv_file)
-            for row in reader:
-                update_patient_data(row)
+    schema_index = None
+    if not args.no_schema_check:
+        try:
+            schema_index = load_schema_index(args.schema_index)
+        except (OSError, ValueError) as e:
+            print(f'Error loading schema index {args.schema_index}: ', e)
+            sys.exit(1)
+        if schema_index.fields is None:
+            if args.strict_schema:
+                print(f'Error: {NO_FIELD_NAMES}')
+                sys.exit(1)
+            print(f'Warning: {NO_FIELD_NAMES}; only the localId fields of the mapping are checked', file=sys.stderr)
 
-    # update vital status and keys that depend on same
-    for patient_id in patient_to_data:
-        new_local_id = outcome_label(patient_id, increment=True)
-        if not "dateOfDeath" in patient_to_data[patient_id]["Patient"]:
-            if not "Outcome" in patient_to_data[patient_id]:
-                patient_to_data[patient_id]["Outcome"] = {"localId": new_local_id, "patientId": patient_id}
-
-            outcomes = patient_to_data[patient_id]["Outcome"]
-            if isinstance(outcomes, dict):
-                patient_to_data[patient_id]["Outcome"]["vitalStatus"] = "Alive"
-            elif isinstance(outcomes, list):
-                patient_to_data[patient_id]["Outcome"][-1]["vitalStatus"] = "Alive"
+    try:
+        if schema_index:
+            engine, corrections = load_checked_engine(args.mapping, schema_index, stable_ids=args.stable_ids)
+            for correction in corrections:
+                print(f'Warning: {correction}', file=sys.stderr)
         else:
-            new_dict = {"vitalStatus": "Dead", "localId": new_local_id, "patientId": patient_id}
-            if "Diagnosis" in patient_to_data[patient_id] and\
-                    len(patient_to_data[patient_id]["Diagnosis"]["diagnosisDate"]) > 0:
-                diagnosis_date = datetime.strptime(patient_to_data[patient_id]["Diagnosis"]["diagnosisDate"], "%m/%d/%Y")
-                death_date = datetime.strptime(patient_to_data[patient_id]["Patient"]["dateOfDeath"], "%m/%d/%Y")
-                new_dict["dateOfAssessment"] = date_from_datetime(str(death_date))
-                dates_diff = relativedelta.relativedelta(death_date, diagnosis_date)
-                survival_in_months = (dates_diff.years * 12) + dates_diff.months + (dates_diff.days / 30)
-                new_dict["overallSurvivalInMonths"] = str(survival_in_months)
-
-            if not "Outcome" in patient_to_data[patient_id]:
-                patient_to_data[patient_id]["Outcome"] = new_dict
-            elif isinstance(patient_to_data[patient_id]["Outcome"], dict):
-                patient_to_data[patient_id]["Outcome"]["overallSurvivalInMonths"] = new_dict["overallSurvivalInMonths"]
-            elif isinstance(patient_to_data[patient_id]["Outcome"], list):
-                patient_to_data[patient_id]["Outcome"][-1]["overallSurvivalInMonths"] = new_dict["overallSurvivalInMonths"]
+            engine = load_engine(args.mapping, stable_ids=args.stable_ids)
+    except (OSError, MappingSpecError) as e:
+        print(f'Error loading mapping {args.mapping}: ', e)
+        sys.exit(1)
+    if profiler:
+        engine.attach_profiler(profiler)
+        profiler.lap("load_mapping")
+    if args.watch:
+        if not os.path.isdir(input_files_dir):
+            print(f'Error watching {input_files_dir}: not a directory')
+            sys.exit(1)
+        watch_inputs(engine, input_files_dir, args.output, map_batches,
+                     functools.partial(finalize_remapped, schema_index=schema_index),
+                     prefilter=not args.no_prefilter, indent=2)
+        return
+    progress = None
+    if args.progress or args.status_file:
+        progress = Progress(total, status_path=args.status_file, report=to_stderr if args.progress else None)
+    read_input_files(engine, inputs, prefilter=not args.no_prefilter, pipelined=not (args.no_pipeline or args.profile),
+                     progress=progress)
+    if profiler:
+        profiler.lap("read")
+    finalize_vital_status(engine)
+    if profiler:
+        profiler.lap("finalize")
+    if schema_index:
+        warn_incomplete(schema_index, engine.metadata())
 
-    output_dict = {"metadata": list(patient_to_data.values())}
-    json.dump(output_dict, outfile, indent=2)
+    try:
+        if args.columnar:
+            write_tables(engine.metadata(), args.output)
+        elif args.shards:
+            write_shards(engine.metadata(), args.output, args.shards, indent=2)
+        else:
+            with open_output(args.output) as outfile:
+                dump_metadata(engine.metadata(), outfile, indent=2)
+    except OSError as e:
+        print(f'Error opening {args.output}: ', e)
+        if progress:
+            progress.finish(STATE_FAILED)
+        sys.exit(1)
+    if progress:
+        progress.finish()
+    if profiler:
+        profiler.lap("write")
+        profiler.stop()
 
 
 if __name__ == '__main__':
@@ -1,154 +1,201 @@
 import argparse
+import os
 import sys
-import csv
-import json
-
-
-patient_mapping = {
-    "patientId": "Patient ID",
-    "gender": "SEX",
-    "otherIds": "PATIENT DISPLAY NAME"
-}
-
-enrollment_mapping = {
-    "patientId": "Patient ID",
-    "ageAtEnrollment": "AGE",
-    "localId": lambda _, dictionary: dictionary["patientId"] + "_enrollment_0"
-}
-
-sample_mapping = {
-    "patientId": "Patient ID",
-    "sampleId": "Sample ID",
-    "cancerType": "CANCER TYPE",
-    "cancerSubtype": "CANCER TYPE DETAILED",
-    "sampleType": lambda row, *_: row['SAMPLE TYPE'] + " " + row['SAMPLE CLASS'],
-    "otherBiobank": "STORAGE"
-}
-
-treatment_mapping = {
-    "patientId": "Patient ID",
-    "unexpectedOrUnusualToxicityDuringTreatment": "IRAE EVENT STATUS",
-    "reasonForEndingTheTreatment": "REASON OFF TRIAL",
-    "localId": lambda _, dictionary: dictionary["patientId"] + "_treatment_0"
-}
-
-outcome_types = [
-    "Disease Free Status",
-    "RECIST1.1 BEST OVERALL RESPONSE"
-]
-
-outcome_nums = [0, 1, 2]
-
-outcome_mapping = {
-    "patientId": "Patient ID",
-    "overallSurvivalInMonths": "Overall Survival",
-    "vitalStatus": "Overall Survival Status",
-    "diseaseFreeSurvivalInMonths": "Disease Free Survival",
-    "responseCriteriaUsed": lambda *_: outcome_types.pop(0),
-    "diseaseResponseOrStatus": lambda row, dictionary: row[dictionary["responseCriteriaUsed"]],
-    "localId": lambda _, dictionary: dictionary["patientId"] + "_outcome_" + str(outcome_nums.pop(0))
-}
-
-labtest_event_types = [
-    "BASELINE_TUMOR_CD4 (% of CD3)",
-    "BASELINE_TUMOR_CD8 (% of CD3)",
-    "BASELINE_TUMOR_PD1 (% CD8)"
-]
-
-labtest_nums = [0, 1, 2]
-
-labtest_mapping = {
-    "patientId": "Patient ID",
-    "eventType": lambda *_: labtest_event_types.pop(0),
-    "timePoint": lambda *_: "Baseline",
-    "testResults": lambda row, dictionary: row[dictionary["eventType"]],
-    "localId": lambda _, dictionary: dictionary["patientId"] + "_labtest_" + str(labtest_nums.pop(0))
-}
-
-
-def get_dict(mapping, row):
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+from ingest_common.accumulator import dump_metadata
+from ingest_common.columnar import write_tables
+from ingest_common.dialects import sniff_input
+from ingest_common.mapping import load_engine, MappingSpecError
+from ingest_common.pipeline import batched
+from ingest_common.profiling import Profiler
+from ingest_common.progress import Progress, STATE_FAILED, to_stderr
+from ingest_common.scan import ROW_BATCH
+from ingest_common.schema import count_incomplete, load_checked_engine, load_schema_index, NO_FIELD_NAMES
+from ingest_common.shards import write_shards
+from ingest_common.streams import bytes_read, input_size, open_input, open_output
+from ingest_common.watch import replaced_output, run_watcher, Watcher
+
+# The mappings from the cBioPortal clinical CSV to the elements of the CanDIGv1
+# data model live in mapping.json next to this script; see
+# ingest_common/mapping.py for the spec format.  Every CSV row becomes one
+# metadata entry with a Patient, Enrollment, Sample and Treatment record, two
+# Outcome records and three Labtest records.
+DEFAULT_MAPPING = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mapping.json')
+
+
+def read_input_file(engine, csv_file, csv_format, progress=None):
     """
-    Returns a dictionary with values in <row> mapped to their corresponding keys in <mapping> (if there is one).
+    Maps every row of the open cBioPortal CSV file with <engine>, split as
+    <csv_format> says; comment lines above the header are skipped.  A
+    <progress> is told how far through the file the reading is.
+    """
+    for rows in batched(csv_format.reader(csv_file), ROW_BATCH):
+        for row in rows:
+            engine.update(row)
+        if progress:
+            progress.update(done=bytes_read(csv_file), items=len(rows))
+
 
-    :param dict[str, str | (dict[str, str], dict[str, str]) -> str] mapping: maps JSON key names to CSV fieldnames
-    :param dict[str, str] row: maps each CSV fieldname to its value in a CSV row
-    :return: values in a CSV row mapped to their corresponding JSON keys (if there is one)
-    :rtype: dict[str, str]
+def watch_input_file(engine, input_file, output_file, schema_index=None):
+    """
+    Maps <input_file> with a fresh copy of <engine> every time it is
+    dropped, changed or replaced, and replaces <output_file> with the
+    metadata.  Runs until interrupted.
     """
-    return_dict = {}
-    for key in mapping:
-        if type(mapping[key]) == str:
-            return_dict[key] = row[mapping[key]]
-        else:  # if the value of the key is of a function type
-            return_dict[key] = mapping[key](row, return_dict)
+    directory, name = os.path.split(os.path.abspath(input_file))
 
-    return return_dict
+    def handle(changes):
+        if not (changes.added or changes.changed):
+            return
+        start = time.perf_counter()
+        batch_engine = engine.fresh()
+        try:
+            csv_format = sniff_input(input_file)
+            with open_input(input_file, csv_format.encoding, errors=csv_format.errors) as csv_file:
+                read_input_file(batch_engine, csv_file, csv_format)
+            if schema_index:
+                warn_incomplete(schema_index, batch_engine.metadata())
+            with replaced_output(output_file) as json_file:
+                dump_metadata(batch_engine.metadata(), json_file)
+        except OSError as e:
+            print(f'Error mapping {input_file}: ', e, file=sys.stderr)
+            return
+        print(f'Wrote {output_file} in {time.perf_counter() - start:.1f}s', file=sys.stderr)
+
+    run_watcher(Watcher(directory, names={name}), handle, input_file)
+
+
+def warn_incomplete(schema_index, entries):
+    """
+    Warns about the mapped records validate.py would skip for lack of the
+    fields their localId is built from.
+    """
+    for table, count in count_incomplete(schema_index, entries).items():
+        print(f'Warning: {count} {table} records have an empty localId field and will be skipped '
+              f'by validate.py', file=sys.stderr)
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('input-file', help='path to input file in CSV format')
-    parser.add_argument('output-file', help='path to output file in JSON format')
+    parser.add_argument('input-file', help='path to input file in CSV format; may be gzip or zstd compressed, '
+                                           'or the only file in a zip bundle')
+    parser.add_argument('output-file', help='path to output file in JSON format; compressed if it ends in .gz or .zst')
+    parser.add_argument('--mapping', default=DEFAULT_MAPPING,
+                        help='path to the mapping spec (default: mapping.json next to this script)')
+    parser.add_argument('--shards', type=int, default=0, metavar='N',
+                        help='split the output into N shards by patient, writing a shard manifest '
+                             'to the output path')
+    parser.add_argument('--columnar', action='store_true',
+                        help='write one file per table to the output path, which is then a directory, '
+                             'instead of a single JSON document')
+    parser.add_argument('--schema-index', metavar='PATH',
+                        help='check the mapping against this schema index instead of the one '
+                             'read from the installed candig')
+    parser.add_argument('--no-schema-check', action='store_true',
+                        help='run the mapping without checking it against the CanDIG schema')
+    parser.add_argument('--strict-schema', action='store_true',
+                        help='stop, rather than only check the localId fields, when the field names of the '
+                             'CanDIG tables are unknown')
+    parser.add_argument('--stable-ids', action='store_true',
+                        help='derive record localIds from the rows they come from rather than counting '
+                             'records, so that they do not depend on the order the rows are read in')
+    parser.add_argument('--profile', metavar='REPORT_DIR',
+                        help='profile the run and write the reports to REPORT_DIR')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running, mapping the input file again and replacing the output whenever '
+                             'the input file is dropped, changed or replaced')
+    parser.add_argument('--progress', action='store_true',
+                        help='report progress, throughput, ETA and memory use on standard error')
+    parser.add_argument('--status-file', metavar='PATH',
+                        help='keep a JSON status of the run, as --progress reports it, in PATH')
     args = parser.parse_args()
+    if args.columnar and args.shards:
+        parser.error('--columnar and --shards are mutually exclusive')
+    if args.watch and (args.shards or args.columnar or '-' in (getattr(args, 'input-file'),
+                                                               getattr(args, 'output-file'))):
+        parser.error('--watch maps an input file path to a single JSON document at an output path')
+
+    profiler = None
+    if args.profile:
+        profiler = Profiler(args.profile)
+        profiler.start()
 
     input_file = getattr(args, 'input-file')
     output_file = getattr(args, 'output-file')
 
-    csv_file = None
+    schema_index = None
+    if not args.no_schema_check:
+        try:
+            schema_index = load_schema_index(args.schema_index)
+        except (OSError, ValueError) as e:
+            print(f'Error loading schema index {args.schema_index}: ', e)
+            sys.exit(1)
+        if schema_index.fields is None:
+            if args.strict_schema:
+                print(f'Error: {NO_FIELD_NAMES}')
+                sys.exit(1)
+            print(f'Warning: {NO_FIELD_NAMES}; only the localId fields of the mapping are checked', file=sys.stderr)
+
     try:
-        csv_file = open(input_file)
-        reader = csv.DictReader(csv_file)
-        output_dict = {
-            "metadata": []
-        }
-        for row in reader:
-            row = dict(row)
-            output_dict['metadata'].append(
-                {
-                    "Patient": get_dict(patient_mapping, row),
-                    "Enrollment": get_dict(enrollment_mapping, row),
-                    "Sample": get_dict(sample_mapping, row),
-                    "Treatment": get_dict(treatment_mapping, row),
-                    "Outcome": [
-                        get_dict(outcome_mapping, row),
-                        get_dict(outcome_mapping, row)
-                    ],
-                    "Labtest": [
-                        get_dict(labtest_mapping, row),
-                        get_dict(labtest_mapping, row),
-                        get_dict(labtest_mapping, row)
-                    ]
-                }
-            )
-
-            # reset outcomes and labtests to their original state for the next iteration
-            global outcome_types, labtest_event_types, outcome_nums, labtest_nums
-            outcome_types = [
-                "Disease Free Status",
-                "RECIST1.1 BEST OVERALL RESPONSE"
-            ]
-            labtest_event_types = [
-                "BASELINE_TUMOR_CD4 (% of CD3)",
-                "BASELINE_TUMOR_CD8 (% of CD3)",
-                "BASELINE_TUMOR_PD1 (% CD8)"
-            ]
-
-            outcome_nums = [0, 1, 2]
-            labtest_nums = [0, 1, 2]
+        if schema_index:
+            engine, corrections = load_checked_engine(args.mapping, schema_index, stable_ids=args.stable_ids)
+            for correction in corrections:
+                print(f'Warning: {correction}', file=sys.stderr)
+        else:
+            engine = load_engine(args.mapping, stable_ids=args.stable_ids)
+    except (OSError, MappingSpecError) as e:
+        print(f'Error loading mapping {args.mapping}: ', e)
+        sys.exit(1)
+    if profiler:
+        engine.attach_profiler(profiler)
+        profiler.lap("load_mapping")
+    if args.watch:
+        watch_input_file(engine, input_file, output_file, schema_index)
+        return
 
+    csv_file = None
+    progress = None
+    try:
+        csv_format = sniff_input(input_file)
+        if args.progress or args.status_file:
+            progress = Progress(input_size(input_file), status_path=args.status_file,
+                                report=to_stderr if args.progress else None)
+            progress.current = input_file
+        csv_file = open_input(input_file, csv_format.encoding, errors=csv_format.errors)
+        read_input_file(engine, csv_file, csv_format, progress)
+        if profiler:
+            profiler.lap("read")
+        if schema_index:
+            warn_incomplete(schema_index, engine.metadata())
         json_file = None
         try:
-            json_file = open(output_file, 'w')
-            json.dump(output_dict, json_file)
+            if args.columnar:
+                write_tables(engine.metadata(), output_file)
+            elif args.shards:
+                write_shards(engine.metadata(), output_file, args.shards)
+            else:
+                json_file = open_output(output_file)
+                dump_metadata(engine.metadata(), json_file)
         except OSError as e:
             print(f'Error opening {output_file}: ', e)
+            if progress:
+                progress.finish(STATE_FAILED)
             sys.exit(1)
         finally:
             if json_file:
                 json_file.close()
+        if progress:
+            progress.finish()
+        if profiler:
+            profiler.lap("write")
+            profiler.stop()
 
     except OSError as e:
         print(f'Error opening {input_file}: ', e)
+        if progress:
+            progress.finish(STATE_FAILED)
         sys.exit(1)
     finally:
         if csv_file:
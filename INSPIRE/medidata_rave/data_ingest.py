@@ -1,304 +1,266 @@
 import argparse
-from datetime import datetime
-from dateutil import relativedelta
+import functools
 import os
 import sys
-import csv
-import json
 
-patient_mapping_0 = {
-    "gender": "PRSN_GENDER_TXT_TP",
-    "dateOfBirth": "PER_BIR_DT",
-    "race": "RACE_CAT_TXT_STD",
-    "ethnicity": "ETH_GRP_CAT_TXT_STD"
-}
-
-patient_mapping_1 = {
-    "dateOfDeath": "DEATH_DT"
-}
-
-sample_mapping_0 = {
-    "patientId": "Subject",
-    "sampleId": lambda sample_id: sample_id,
-    "collectionDate": "BX_DT",
-    "anatomicSiteTheSampleObtainedFrom": "BIOP_ANA_PERF_NAM_STD"
-}
-
-sample_mapping_1 = {
-    "patientId": "Subject",
-    "sampleId": lambda sample_id: sample_id,
-    "collectionDate": "BL_SPEC_COLL_DT"
-}
-
-treatment_mapping_0 = {
-    "patientId": "Subject",
-    "stopDate": "OTX_DATE",
-    "reasonForEndingTheTreatment": "OFF_TX_RSN_SPEC",
-    "localId": lambda local_id: local_id
-}
-
-treatment_mapping_1 = {
-    "patientId": "Subject",
-    "startDate": "INTVN_BEG_DT",
-    "localId": lambda local_id: local_id
-}
-
-outcome_mapping = {
-    "patientId": "Subject",
-    "vitalStatus": "PART_VITAL_STAT_TP",
-    "localId": lambda local_id: local_id
-}
-
-diagnosis_mapping = {
-    "patientId": "Subject",
-    "diagnosisDate": "CURRENT_DZ_P_DX_DT",
-    "cancerSite": "PRIM_DZ_ANAT_SITE_NM_STD",
-    "localId": lambda local_id: local_id
-}
-
-immunotherapy_mapping_0 = {
-    "patientId": "Subject",
-    "courseNumber": "CRSE_NUM",
-    "startDate": "TX_STT_DT",
-    "localId": lambda local_id: local_id
-}
-
-immunotherapy_mapping_1 = {
-    "patientId": "Subject",
-    "immunotherapyType": "AGT_NAME",
-    "localId": lambda local_id: local_id
-}
-
-complication_mapping = {
-    "patientId": "Subject",
-    "date": "AE_ONSET_DT",
-    "lateComplicationOfTherapyDeveloped": "CTCAE4_LLT_NM",
-    "localId": lambda local_id: local_id
-}
-
-labtest_mapping_0 = {
-    "patientId": "Subject",
-    "recordingDate": "IMG_PROC_DT",
-    "localId": lambda local_id, *_: local_id
-}
-
-labtest_mapping_1 = {
-    "patientId": "Subject",
-    "testResults": "MSRBL_IND",
-    "localId": lambda local_id, *_: local_id,
-    "eventType": lambda _id, method: "RECISTv1.1 " + method + " MSRBL_IND"
-}
-
-labtest_mapping_2 = {
-    "patientId": "Subject",
-    "testResults": "TGT_NONTGT_IDN_TXT",
-    "localId": lambda local_id, *_: local_id,
-    "eventType": lambda _id, method: "RECISTv1.1 " + method + " TGT_NONTGT_IDN_TXT"
-}
-
-labtest_mapping_3 = {
-    "patientId": "Subject",
-    "testResults": "NEW_LES_APR_IND_2_STD",
-    "localId": lambda local_id, *_: local_id,
-    "eventType": lambda _id, method: "RECISTv1.1 " + method + " NEW_LES_APR_IND_2_STD"
-}
-
-labtest_mapping_4 = {
-    "patientId": "Subject",
-    "testResults": "TUMOR_SITE_LCTN_NM_STD",
-    "localId": lambda local_id, *_: local_id,
-    "eventType": lambda _id, method: "RECISTv1.1 " + method + " TUMOR_SITE_LCTN_NM_STD"
-}
-
-labtest_mapping_5 = {
-    "patientId": "Subject",
-    "testResults": "LES_NUM",
-    "localId": lambda local_id, *_: local_id,
-    "eventType": lambda _id, method: "RECISTv1.1 " + method + " LES_NUM"
-}
-
-labtest_mapping_6 = {
-    "patientId": "Subject",
-    "testResults": "LES_SZ_NUM",
-    "localId": lambda local_id, *_: local_id,
-    "eventType": lambda _id, method: "RECISTv1.1 " + method + " LES_SZ_NUM"
-}
-
-labtest_mapping_7 = {
-    "patientId": "Subject",
-    "testResults": "MALIGN_SUM_DIAM_VOL",
-    "localId": lambda local_id, *_: local_id,
-    "eventType": lambda _id, method: "RECISTv1.1 " + method + " MALIGN_SUM_DIAM_VOL"
-}
-
-labtest_mapping_8 = {
-    "patientId": "Subject",
-    "testResults": "TGT_RESP_STD",
-    "localId": lambda local_id, *_: local_id,
-    "eventType": lambda _id, method: "RECISTv1.1 " + method + " TGT_RESP_STD"
-}
-
-labtest_mapping_9 = {
-    "patientId": "Subject",
-    "testResults": "NTGT_RESP_STD",
-    "localId": lambda local_id, *_: local_id,
-    "eventType": lambda _id, method: "RECISTv1.1 " + method + " NTGT_RESP_STD"
-}
-
-labtest_mapping_10 = {
-    "patientId": "Subject",
-    "testResults": "OVERALL_LES_RESP_TP_STD",
-    "localId": lambda local_id, *_: local_id,
-    "eventType": lambda _id, method: "RECISTv1.1 " + method + " OVERALL_LES_RESP_TP_STD"
-}
-
-section_to_mapping_types = {
-    "demography": [("Patient", patient_mapping_0)],
-    "diagnosis": [("Diagnosis", diagnosis_mapping)],
-    "survival": [("Outcome", outcome_mapping), ("Patient", patient_mapping_1)],
-    "biopsy": [("Sample", sample_mapping_0)],
-    "research blood - circulating tumor dna blood": [("Sample", sample_mapping_1)],
-    "research blood - normal dna sequence control blood": [("Sample", sample_mapping_1)],
-    "research blood - immune assessment for pbmc blood": [("Sample", sample_mapping_1)],
-    "course initiation": [("Immunotherapy", immunotherapy_mapping_0)],
-    "off treatment": [("Treatment", treatment_mapping_0)],
-    "study agent administration": [("Immunotherapy", immunotherapy_mapping_1), ("Treatment", treatment_mapping_1)],
-    "adverse events": [("Complication", complication_mapping)],
-    "recistv1.1": [("Labtest", labtest_mapping_0), ("Labtest", labtest_mapping_1), ("Labtest", labtest_mapping_2),
-                   ("Labtest", labtest_mapping_3), ("Labtest", labtest_mapping_4), ("Labtest", labtest_mapping_5),
-                   ("Labtest", labtest_mapping_6), ("Labtest", labtest_mapping_7), ("Labtest", labtest_mapping_8),
-                   ("Labtest", labtest_mapping_9), ("Labtest", labtest_mapping_10)]
-}
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+from ingest_common.accumulator import dump_metadata
+from ingest_common.columnar import write_tables
+from ingest_common.mapping import load_engine, MappingSpecError
+from ingest_common.profiling import Profiler
+from ingest_common.progress import Progress, STATE_FAILED, to_stderr
+from ingest_common.schema import count_incomplete, load_checked_engine, load_schema_index, NO_FIELD_NAMES
+from ingest_common.shards import write_shards
+from ingest_common.pipeline import batched, pipeline
+from ingest_common.scan import read_batches, total_size, ROWS, PATIENTS, ERROR
+from ingest_common.streams import input_files_in, open_output
+from ingest_common.survival import BATCH_SIZE as SURVIVAL_BATCH_SIZE, SurvivalBatch
+from ingest_common.watch import watch_inputs
+
+# The mappings from the CSV files to the elements of the CanDIGv1 data model
+# live in mapping.json next to this script; see ingest_common/mapping.py for
+# the spec format.
+DEFAULT_MAPPING = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mapping.json')
+
+# the tables finalize_vital_status() reads; it only writes Outcome
+FINALIZED_TABLES = ("Patient", "Outcome", "Diagnosis")
+
+
+def is_dead(data):
+    """
+    Whether a patient's survival page reports them as dead.
 
-patient_to_id_nums = {}
-patient_to_data = {}
-dead_patients = set()
+    :param dict data: the CanDIGv1 tables of the patient
+    :rtype: bool
+    """
+    outcomes = data.get("Outcome", [])
+    if isinstance(outcomes, dict):
+        outcomes = [outcomes]
+    return any(outcome.get("vitalStatus", "").strip().lower() == "dead" for outcome in outcomes)
 
 
-def update_patient_data(row):
+def read_input_files(engine, inputs, prefilter=True, pipelined=True, progress=None):
     """
-    Updates a patient's data with information provided in <row>.
-
-    :param dict[str, str] row: maps each CSV fieldname to its value in a CSV row
-    :return: None
+    Maps every row of the given CSV InputFiles with <engine>.  With
+    <prefilter>, exports of pages the mapping doesn't use are skipped
+    without being parsed.  With <pipelined>, the files are read and parsed
+    in a background thread while the rows read so far are mapped.  A
+    <progress> is told how far through the inputs the reading is.
     """
-    patient_id = row["Subject"]
-    if patient_id not in patient_to_id_nums:
-        patient_to_id_nums[patient_id] = dict.fromkeys(section_to_mapping_types.keys(), 0)
+    batches = read_batches(engine, inputs, prefilter, progress=progress)
+    if pipelined:
+        batches = pipeline(batches)
+    map_batches(engine, batches, progress)
 
-    if patient_id not in patient_to_data:
-        patient_to_data[patient_id] = {
-            "Patient": {
-                "patientId": patient_id
-            }
-        }
-    curr_patient_data = patient_to_data[patient_id]
 
-    increment_id_num = False
-    section = row["DataPageName"].strip().lower()
-    mapping_types = section_to_mapping_types.get(section, [])
-    for mapping_type in mapping_types:
-        mapping_name = mapping_type[0]
-        mapping_dict = mapping_type[1]
+def map_batches(engine, batches, progress=None):
+    """
+    Maps the (input_file, kind, items) batches of scan.read_batches() with
+    <engine>.
+    """
+    for input_file, kind, items in batches:
+        if kind == ROWS:
+            for row in items:
+                engine.update(row)
+        elif kind == PATIENTS:
+            for patient_id in items:
+                engine.add_patient(patient_id)
+        elif kind == ERROR:
+            print(f'Error opening {input_file.name}: ', items)
+            if progress:
+                progress.finish(STATE_FAILED)
+            sys.exit(1)
 
-        prev_key = None
-        new_dict = {}
-        for key in mapping_dict:
-            if type(mapping_dict[key]) == str:
-                new_dict[key] = row[mapping_dict[key]]
-            else:  # if the value of the key is of a function type
-                args = []
-                new_id = section.replace(" ", "_") + "_"
-                if section == "recistv1.1":
-                    if key == "eventType":
-                        method = row["RECIST_MET"]
-                        args.append(method)
-                    elif key == "localId":
-                        new_id += prev_key + "_"
 
-                new_id += str(patient_to_id_nums[patient_id][section])
-                args.insert(0, new_id)
-                new_dict[key] = mapping_dict[key](*args)
-                increment_id_num = True
-            prev_key = mapping_dict[key]
+def finalize_remapped(engine, patients, schema_index=None):
+    """
+    Finalizes the patients --watch just mapped again.
+    """
+    finalize_vital_status(engine, patients)
+    if schema_index:
+        warn_incomplete(schema_index, (engine.patient_data(patient_id) for patient_id in patients))
 
-        if mapping_name in curr_patient_data:
-            if mapping_name == "Patient":
-                curr_patient_data[mapping_name] = {**curr_patient_data[mapping_name], **new_dict}
-            elif type(curr_patient_data[mapping_name]) == list:
-                curr_patient_data[mapping_name].append(new_dict)
-            else:
-                curr_patient_data[mapping_name] = [curr_patient_data[mapping_name], new_dict]
-        else:
-            curr_patient_data[mapping_name] = new_dict
 
-        if mapping_name == "Outcome" and patient_to_data[patient_id]["Outcome"]["vitalStatus"].strip().lower() == "dead":
-            dead_patients.add(patient_id)
+def finalize_vital_status(engine, patients=None):
+    """
+    Adds an Alive Outcome to every patient not reported dead, and the
+    overall survival of those who died, computed a batch of patients at a
+    time.
 
-    if increment_id_num:
-        patient_to_id_nums[patient_id][section] += 1
+    :param patients: the patients to finalize, e.g. those touched by an
+        incremental refresh; all of them by default
+    """
+    if patients is None:
+        patients = engine.patient_ids()
+    for batch in batched(patients, SURVIVAL_BATCH_SIZE):
+        patient_data = {patient: engine.patient_data(patient, FINALIZED_TABLES) for patient in batch}
+        survival = SurvivalBatch()
+        for patient, data in patient_data.items():
+            if is_dead(data) and "Diagnosis" in data and\
+                    len(data["Diagnosis"]["diagnosisDate"]) > 0:
+                survival.add(patient, data["Diagnosis"]["diagnosisDate"].split()[0],
+                             data["Patient"]["dateOfDeath"].split()[0])
+        survival_in_months = survival.months()
+
+        for patient, data in patient_data.items():
+            if not is_dead(data):
+                if engine.stable_ids:
+                    count = engine.stable_id(patient, "survival", "vital status")
+                else:
+                    count = engine.count(patient, "survival")
+                data["Outcome"] = {
+                    "patientId": patient,
+                    "vitalStatus": "Alive",
+                    "localId": "survival_" + str(count)
+                }
+                engine.increment(patient, "survival")
+            elif patient in survival_in_months:
+                data["Outcome"]["overallSurvivalInMonths"] = str(survival_in_months[patient])
+            engine.update_patient_data(patient, {"Outcome": data["Outcome"]})
+
+
+def warn_incomplete(schema_index, entries):
+    """
+    Warns about the mapped records validate.py would skip for lack of the
+    fields their localId is built from.
+    """
+    for table, count in count_incomplete(schema_index, entries).items():
+        print(f'Warning: {count} {table} records have an empty localId field and will be skipped '
+              f'by validate.py', file=sys.stderr)
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('input-files-dir', help='path to directory containing input files in CSV format')
-    parser.add_argument('output-file', help='path to output file in JSON format')
+    parser.add_argument('input-files-dir', help='path to directory or zip bundle containing input files in CSV '
+                                                'format, optionally gzip or zstd compressed')
+    parser.add_argument('output-file', help='path to output file in JSON format; compressed if it ends in .gz or .zst')
+    parser.add_argument('--mapping', default=DEFAULT_MAPPING,
+                        help='path to the mapping spec (default: mapping.json next to this script)')
+    parser.add_argument('--no-prefilter', action='store_true',
+                        help='parse every input file, even exports of pages the mapping does not use')
+    parser.add_argument('--no-pipeline', action='store_true',
+                        help='read the input files in the main thread instead of a background one')
+    parser.add_argument('--shards', type=int, default=0, metavar='N',
+                        help='split the output into N shards by patient, writing a shard manifest '
+                             'to the output path')
+    parser.add_argument('--columnar', action='store_true',
+                        help='write one file per table to the output path, which is then a directory, '
+                             'instead of a single JSON document')
+    parser.add_argument('--schema-index', metavar='PATH',
+                        help='check the mapping against this schema index instead of the one '
+                             'read from the installed candig')
+    parser.add_argument('--no-schema-check', action='store_true',
+                        help='run the mapping without checking it against the CanDIG schema')
+    parser.add_argument('--strict-schema', action='store_true',
+                        help='stop, rather than only check the localId fields, when the field names of the '
+                             'CanDIG tables are unknown')
+    parser.add_argument('--stable-ids', action='store_true',
+                        help='derive record localIds from the rows they come from rather than counting '
+                             'records, so that they do not depend on the order the rows are read in')
+    parser.add_argument('--profile', metavar='REPORT_DIR',
+                        help='profile the run and write the reports to REPORT_DIR; implies --no-pipeline, '
+                             'as cProfile only sees the main thread')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running, mapping the input directory again whenever files are dropped into, '
+                             'changed in or removed from it, and replacing the output each time; only the '
+                             'files added or changed are read again and only the patients they have rows for '
+                             'mapped again, but the rows of every file are kept in memory')
+    parser.add_argument('--progress', action='store_true',
+                        help='report progress, throughput, ETA and memory use on standard error')
+    parser.add_argument('--status-file', metavar='PATH',
+                        help='keep a JSON status of the run, as --progress reports it, in PATH')
     args = parser.parse_args()
+    if args.columnar and args.shards:
+        parser.error('--columnar and --shards are mutually exclusive')
+    if args.watch and (args.shards or args.columnar or getattr(args, 'output-file') == '-'):
+        parser.error('--watch writes a single JSON document to an output path')
+
+    profiler = None
+    if args.profile:
+        profiler = Profiler(args.profile)
+        profiler.start()
 
     input_files_dir = getattr(args, 'input-files-dir')
     output_file = getattr(args, 'output-file')
 
     try:
-        input_files = os.listdir(input_files_dir)
+        inputs = input_files_in(input_files_dir)
+        total = total_size(inputs) if args.progress or args.status_file else None
     except OSError as e:
         print(f'Error accessing {input_files_dir}: ', e)
         sys.exit(1)
 
-    for input_file in input_files:
-        csv_file = None
+    schema_index = None
+    if not args.no_schema_check:
         try:
-            csv_file = open(input_files_dir + input_file)
-            reader = csv.DictReader(csv_file)
-            for row in reader:
-                row = dict(row)
-                update_patient_data(row)
-
-        except OSError as e:
-            print(f'Error opening {input_files_dir + input_file}: ', e)
+            schema_index = load_schema_index(args.schema_index)
+        except (OSError, ValueError) as e:
+            print(f'Error loading schema index {args.schema_index}: ', e)
             sys.exit(1)
-        finally:
-            if csv_file:
-                csv_file.close()
+        if schema_index.fields is None:
+            if args.strict_schema:
+                print(f'Error: {NO_FIELD_NAMES}')
+                sys.exit(1)
+            print(f'Warning: {NO_FIELD_NAMES}; only the localId fields of the mapping are checked', file=sys.stderr)
 
-    for patient in patient_to_data.keys():
-        if patient not in dead_patients:
-            patient_to_data[patient]["Outcome"] = {
-                "patientId": patient,
-                "vitalStatus": "Alive",
-                "localId": "survival_" + str(patient_to_id_nums[patient]["survival"])
-            }
-            patient_to_id_nums[patient]["survival"] += 1
+    try:
+        if schema_index:
+            engine, corrections = load_checked_engine(args.mapping, schema_index, stable_ids=args.stable_ids)
+            for correction in corrections:
+                print(f'Warning: {correction}', file=sys.stderr)
         else:
-            if "Diagnosis" in patient_to_data[patient] and\
-                    len(patient_to_data[patient]["Diagnosis"]["diagnosisDate"]) > 0:
-                diagnosis_date = datetime.strptime(patient_to_data[patient]["Diagnosis"]["diagnosisDate"].split()[0], "%m/%d/%Y")
-                death_date = datetime.strptime(patient_to_data[patient]["Patient"]["dateOfDeath"].split()[0], "%m/%d/%Y")
-                dates_diff = relativedelta.relativedelta(death_date, diagnosis_date)
-                survival_in_months = (dates_diff.years * 12) + dates_diff.months + (dates_diff.days / 30)
-                patient_to_data[patient]["Outcome"]["overallSurvivalInMonths"] = str(survival_in_months)
+            engine = load_engine(args.mapping, stable_ids=args.stable_ids)
+    except (OSError, MappingSpecError) as e:
+        print(f'Error loading mapping {args.mapping}: ', e)
+        sys.exit(1)
+    if profiler:
+        engine.attach_profiler(profiler)
+        profiler.lap("load_mapping")
+    if args.watch:
+        if not os.path.isdir(input_files_dir):
+            print(f'Error watching {input_files_dir}: not a directory')
+            sys.exit(1)
+        watch_inputs(engine, input_files_dir, output_file, map_batches,
+                     functools.partial(finalize_remapped, schema_index=schema_index),
+                     prefilter=not args.no_prefilter, indent=None)
+        return
+    progress = None
+    if args.progress or args.status_file:
+        progress = Progress(total, status_path=args.status_file, report=to_stderr if args.progress else None)
+    read_input_files(engine, inputs, prefilter=not args.no_prefilter, pipelined=not (args.no_pipeline or args.profile),
+                     progress=progress)
+    if profiler:
+        profiler.lap("read")
+    finalize_vital_status(engine)
+    if profiler:
+        profiler.lap("finalize")
+    if schema_index:
+        warn_incomplete(schema_index, engine.metadata())
 
-    output_dict = {"metadata": list(patient_to_data.values())}
     json_file = None
     try:
-        json_file = open(output_file, 'w')
-        json.dump(output_dict, json_file)
+        if args.columnar:
+            write_tables(engine.metadata(), output_file)
+        elif args.shards:
+            write_shards(engine.metadata(), output_file, args.shards)
+        else:
+            json_file = open_output(output_file)
+            dump_metadata(engine.metadata(), json_file)
     except OSError as e:
         print(f'Error opening {output_file}: ', e)
+        if progress:
+            progress.finish(STATE_FAILED)
         sys.exit(1)
     finally:
         if json_file:
             json_file.close()
 
+    if progress:
+        progress.finish()
+    if profiler:
+        profiler.lap("write")
+        profiler.stop()
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Generates synthetic Medidata Rave and cBioPortal exports for benchmarking
+the ingest scripts.
+
+The CSV columns are taken from each cohort's mapping spec, so the generated
+files always match what the ingest scripts read.  Rows are written one page
+at a time and every patient's values are derived from the seed and the
+patient number alone, so memory use stays flat from 1k to 1M patients and
+the same arguments always produce the same files.
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from ingest_common.mapping import load_plan, required_columns
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+COHORTS = {
+    "comparison": {
+        "mapping": os.path.join(ROOT, "COMPARISON", "mapping.json"),
+        "prefix": "COMP",
+        "death_section": "death",
+    },
+    "inspire-rave": {
+        "mapping": os.path.join(ROOT, "INSPIRE", "medidata_rave", "mapping.json"),
+        "prefix": "INSP",
+        "death_section": "survival",
+    },
+    "cbioportal": {
+        "mapping": os.path.join(ROOT, "INSPIRE", "cBioportal_clinphen", "mapping.json"),
+        "prefix": "INSP",
+    }
+}
+
+# the bookkeeping columns found at the start of every Rave DataPage export
+RAVE_COLUMNS = ["Subject", "Site", "SiteNumber", "InstanceName", "DataPageName",
+                "PageRepeatNumber", "RecordId", "RecordPosition"]
+
+SITES = ["Princess Margaret Cancer Centre", "BCCA Vancouver Cancer Centre",
+         "Juravinski Cancer Centre", "Tom Baker Cancer Centre"]
+
+# (min, max) rows per patient for each section; sections not listed get one
+ROWS_PER_PATIENT = {
+    "systemic therapy log": (1, 4),
+    "follow-up patient status": (0, 5),
+    "tissue collection": (0, 2),
+    "biopsy": (0, 2),
+    "course initiation": (1, 3),
+    "study agent administration": (1, 6),
+    "adverse events": (0, 8),
+    "recistv1.1": (1, 6)
+}
+
+# pages that no mapping reads; Rave exports carry many of these
+UNMAPPED_PAGES = ["Vital Signs", "Concomitant Medications", "Laboratory Results",
+                  "Physical Examination", "ECOG Performance Status", "Medical History",
+                  "Protocol Deviations", "Quality of Life"]
+
+VALUE_POOLS = {
+    "GENDER_CODE": ["Male", "Female"],
+    "PRSN_GENDER_TXT_TP": ["Male", "Female"],
+    "SEX": ["Male", "Female"],
+    "ETHNICITY_CODE": ["Not Hispanic or Latino", "Hispanic or Latino", "Unknown"],
+    "ETH_GRP_CAT_TXT_STD": ["Not Hispanic or Latino", "Hispanic or Latino", "Unknown"],
+    "RACE_CAT_TXT_STD": ["White", "Asian", "Black or African American", "Other"],
+    "MALIGNANCY": ["Leiomyosarcoma", "Liposarcoma", "Synovial Sarcoma", "Osteosarcoma"],
+    "CANCER_TYPE_LONG": ["Leiomyosarcoma", "Liposarcoma", "Synovial Sarcoma"],
+    "CANCER TYPE": ["Head and Neck Cancer", "Breast Cancer", "Ovarian Cancer", "Melanoma"],
+    "CANCER TYPE DETAILED": ["Head and Neck Squamous Cell Carcinoma", "Triple Negative Breast Cancer",
+                             "High-Grade Serous Ovarian Cancer", "Cutaneous Melanoma"],
+    "HISTO_CYTO_DIAG": ["Spindle Cell", "Myxoid", "Pleomorphic", "Round Cell"],
+    "GRADE_DIAG": ["1", "2", "3", "Unknown"],
+    "STAGE_DIAG": ["I", "II", "III", "IV"],
+    "THER_TX_NAME": ["Doxorubicin", "Ifosfamide", "Gemcitabine", "Docetaxel", "Trabectedin"],
+    "THER_BR": ["CR", "PR", "SD", "PD", "NE"],
+    "DISEASE_STATUS": ['"No Evidence of Disease"', '"Stable Disease"', '"Progressive Disease"'],
+    "ARCH_TMR_SITE": ["Primary", "Metastasis", "Recurrence"],
+    "PRIM_DZ_ANAT_SITE_NM_STD": ["Head and Neck", "Breast", "Ovary", "Skin"],
+    "BIOP_ANA_PERF_NAM_STD": ["Lymph Node", "Liver", "Lung", "Skin"],
+    "OFF_TX_RSN_SPEC": ["Disease progression", "Adverse event", "Patient withdrawal"],
+    "AGT_NAME": ["Pembrolizumab"],
+    "CTCAE4_LLT_NM": ["Fatigue", "Rash", "Diarrhea", "Nausea", "Hypothyroidism"],
+    "RECIST_MET": ["CT", "MRI", "PET-CT"],
+    "MSRBL_IND": ["Yes", "No"],
+    "TGT_NONTGT_IDN_TXT": ["Target", "Non-target"],
+    "NEW_LES_APR_IND_2_STD": ["Yes", "No"],
+    "TUMOR_SITE_LCTN_NM_STD": ["Lung", "Liver", "Lymph Node", "Bone"],
+    "TGT_RESP_STD": ["CR", "PR", "SD", "PD"],
+    "NTGT_RESP_STD": ["CR", "Non-CR/Non-PD", "PD"],
+    "OVERALL_LES_RESP_TP_STD": ["CR", "PR", "SD", "PD"],
+    "SAMPLE TYPE": ["Primary", "Metastasis"],
+    "SAMPLE CLASS": ["Tumor", "Blood"],
+    "STORAGE": ["FFPE", "Frozen"],
+    "IRAE EVENT STATUS": ["Yes", "No"],
+    "REASON OFF TRIAL": ["Progression", "Toxicity", "Withdrawal"],
+    "Overall Survival Status": ["1:DECEASED", "0:LIVING"],
+    "Disease Free Status": ["0:DiseaseFree", "1:Recurred/Progressed"],
+    "RECIST1.1 BEST OVERALL RESPONSE": ["CR", "PR", "SD", "PD"],
+    "Site": SITES
+}
+
+NUMERIC_RANGES = {
+    "WEC_AGE": (18, 90),
+    "AGE": (18, 90),
+    "CRSE_NUM": (1, 12),
+    "LES_NUM": (1, 5),
+    "LES_SZ_NUM": (5, 120),
+    "MALIGN_SUM_DIAM_VOL": (10, 300),
+    "Overall Survival": (1, 120),
+    "Disease Free Survival": (1, 120),
+    "BASELINE_TUMOR_CD4 (% of CD3)": (0, 100),
+    "BASELINE_TUMOR_CD8 (% of CD3)": (0, 100),
+    "BASELINE_TUMOR_PD1 (% CD8)": (0, 100)
+}
+
+
+def is_date_column(column):
+    """
+    Guesses whether a Rave column holds a date from its name.
+    """
+    upper = column.upper()
+    return upper.endswith(("_DT", "_DATE", "_DT_INT", "_YM_INT")) or upper in ("DIAG_PA", "OTX_DATE", "LAST_DATE")
+
+
+def format_date(day, with_time=True):
+    """
+    Formats a date the way Rave exports do, MM/DD/YYYY with an optional time.
+    """
+    text = f"{day.month:02d}/{day.day:02d}/{day.year}"
+    return f"{text} 00:00:00" if with_time else text
+
+
+class PatientProfile(object):
+    """
+    The values of one synthetic patient that must agree across pages.
+    """
+    def __init__(self, seed, index, prefix, death_rate):
+        rng = random.Random(seed * 1000003 + index)
+        self.patient_id = f"{prefix}-{index:07d}"
+        self.site = rng.choice(SITES)
+        self.site_number = str(SITES.index(self.site) + 1)
+        self.diagnosis_date = date(2010, 1, 1) + timedelta(days=rng.randrange(3000))
+        self.dead = rng.random() < death_rate
+        self.death_date = self.diagnosis_date + timedelta(days=rng.randrange(30, 2500))
+        self.seed = rng.randrange(1 << 30)
+
+
+def column_value(rng, column, profile, section):
+    """
+    Returns a plausible value for <column> on a page of <section>.
+    """
+    if column in ("DIAG_PA", "CURRENT_DZ_P_DX_DT"):
+        return format_date(profile.diagnosis_date)
+    if column in ("DTH_DT", "DEATH_DT"):
+        return format_date(profile.death_date)
+    if column == "PART_VITAL_STAT_TP":
+        return "Dead" if profile.dead else "Alive"
+    if column == "Site":
+        return profile.site
+    if column in VALUE_POOLS:
+        return rng.choice(VALUE_POOLS[column])
+    if column in NUMERIC_RANGES:
+        return str(rng.randint(*NUMERIC_RANGES[column]))
+    if is_date_column(column):
+        return format_date(profile.diagnosis_date + timedelta(days=rng.randrange(-60, 900)))
+    if column in ("SAMPLE_ID", "Sample ID"):
+        return f"{profile.patient_id}-S{rng.randrange(100)}"
+    return f"{column.lower()}_{rng.randrange(8)}"
+
+
+def rows_for(rng, section, profile, death_section):
+    """
+    Returns how many rows of <section> a patient gets.
+    """
+    if section == death_section:
+        return 1 if profile.dead else 0
+    low, high = ROWS_PER_PATIENT.get(section, (1, 1))
+    return rng.randint(low, high)
+
+
+def write_rave_cohort(name, outdir, patients, seed, death_rate, unmapped_pages):
+    """
+    Writes one CSV per DataPage of a Rave cohort; returns the row counts.
+    """
+    cohort = COHORTS[name]
+    sections = required_columns(load_plan(cohort["mapping"]))
+    pages = [(section, columns) for section, columns in sections.items()]
+    for page in UNMAPPED_PAGES[:unmapped_pages]:
+        pages.append((page.lower(), [f"{page.upper().replace(' ', '_')[:8]}_{i}" for i in range(12)]))
+
+    os.makedirs(outdir, exist_ok=True)
+    counts = {}
+    record_id = 0
+    for page_number, (section, columns) in enumerate(pages):
+        fieldnames = RAVE_COLUMNS + [column for column in columns if column not in RAVE_COLUMNS]
+        page_name = section.title()
+        # unmapped pages tend to be the bulky ones
+        multiplier = 4 if page_number >= len(sections) else 1
+        file_name = os.path.join(outdir, f"{section.replace(' ', '_')}.csv")
+        counts[page_name] = 0
+        with open(file_name, "w", newline="") as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames)
+            writer.writeheader()
+            for index in range(patients):
+                profile = PatientProfile(seed, index, cohort["prefix"], death_rate)
+                rng = random.Random(profile.seed + page_number)
+                for position in range(rows_for(rng, section, profile, cohort["death_section"]) * multiplier):
+                    record_id += 1
+                    row = {
+                        "Subject": profile.patient_id,
+                        "Site": profile.site,
+                        "SiteNumber": profile.site_number,
+                        "InstanceName": "Screening" if position == 0 else f"Cycle {position}",
+                        "DataPageName": page_name,
+                        "PageRepeatNumber": "0",
+                        "RecordId": str(record_id),
+                        "RecordPosition": str(position)
+                    }
+                    for column in columns:
+                        if column not in row:
+                            row[column] = column_value(rng, column, profile, section)
+                    writer.writerow(row)
+                    counts[page_name] += 1
+    return counts
+
+
+def write_cbioportal_cohort(outdir, patients, seed, death_rate):
+    """
+    Writes the cBioPortal clinical CSV, one row per patient; returns the row count.
+    """
+    cohort = COHORTS["cbioportal"]
+    columns = required_columns(load_plan(cohort["mapping"]))[None]
+
+    os.makedirs(outdir, exist_ok=True)
+    with open(os.path.join(outdir, "data_clinical.csv"), "w", newline="") as csv_file:
+        writer = csv.DictWriter(csv_file, columns)
+        writer.writeheader()
+        for index in range(patients):
+            profile = PatientProfile(seed, index, cohort["prefix"], death_rate)
+            rng = random.Random(profile.seed)
+            row = {column: column_value(rng, column, profile, None) for column in columns}
+            row["Patient ID"] = profile.patient_id
+            row["PATIENT DISPLAY NAME"] = f"Patient {index}"
+            writer.writerow(row)
+    return {"data_clinical": patients}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('outdir', help='directory to write the synthetic cohorts to')
+    parser.add_argument('--patients', type=int, default=1000, help='number of patients per cohort')
+    parser.add_argument('--cohort', choices=sorted(COHORTS) + ['all'], default='all')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--death-rate', type=float, default=0.3,
+                        help='fraction of patients with a death record')
+    parser.add_argument('--unmapped-pages', type=int, default=3,
+                        help=f'number of Rave pages no mapping reads (max {len(UNMAPPED_PAGES)})')
+    args = parser.parse_args()
+
+    cohorts = sorted(COHORTS) if args.cohort == 'all' else [args.cohort]
+    manifest = {"patients": args.patients, "seed": args.seed, "cohorts": {}}
+    for name in cohorts:
+        outdir = os.path.join(args.outdir, name)
+        if name == "cbioportal":
+            counts = write_cbioportal_cohort(outdir, args.patients, args.seed, args.death_rate)
+        else:
+            counts = write_rave_cohort(name, outdir, args.patients, args.seed, args.death_rate,
+                                       args.unmapped_pages)
+        manifest["cohorts"][name] = {"path": name, "rows": sum(counts.values()), "pages": counts}
+        print(f'{name}: {sum(counts.values())} rows in {outdir}')
+
+    with open(os.path.join(args.outdir, "manifest.json"), "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Benchmarks the ingest scripts and validate.py on a synthetic cohort.
+
+Generate the data first with generate_cohort.py, then e.g.:
+
+    python benchmarks/run_benchmarks.py /tmp/cohort --save-baseline before
+    ... change something ...
+    python benchmarks/run_benchmarks.py /tmp/cohort --compare before
+
+Every target runs in its own subprocess so its peak RSS is measured in
+isolation.  The report lists rows/s, peak RSS and the time spent in each
+stage of every target.  Baselines are stored as JSON in benchmarks/baselines.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+from ingest_common.accumulator import dump_metadata
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+INGESTERS = {
+    "comparison": os.path.join(ROOT, "COMPARISON", "data_ingest.py"),
+    "inspire-rave": os.path.join(ROOT, "INSPIRE", "medidata_rave", "data_ingest.py"),
+    "cbioportal": os.path.join(ROOT, "INSPIRE", "cBioportal_clinphen", "data_ingest.py")
+}
+TARGETS = sorted(INGESTERS) + ["validate"]
+
+
+def import_script(name, path):
+    """
+    Imports a script that is not on sys.path as a module.
+    """
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class StageTimer(object):
+    """
+    Collects the wall time of consecutive named stages.
+    """
+    def __init__(self):
+        self.stages = {}
+        self._start = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self._start
+        self._start = now
+
+
+def run_ingester(target, data_dir, work_dir):
+    """
+    Runs one ingest script stage by stage; returns the stage timings.
+    """
+    timer = StageTimer()
+    module = import_script(f"bench_{target.replace('-', '_')}", INGESTERS[target])
+    engine = module.load_engine(module.DEFAULT_MAPPING)
+    timer.lap("load_mapping")
+
+    input_dir = os.path.join(data_dir, target)
+    if target == "cbioportal":
+        input_file = os.path.join(input_dir, "data_clinical.csv")
+        csv_format = module.sniff_input(input_file)
+        with module.open_input(input_file, csv_format.encoding, errors=csv_format.errors) as csv_file:
+            module.read_input_file(engine, csv_file, csv_format)
+        timer.lap("read")
+    else:
+        module.read_input_files(engine, module.input_files_in(input_dir))
+        timer.lap("read")
+        module.finalize_vital_status(engine)
+        timer.lap("finalize")
+
+    with open(os.path.join(work_dir, f"{target}.json"), "w") as json_file:
+        dump_metadata(engine.metadata(), json_file)
+    timer.lap("write")
+    return timer.stages
+
+
+def run_validate(work_dir):
+    """
+    Runs validate.py on the COMPARISON output; returns the stage timings.
+    """
+    timer = StageTimer()
+    module = import_script("bench_validate", os.path.join(ROOT, "validate.py"))
+    timer.lap("import")
+
+    sys.argv = ["validate", os.path.join(work_dir, "comparison.json")]
+    module.main()
+    timer.lap("validate")
+    return timer.stages
+
+
+def child(target, data_dir, work_dir):
+    """
+    Entry point of the per-target subprocess; prints its measurements as JSON.
+    """
+    start = time.perf_counter()
+    try:
+        if target == "validate":
+            stages = run_validate(work_dir)
+        else:
+            stages = run_ingester(target, data_dir, work_dir)
+    except ImportError as e:
+        print(json.dumps({"skipped": f"missing dependency: {e}"}))
+        return
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_mb = peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+    print(json.dumps({
+        "seconds": time.perf_counter() - start,
+        "peak_rss_mb": round(peak_mb, 1),
+        "stages": {stage: round(seconds, 4) for stage, seconds in stages.items()}
+    }))
+
+
+def target_rows(manifest, target, work_dir):
+    """
+    Returns the number of input rows (or individuals, for validate) of a target.
+    """
+    if target == "validate":
+        with open(os.path.join(work_dir, "comparison.json")) as json_file:
+            return len(json.load(json_file)["metadata"])
+    return manifest["cohorts"][target]["rows"]
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints the change against a baseline; returns True if anything regressed.
+    """
+    regressed = False
+    for target, result in results.items():
+        base = baseline.get("results", {}).get(target)
+        if not base or "rows_per_s" not in base or "rows_per_s" not in result:
+            continue
+        speed = result["rows_per_s"] / base["rows_per_s"]
+        memory = result["peak_rss_mb"] / base["peak_rss_mb"]
+        flags = []
+        if speed < 1 - tolerance:
+            flags.append("SLOWER")
+        if memory > 1 + tolerance:
+            flags.append("MORE MEMORY")
+        regressed = regressed or bool(flags)
+        print(f'{target:>14}: {speed:6.2f}x throughput, {memory:6.2f}x peak RSS {" ".join(flags)}')
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('datadir', help='directory written by generate_cohort.py')
+    parser.add_argument('--targets', default=','.join(TARGETS),
+                        help=f'comma-separated subset of {",".join(TARGETS)}')
+    parser.add_argument('--workdir', help='where to write ingest outputs (default: <datadir>/bench_output)')
+    parser.add_argument('--save-baseline', metavar='NAME', help='store the results as a named baseline')
+    parser.add_argument('--compare', metavar='NAME', help='compare the results against a named baseline')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='relative change tolerated before --compare reports a regression')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    work_dir = args.workdir or os.path.join(args.datadir, "bench_output")
+    if args.child:
+        child(args.child, args.datadir, work_dir)
+        return
+
+    os.makedirs(work_dir, exist_ok=True)
+    with open(os.path.join(args.datadir, "manifest.json")) as manifest_file:
+        manifest = json.load(manifest_file)
+
+    results = {}
+    for target in args.targets.split(','):
+        if target not in TARGETS:
+            parser.error(f'unknown target {target}')
+        if target in INGESTERS and target not in manifest["cohorts"]:
+            results[target] = {"skipped": "no generated data"}
+            continue
+        if target == "validate" and not os.path.exists(os.path.join(work_dir, "comparison.json")):
+            results[target] = {"skipped": "needs the comparison output"}
+            continue
+
+        process = subprocess.run([sys.executable, os.path.abspath(__file__), args.datadir,
+                                  '--workdir', work_dir, '--child', target],
+                                 stdout=subprocess.PIPE, universal_newlines=True)
+        if process.returncode != 0:
+            results[target] = {"failed": f"exited with status {process.returncode}"}
+            continue
+        result = json.loads(process.stdout.strip().splitlines()[-1])
+        if "seconds" in result:
+            rows = target_rows(manifest, target, work_dir)
+            result["rows"] = rows
+            result["rows_per_s"] = round(rows / result["seconds"], 1)
+        results[target] = result
+
+    for target, result in results.items():
+        if "skipped" in result:
+            print(f'{target:>14}: skipped ({result["skipped"]})')
+            continue
+        if "failed" in result:
+            print(f'{target:>14}: FAILED ({result["failed"]})')
+            continue
+        stages = ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in result["stages"].items())
+        print(f'{target:>14}: {result["rows"]} rows, {result["rows_per_s"]:.0f} rows/s, '
+              f'{result["peak_rss_mb"]:.0f} MB peak RSS ({stages})')
+
+    report = {"patients": manifest["patients"], "results": results}
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(os.path.join(BASELINE_DIR, f"{args.save_baseline}.json"), "w") as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, f"{args.compare}.json")) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline["patients"] != manifest["patients"]:
+            print(f'Warning: baseline {args.compare} was run with {baseline["patients"]} patients')
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+    if any("failed" in result for result in results.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
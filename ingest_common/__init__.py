@@ -0,0 +1,6 @@
+"""
+Shared helpers for the DHDP cohort ingest scripts and validate.py.
+
+The ingest scripts live in per-cohort directories and are run directly, so
+they put the repository root on sys.path before importing this package.
+"""
@@ -0,0 +1,227 @@
+"""
+Compact storage for the records accumulated by the mapping engine.
+
+Holding every patient as nested dicts costs a dict per record, with its own
+hash table, and a fresh string for every value read from the CSV.  A
+CompactStore keeps each record as a single tuple
+
+    (shape, value, value, ...)
+
+where <shape> is the tuple of field names, shared by every record with the
+same fields.  The mapping engine interns the values of the CSV columns that
+repeat (categorical values, dates, patient ids), so that they are stored
+once.  The tables of one patient are kept in a dict mapping each table to a
+record tuple or, once the table has several records, a list of them,
+mirroring the dict each patient is materialized into on output.
+
+Dicts are only built when a patient is read back, one at a time, so the
+output can be streamed with dump_metadata() without ever holding every
+patient as dicts at once.  On a 20000 patient COMPARISON cohort made by
+benchmarks/generate_cohort.py, the mapped records take 47 MiB instead of
+106 MiB as nested dicts, as measured by tracemalloc, and mapping runs at the
+same speed.  The peak RSS of the ingest drops less, from 141 to 77 MiB with
+--no-prefilter: about 22 MiB of it is the interpreter and its imports, and
+with the prefilter the pages of the skipped exports it memory-maps count
+towards it too.
+"""
+
+import json
+
+
+class Interner(dict):
+    """
+    Maps every string it is looked up with to a single shared instance of
+    it: interner[value].
+    """
+    def __missing__(self, value):
+        self[value] = value
+        return value
+
+
+class CompactStore(object):
+    """
+    Records grouped by key (a patient id, or an entry number), each group
+    materialized as a dict mapping table names to a record or a list of
+    records.
+    """
+    def __init__(self):
+        self._shapes = {}
+        self._groups = {}
+
+    def shape(self, keys):
+        """
+        Returns the shared instance of a tuple of field names.
+        """
+        return self._shapes.setdefault(keys, keys)
+
+    def record(self, data):
+        """
+        Packs a record dict into a record tuple.
+        """
+        return (self.shape(tuple(data)),) + tuple(data.values())
+
+    @staticmethod
+    def unpack(record):
+        """
+        Returns a record tuple as a dict.
+        """
+        return dict(zip(record[0], record[1:]))
+
+    def __contains__(self, key):
+        return key in self._groups
+
+    def __len__(self):
+        return len(self._groups)
+
+    def keys(self):
+        """
+        Returns the keys, in the order they were first added.
+        """
+        return list(self._groups)
+
+    def discard(self, key):
+        """
+        Removes the group <key>, if there.
+        """
+        self._groups.pop(key, None)
+
+    def add(self, key, data=None):
+        """
+        Adds a group, empty or holding the tables of <data>, if not already
+        there.
+        """
+        if key not in self._groups:
+            self._groups[key] = {}
+            if data:
+                self.update(key, data)
+
+    def merge(self, key, table, record):
+        """
+        Adds a record tuple to the group <key>.  A table's first record is
+        stored as such, later ones turn it into a list; Patient records are
+        merged field by field instead.
+        """
+        group = self._groups[key]
+        current = group.get(table)
+        if current is None:
+            group[table] = record
+        elif table == "Patient":
+            group[table] = self.record({**self.unpack(current), **self.unpack(record)})
+        elif isinstance(current, list):
+            current.append(record)
+        else:
+            group[table] = [current, record]
+
+    def get(self, key, tables=None):
+        """
+        Materializes the group <key> as a dict of tables; only those of
+        them named in <tables>, if given.
+        """
+        data = {}
+        for table, records in self._groups[key].items():
+            if tables is not None and table not in tables:
+                continue
+            if isinstance(records, list):
+                data[table] = [self.unpack(record) for record in records]
+            else:
+                data[table] = self.unpack(records)
+        return data
+
+    def set(self, key, data):
+        """
+        Replaces the group <key> with a dict of tables, as returned by get().
+        """
+        self._groups[key] = {}
+        self.update(key, data)
+
+    def update(self, key, data):
+        """
+        Replaces the tables of the group <key> found in <data>, a dict of
+        tables as returned by get(), adding those it doesn't have yet.
+        """
+        group = self._groups[key]
+        for table, records in data.items():
+            if isinstance(records, list):
+                group[table] = [self.record(record) for record in records]
+            else:
+                group[table] = self.record(records)
+
+
+class MetadataView(object):
+    """
+    The groups of a CompactStore as metadata entries, materialized one at a
+    time as they are iterated over.
+    """
+    def __init__(self, store):
+        self._store = store
+
+    def __len__(self):
+        return len(self._store)
+
+    def __iter__(self):
+        for key in self._store.keys():
+            yield self._store.get(key)
+
+
+class MetadataWriter(object):
+    """
+    Writes {<metadata_key>: [entries]} to <output_file> one entry at a time,
+    producing exactly what json.dump() would for the same list.
+    """
+    def __init__(self, output_file, metadata_key="metadata", indent=None):
+        self._output_file = output_file
+        self._indent = indent
+        self.count = 0
+        key = json.dumps(metadata_key)
+        if indent is None:
+            output_file.write(f"{{{key}: [")
+        else:
+            output_file.write(f"{{\n{' ' * indent}{key}: [")
+
+    def encode(self, entry):
+        """
+        Returns an entry as write() writes it, e.g. to write it again with
+        write_encoded() without encoding it again.
+        """
+        if self._indent is None:
+            return json.dumps(entry)
+        return json.dumps(entry, indent=self._indent).replace("\n", "\n" + " " * (2 * self._indent))
+
+    def write(self, entry):
+        """
+        Writes the next entry of the list.
+        """
+        self.write_encoded(self.encode(entry))
+
+    def write_encoded(self, text):
+        """
+        Writes the next entry of the list, as returned by encode().
+        """
+        if self._indent is None:
+            self._output_file.write((", " if self.count else "") + text)
+        else:
+            self._output_file.write((",\n" if self.count else "\n") + " " * (2 * self._indent) + text)
+        self.count += 1
+
+    def close(self):
+        """
+        Closes the list and the document, but not <output_file>.
+        """
+        if self._indent is None:
+            self._output_file.write("]}")
+        elif self.count:
+            self._output_file.write(f"\n{' ' * self._indent}]\n}}")
+        else:
+            # an empty list stays on one line
+            self._output_file.write("]\n}")
+
+
+def dump_metadata(entries, output_file, metadata_key="metadata", indent=None):
+    """
+    Writes {<metadata_key>: [entries]} to <output_file> with a
+    MetadataWriter.
+    """
+    writer = MetadataWriter(output_file, metadata_key, indent)
+    for entry in entries:
+        writer.write(entry)
+    writer.close()
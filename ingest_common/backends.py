@@ -0,0 +1,140 @@
+"""
+The databases validate.py's CandigRepo can load records into.
+
+CandigRepo writes records through candig's SqlDataRepository, which only
+knows SQLite files.  Where the records end up is up to a backend, chosen
+from the --repo given:
+
+    SqliteBackend     a repo file, written in place (the default)
+    PostgresBackend   a PostgreSQL database, named by a postgresql:// URL
+
+SQLite locks the whole file for every write, so loaders writing to the
+same repo take turns.  Records bound for PostgreSQL are written to a local
+SQLite staging repo instead, as with --staged, which is verified and then
+bulk loaded table by table with COPY into a temporary table, moved over
+with INSERT ... ON CONFLICT DO NOTHING.  Loaders only share the target
+database, where they write concurrently.  The tables and indexes are
+created from those of the staging repo when missing.
+
+Connections are taken from a pool per database, shared by the backends of
+a process, so that the shards of a manifest are loaded over several
+connections at once.  PostgreSQL needs the optional psycopg2 package.
+PostgresBackend lives in ingest_common/postgres.py, only imported for a
+PostgreSQL repo.
+"""
+
+import os
+import re
+
+POSTGRES_SCHEMES = ("postgresql://", "postgres://")
+
+
+def is_postgres(repo):
+    """
+    Returns whether a --repo names a PostgreSQL database.
+    """
+    return repo.startswith(POSTGRES_SCHEMES)
+
+
+def open_backend(repo):
+    """
+    Returns the backend of a --repo: a PostgreSQL URL or a SQLite file.
+    """
+    if is_postgres(repo):
+        from ingest_common.postgres import PostgresBackend
+        return PostgresBackend(repo)
+    return SqliteBackend(repo)
+
+
+def sqlite_tables(connection):
+    """
+    Returns the names of the tables of a sqlite3 connection's database.
+    """
+    return [row[0] for row in connection.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+
+
+def drop_indexes(database):
+    """
+    Drops the indexes of a peewee SQLite <database> that don't enforce
+    uniqueness, and returns the statements recreating them.
+    """
+    indexes = [(name, sql) for name, sql in database.execute_sql(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL")
+        if not re.match(r'\s*CREATE\s+UNIQUE\b', sql, re.IGNORECASE)]
+    for name, _ in indexes:
+        database.execute_sql(f'DROP INDEX "{name}"')
+    return [sql for _, sql in indexes]
+
+
+def remove_repo(path):
+    """
+    Removes the SQLite repo at <path>, if any, with the journal files
+    SQLite keeps next to it and the staging repo of a --staged load into it.
+    """
+    for name in (path, f'{path}-journal', f'{path}-wal', f'{path}-shm', f'{path}.staging'):
+        if os.path.exists(name):
+            os.remove(name)
+
+
+class SqliteBackend(object):
+    """
+    A repo file, opened as a candig SqlDataRepository.
+    """
+    # records may be written to the repo itself
+    staged_only = False
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.repo = None
+
+    def local_path(self, suffix):
+        """
+        Returns the path of a working file of this repo, such as a staging
+        repo or a shard.
+        """
+        return f'{self.filename}.{suffix}'
+
+    def open(self, datarepo):
+        """
+        Opens the repo with the candig.server.datarepo module, creating it
+        if needed, and returns the SqlDataRepository.
+        """
+        repo = datarepo.SqlDataRepository(self.filename)
+        repo.open(datarepo.MODE_WRITE)
+
+        if not os.path.isfile(self.filename):
+            repo.initialise()
+        self.repo = repo
+        return repo
+
+    def copy_rows(self, filenames, rebuild_indexes=False):
+        """
+        Copies every row of the SQLite repos in <filenames>, which must share
+        this repo's schema, into this one.  Rows already present, such as
+        the dataset, are left alone.  With <rebuild_indexes>, the indexes
+        not enforcing uniqueness are dropped during the copy and rebuilt
+        once afterwards.
+        """
+        database = self.repo.database
+        self.repo.commit()
+        indexes = drop_indexes(database) if rebuild_indexes else []
+        for filename in filenames:
+            database.execute_sql("ATTACH DATABASE ? AS staging", (filename,))
+            for table in [row[0] for row in database.execute_sql(
+                    "SELECT name FROM staging.sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]:
+                database.execute_sql(f'INSERT OR IGNORE INTO main."{table}" SELECT * FROM staging."{table}"')
+            self.repo.commit()
+            database.execute_sql("DETACH DATABASE staging")
+        for sql in indexes:
+            database.execute_sql(sql)
+        if indexes:
+            self.repo.commit()
+
+    def close(self, keep=True):
+        self.repo.close()
+        if not keep:
+            self.repo.delete()
+
+    def __repr__(self):
+        return f"SqliteBackend({self.filename!r})"
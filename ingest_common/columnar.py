@@ -0,0 +1,206 @@
+"""
+A columnar, per-table intermediate between the ingest scripts and validate.py.
+
+Instead of one nested document per patient, write_tables() writes one file
+per CanDIG table, each record a row keyed by patientId/localId, plus a
+manifest listing the tables:
+
+    tables.json
+    {
+      "format": "columnar",
+      "metadata_key": "metadata",
+      "tables": {
+        "Patient": {"path": "Patient.parquet", "rows": 2000, "columns": [...]},
+        ...
+      }
+    }
+
+Tables are Parquet files when the optional pyarrow package is installed,
+and gzip compressed column-JSON ({"table", "rows", "columns": {column:
+[values]}}) otherwise.  Columns are stored as written, so repeated values
+compress well and a whole table is read in one go.  Missing values are
+null in either format and dropped again when the records are read back.
+Neither side holds a table as a list of records: write_tables() builds the
+columns straight from the entries, and read_tables() reads a table file
+only when its records are iterated over, building them one at a time.
+
+A table may also list "renames", {column: field name}, which read_tables()
+applies to its records.  validate.py writes the field names it suggests
+that way, to a copy of the manifest next to it, rather than rewriting the
+table files.
+"""
+
+import gzip
+import json
+import os
+
+MANIFEST = "tables.json"
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        return None
+    return pyarrow
+
+
+def _arrow_array(pyarrow, values):
+    """
+    Converts a column to an Arrow array, falling back to strings for
+    columns mixing value types.
+    """
+    try:
+        return pyarrow.array(values)
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+        return pyarrow.array([None if value is None else str(value) for value in values], type=pyarrow.string())
+
+
+def split_columns(entries):
+    """
+    Flattens per-patient metadata entries into the columns of each table,
+    in first-seen table and column order, without building the records of
+    a table first.  Records missing a patientId get the one of their entry;
+    values a record doesn't have are None.
+
+    :return: {table: {column: [values]}}
+    :rtype: dict
+    """
+    tables = {}
+    rows = {}
+    for entry in entries:
+        patient_id = entry["Patient"]["patientId"]
+        for table, records in entry.items():
+            if isinstance(records, dict):
+                records = [records]
+            columns = tables.setdefault(table, {})
+            for record in records:
+                if "patientId" not in record:
+                    record = dict(record, patientId=patient_id)
+                count = rows.get(table, 0)
+                for column in record:
+                    if column not in columns:
+                        columns[column] = [None] * count
+                for column, values in columns.items():
+                    values.append(record.get(column))
+                rows[table] = count + 1
+    return tables
+
+
+def write_tables(entries, output_dir, metadata_key="metadata"):
+    """
+    Writes <entries> as one file per table and a manifest to <output_dir>.
+
+    :param list[dict] entries: metadata entries, each with a Patient record
+    :param str output_dir: directory to write to; created if missing
+    :param str metadata_key: key the validator files the tables under
+    :return: the manifest
+    :rtype: dict
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    pyarrow = _pyarrow()
+
+    manifest = {"format": "columnar", "metadata_key": metadata_key, "tables": {}}
+    for table, columns in split_columns(entries).items():
+        names = list(columns)
+        rows = len(columns["patientId"])
+        if pyarrow:
+            path = f"{table}.parquet"
+            arrays = [_arrow_array(pyarrow, columns[column]) for column in names]
+            pyarrow.parquet.write_table(pyarrow.Table.from_arrays(arrays, names=names),
+                                        os.path.join(output_dir, path))
+        else:
+            path = f"{table}.json.gz"
+            with gzip.open(os.path.join(output_dir, path), "wt", encoding="utf-8") as table_file:
+                json.dump({"table": table, "rows": rows, "columns": columns}, table_file)
+        manifest["tables"][table] = {"path": path, "rows": rows, "columns": names}
+
+    with open(os.path.join(output_dir, MANIFEST), "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    return manifest
+
+
+def is_columnar(document):
+    """
+    Whether a parsed JSON document is a columnar table manifest.
+    """
+    return isinstance(document, dict) and document.get("format") == "columnar"
+
+
+def manifest_path(path):
+    """
+    Returns the manifest of a columnar output given either its directory or
+    the manifest itself.
+    """
+    if os.path.isdir(path):
+        return os.path.join(path, MANIFEST)
+    return path
+
+
+def _read_columns(path):
+    if path.endswith(".parquet"):
+        pyarrow = _pyarrow()
+        if pyarrow is None:
+            raise OSError(f"the pyarrow package is required to read {path}")
+        return pyarrow.parquet.read_table(path).to_pydict()
+    with gzip.open(path, "rt", encoding="utf-8") as table_file:
+        return json.load(table_file)["columns"]
+
+
+class TableRecords(object):
+    """
+    The records of one table of a columnar output.  Its length is the row
+    count of the manifest; the table file is only read when the records are
+    iterated over, one record built at a time.
+    """
+    def __init__(self, path, rows, renames=None):
+        self.path = path
+        self.rows = rows
+        self.renames = renames or {}
+
+    def __len__(self):
+        return self.rows
+
+    def __iter__(self):
+        columns = _read_columns(self.path)
+        names = [self.renames.get(column, column) for column in columns]
+        for values in zip(*columns.values()):
+            yield {name: value for name, value in zip(names, values) if value is not None}
+
+
+def read_tables(path, manifest=None):
+    """
+    Yields (table, records) for every table of a columnar output, in the
+    order they were written, the records a TableRecords.  Null values are
+    left out of the records, and columns renamed as the manifest says.
+
+    :param str path: the output directory or its manifest
+    :param dict manifest: the parsed manifest, if already read
+    """
+    path = manifest_path(path)
+    if manifest is None:
+        with open(path) as manifest_file:
+            manifest = json.load(manifest_file)
+    table_dir = os.path.dirname(os.path.abspath(path))
+
+    for table, info in manifest["tables"].items():
+        yield table, TableRecords(os.path.join(table_dir, info["path"]), info["rows"], info.get("renames"))
+
+
+def rename_columns(manifest, renames):
+    """
+    Returns a copy of <manifest> whose tables rename their columns as
+    <renames>, {table: {column: field name}}, says, on top of the renames
+    they had.
+    """
+    manifest = json.loads(json.dumps(manifest))
+    for table, table_renames in renames.items():
+        info = manifest["tables"][table]
+        # the renames apply to the fields of the records, so follow any earlier renames back to the column
+        columns = {info.get("renames", {}).get(column, column): column for column in info["columns"]}
+        merged = dict(info.get("renames", {}))
+        for field, new_name in table_renames.items():
+            merged[columns.get(field, field)] = new_name
+        info["renames"] = merged
+    return manifest
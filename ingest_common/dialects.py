@@ -0,0 +1,208 @@
+"""
+Encoding and CSV dialect detection for ingest inputs.
+
+Rave exports come as UTF-8, UTF-16 or Windows-1252 text, with or without a
+byte order mark, and cBioPortal clinical files are often tab-separated with
+"#" comment lines above the header.  sniff() looks at the first block of a
+file only and returns a CsvFormat telling how to decode and split it:
+
+    csv_format = sniff(sample)
+    with input_file.open(csv_format.encoding, errors=csv_format.errors) as csv_file:
+        for row in csv_format.reader(csv_file):
+            ...
+
+UTF-8 and Windows-1252 inputs are decoded with the "ingest-fallback" error
+handler, which decodes any byte sequence that isn't valid in the sniffed
+encoding as Windows-1252 (or Latin-1) rather than failing half way through
+a large file.
+
+The files of one export share their format, so a FormatCache sniffs the
+first file of every source (a directory or zip bundle) and reuses the
+result for files of the same kind, telling them apart by suffix and byte
+order mark.
+"""
+
+import codecs
+import csv
+import itertools
+import os
+import sys
+
+from ingest_common.streams import open_binary_input, zip_members, ZIP_MAGIC
+
+SAMPLE_SIZE = 64 * 1024
+SNIFF_LINES = 50
+DELIMITERS = ",\t;|"
+COMMENT = "#"
+FALLBACK_ERRORS = "ingest-fallback"
+
+# the UTF-32 marks first: the little endian one starts with the UTF-16 one
+BOMS = (
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16")
+)
+
+
+def _fallback(error):
+    """
+    Decodes the bytes <error> is about as Windows-1252, or as Latin-1 for
+    the few bytes Windows-1252 leaves undefined.
+    """
+    if not isinstance(error, UnicodeDecodeError):
+        raise error
+    text = "".join(bytes([byte]).decode("cp1252", "ignore") or chr(byte)
+                   for byte in error.object[error.start:error.end])
+    return text, error.end
+
+
+codecs.register_error(FALLBACK_ERRORS, _fallback)
+
+
+class CsvFormat(object):
+    """
+    How to decode and split one CSV input.
+    """
+    def __init__(self, encoding="utf-8", delimiter=","):
+        """
+        Parameters
+        ==========
+        encoding: string
+            The codec the input is decoded with.
+        delimiter: string
+            The field delimiter.
+
+        """
+        self.encoding = encoding
+        self.delimiter = delimiter
+
+    @property
+    def errors(self):
+        """
+        The error handler to decode the input with.
+        """
+        if self.encoding in ("utf-8", "utf-8-sig", "cp1252"):
+            return FALLBACK_ERRORS
+        return "strict"
+
+    @property
+    def dialect(self):
+        if self.delimiter == ",":
+            return csv.excel
+        if self.delimiter == "\t":
+            return csv.excel_tab
+        return type("sniffed", (csv.excel,), {"delimiter": self.delimiter})
+
+    def lines(self, text_file):
+        """
+        Returns the lines of an open input, leading comment lines excepted.
+        """
+        return itertools.dropwhile(lambda line: line.startswith(COMMENT), text_file)
+
+    def reader(self, text_file):
+        """
+        Returns a csv.DictReader over an open input.
+        """
+        return csv.DictReader(self.lines(text_file), dialect=self.dialect)
+
+    def row_reader(self, text_file):
+        """
+        Returns a csv.reader over an open input.
+        """
+        return csv.reader(self.lines(text_file), dialect=self.dialect)
+
+    def __repr__(self):
+        return f"CsvFormat({self.encoding!r}, {self.delimiter!r})"
+
+
+def sniff_encoding(sample):
+    """
+    Returns the encoding of a file starting with the bytes <sample>: the one
+    its byte order mark names, else UTF-8 if the sample is valid UTF-8, and
+    Windows-1252 otherwise.
+    """
+    for bom, encoding in BOMS:
+        if sample.startswith(bom):
+            return encoding
+    try:
+        # not final: the sample may end in the middle of a character
+        codecs.getincrementaldecoder("utf-8")().decode(sample, False)
+    except UnicodeDecodeError:
+        return "cp1252"
+    return "utf-8"
+
+
+def sniff_delimiter(lines):
+    """
+    Returns the field delimiter of a CSV file starting with <lines>, or ","
+    if it can't tell.
+    """
+    if not lines:
+        return ","
+    try:
+        delimiter = csv.Sniffer().sniff("".join(lines), DELIMITERS).delimiter
+    except csv.Error:
+        return ","
+    # the header of a multi-column file holds the delimiter
+    if delimiter not in lines[0]:
+        return ","
+    return delimiter
+
+
+def sniff(sample):
+    """
+    Returns the CsvFormat of a file starting with the bytes <sample>.
+    """
+    encoding = sniff_encoding(sample)
+    text = codecs.getincrementaldecoder(encoding)("replace").decode(sample, False)
+    lines = text.splitlines(keepends=True)
+    if len(sample) >= SAMPLE_SIZE and lines:
+        # the last line may be cut short
+        lines.pop()
+    lines = list(itertools.islice((line for line in lines if not line.startswith(COMMENT)), SNIFF_LINES))
+    return CsvFormat(encoding, sniff_delimiter(lines))
+
+
+def sniff_input(path):
+    """
+    Returns the CsvFormat of the input at <path>, as opened by
+    streams.open_input(); "-" is standard input, peeked at without being
+    consumed.
+    """
+    if path == "-":
+        return sniff(sys.stdin.buffer.peek(SAMPLE_SIZE)[:SAMPLE_SIZE])
+    with open(path, "rb") as raw_file:
+        magic = raw_file.read(len(ZIP_MAGIC))
+    if magic == ZIP_MAGIC:
+        members = list(zip_members(path))
+        if len(members) == 1:
+            with members[0].open_binary() as binary_file:
+                return sniff(binary_file.read(SAMPLE_SIZE))
+    with open_binary_input(path) as binary_file:
+        return sniff(binary_file.read(SAMPLE_SIZE))
+
+
+class FormatCache(object):
+    """
+    The CsvFormat of every kind of input seen so far, per source.
+    """
+    def __init__(self):
+        self._formats = {}
+
+    def format_of(self, input_file):
+        """
+        Returns the CsvFormat of a streams.InputFile, sniffing it unless a
+        file of the same source, suffix and byte order mark was sniffed
+        before.
+        """
+        name = input_file.member or input_file.path
+        source = input_file.path if input_file.member else os.path.dirname(input_file.path)
+        with input_file.open_binary() as binary_file:
+            head = binary_file.read(len(codecs.BOM_UTF32_LE))
+            bom = next((bom for bom, _ in BOMS if head.startswith(bom)), b"")
+            key = (source, os.path.splitext(name)[1].lower(), bom)
+            if key not in self._formats:
+                self._formats[key] = sniff(head + binary_file.read(SAMPLE_SIZE - len(head)))
+        return self._formats[key]
@@ -0,0 +1,111 @@
+"""
+Record fingerprints for diff-based loads.
+
+A fingerprint is the sha256 of a record's canonical JSON (sorted keys, no
+whitespace), so two records with the same fields and values have the same
+fingerprint whatever their key order.  A FingerprintStore keeps the
+fingerprint of every record loaded into a repo, keyed by table and localId,
+in a small sqlite database next to it.  Comparing an incoming record against
+the store tells whether it has to be inserted, updated or can be left alone,
+and the records not seen during a load are the ones to delete.  A second
+record with the localId of one already planned in the same load is a
+DUPLICATE.
+"""
+
+import hashlib
+import json
+import sqlite3
+
+INSERT, UPDATE, UNCHANGED, DUPLICATE = "insert", "update", "unchanged", "duplicate"
+
+
+def fingerprint(record):
+    """
+    Returns the hex sha256 of the canonical JSON form of <record>.
+    """
+    canonical = json.dumps(record, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class FingerprintStore(object):
+    """
+    The fingerprints of the records in one repo.
+
+    Every record planned during a load is marked as seen; begin() clears the
+    marks, so that after a complete load unseen() lists the records that
+    have disappeared from the input.  A resumed load keeps the marks of the
+    run it resumes, but only tells duplicates among the records it plans
+    itself.
+    """
+    def __init__(self, path):
+        """
+        Parameters
+        ==========
+        path: string
+            The sqlite database holding the fingerprints; created if missing.
+
+        """
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.execute("CREATE TABLE IF NOT EXISTS fingerprints ("
+                         "tbl TEXT NOT NULL, local_id TEXT NOT NULL, fingerprint TEXT NOT NULL, "
+                         "seen INTEGER NOT NULL DEFAULT 1, PRIMARY KEY (tbl, local_id))")
+        self._db.commit()
+        # (table, localId) -> the plan of every record planned in this run
+        self._planned = {}
+
+    def begin(self):
+        """
+        Starts a new load: no record has been seen yet.
+        """
+        self._db.execute("UPDATE fingerprints SET seen = 0")
+        self._db.commit()
+        self._planned = {}
+
+    def plan(self, table, local_id, record_fingerprint):
+        """
+        Marks a record as seen and returns what has to be done with it:
+        INSERT, UPDATE or UNCHANGED, or DUPLICATE if a record with the same
+        localId was planned before.
+        """
+        key = (table, local_id)
+        if key in self._planned:
+            return DUPLICATE
+        row = self._db.execute("SELECT fingerprint FROM fingerprints WHERE tbl = ? AND local_id = ?",
+                               key).fetchone()
+        if row is None:
+            plan = INSERT
+        else:
+            self._db.execute("UPDATE fingerprints SET seen = 1 WHERE tbl = ? AND local_id = ?", key)
+            plan = UNCHANGED if row[0] == record_fingerprint else UPDATE
+        self._planned[key] = plan
+        return plan
+
+    def planned(self, table, local_id):
+        """
+        Returns the plan of the first record planned with a localId, or None.
+        """
+        return self._planned.get((table, local_id))
+
+    def record(self, table, local_id, record_fingerprint):
+        """
+        Stores the fingerprint of a record that was written to the repo.
+        """
+        self._db.execute("INSERT OR REPLACE INTO fingerprints (tbl, local_id, fingerprint, seen) "
+                         "VALUES (?, ?, ?, 1)", (table, local_id, record_fingerprint))
+
+    def unseen(self):
+        """
+        Returns (table, localId) of every record not seen since begin().
+        """
+        return self._db.execute("SELECT tbl, local_id FROM fingerprints WHERE seen = 0").fetchall()
+
+    def forget(self, table, local_id):
+        self._db.execute("DELETE FROM fingerprints WHERE tbl = ? AND local_id = ?", (table, local_id))
+
+    def commit(self):
+        self._db.commit()
+
+    def close(self):
+        self._db.commit()
+        self._db.close()
@@ -0,0 +1,707 @@
+"""
+Declarative mapping specs for the cohort ingest scripts.
+
+A spec is a JSON (or YAML, when PyYAML is installed) document describing how
+the CSV rows of one cohort export map onto the CanDIGv1 tables.  E.g.:
+
+    {
+      "version": 1,
+      "patient_column": "Subject",
+      "section_column": "DataPageName",
+      "counters": {"scope": "table", "tables": ["Outcome"],
+                   "local_id": "{@patient}_{@table}_{@count}"},
+      "sections": {
+        "death": [
+          {"table": "Outcome", "fields": {
+            "patientId": "Subject",
+            "vitalStatus": {"const": "Dead"},
+            "dateOfAssessment": {"transform": "date_from_datetime", "args": ["DTH_DT"]}
+          }}
+        ]
+      }
+    }
+
+means that every row of the "death" DataPage adds an Outcome record to the
+patient named in the Subject column.  A field value is either a CSV column
+name, a constant, a named transform from ingest_common.transforms applied to
+one or more columns, or a template.  Templates substitute CSV columns
+({Subject}) and the engine variables {@patient}, {@section} (the section
+name with spaces replaced by underscores), {@table} (the lowercased table
+name) and {@count}.  Transforms declared pure are memoized by each engine.
+
+Counters number the records of each patient, either per table ("scope":
+"table", incremented before every record of a listed table) or per section
+("scope": "section", incremented after every row of a section that uses a
+template).
+
+With stable ids, {@count} is instead a hash of the patient, the counter
+key and the row's "row_key" columns (e.g. Rave's RecordId), so that a
+record gets the same localId whatever order the files are read in, and
+files can be mapped independently.  Rows lacking the row key columns are
+keyed by their whole content.
+
+Specs without a section column list their mappings under "records" instead
+of "sections"; every CSV row then becomes its own metadata entry.
+
+The engine keeps what it maps in a CompactStore (see accumulator.py):
+records are tuples sharing their field names.  Patients are materialized as
+dicts one at a time, by patient_data() or when iterating over metadata().
+
+Each table mapping is turned into a function building its record tuple
+straight from a row, out of one closure per field; templates become
+str.format() strings, filled in from an operator.itemgetter() of their
+columns.  The first LEARN_RECORDS
+records it builds intern every column value, counting the values seen for
+the first time; from then on only the columns whose values mostly repeat
+are interned, so unique ids and free text don't pay for it.
+
+Compiling a spec validates it and reduces it to a plan made of plain tuples.
+The plan is pickled in a cache directory under the hash of the spec, so
+later runs skip both validation and compilation.
+"""
+
+import functools
+import hashlib
+import json
+import operator
+import os
+import pickle
+import string
+import time
+
+from ingest_common.accumulator import CompactStore, Interner, MetadataView
+from ingest_common.transforms import TRANSFORMS
+
+# bump whenever the layout of a compiled plan changes, so stale cache
+# entries are ignored
+ENGINE_VERSION = 2
+
+COLUMN, CONST, TRANSFORM, TEMPLATE = range(4)
+ENGINE_VARIABLES = ("patient", "section", "table", "count")
+
+# records a table mapping builds before deciding which columns to intern
+LEARN_RECORDS = 1000
+
+
+class MappingSpecError(ValueError):
+    """
+    Raised when a mapping spec is malformed.
+    """
+
+
+def default_cache_dir():
+    """
+    Returns the directory compiled plans are cached in.
+    """
+    return os.environ.get("DHDP_INGEST_CACHE",
+                          os.path.join(os.path.expanduser("~"), ".cache", "dhdp_ingest"))
+
+
+def read_spec(spec_bytes, spec_path=""):
+    """
+    Parses the raw contents of a spec file.
+
+    :param bytes spec_bytes: contents of the spec file
+    :param str spec_path: name of the spec file, used to pick the parser
+    :return: the parsed spec
+    :rtype: dict
+    """
+    if spec_path.endswith((".yaml", ".yml")):
+        try:
+            import yaml
+        except ImportError:
+            raise MappingSpecError(f"PyYAML is required to read {spec_path}")
+        return yaml.safe_load(spec_bytes)
+    return json.loads(spec_bytes)
+
+
+def _compile_template(template, where):
+    parts = []
+    try:
+        parsed = list(string.Formatter().parse(template))
+    except ValueError as e:
+        raise MappingSpecError(f"{where}: bad template {template!r}: {e}")
+
+    for literal, name, _, _ in parsed:
+        if name is None:
+            parts.append((literal, None, None))
+        elif name.startswith("@"):
+            if name[1:] not in ENGINE_VARIABLES:
+                raise MappingSpecError(f"{where}: unknown template variable {name!r}")
+            parts.append((literal, True, name[1:]))
+        else:
+            parts.append((literal, False, name))
+    return tuple(parts)
+
+
+def _compile_field(value, where):
+    if isinstance(value, str):
+        return COLUMN, value
+    if not isinstance(value, dict) or len(value.keys() & {"const", "transform", "template"}) != 1:
+        raise MappingSpecError(f"{where}: expected a column name or one of const/transform/template")
+
+    if "const" in value:
+        return CONST, value["const"]
+    if "template" in value:
+        return TEMPLATE, _compile_template(value["template"], where)
+
+    name = value["transform"]
+    if name not in TRANSFORMS:
+        raise MappingSpecError(f"{where}: unknown transform {name!r}")
+    args = value.get("args", [])
+    if not isinstance(args, list) or not all(isinstance(arg, str) for arg in args):
+        raise MappingSpecError(f"{where}: transform args must be a list of column names")
+    return TRANSFORM, (name, tuple(args))
+
+
+def _compile_records(records, counted_tables, where):
+    if not isinstance(records, list):
+        raise MappingSpecError(f"{where}: expected a list of table mappings")
+
+    compiled = []
+    for i, record in enumerate(records):
+        record_where = f"{where}[{i}]"
+        if not isinstance(record, dict) or not isinstance(record.get("table"), str) \
+                or not isinstance(record.get("fields"), dict):
+            raise MappingSpecError(f"{record_where}: expected a table name and a fields mapping")
+        fields = tuple((key, *_compile_field(value, f"{record_where}.{key}"))
+                       for key, value in record["fields"].items())
+        compiled.append((record["table"], record["table"] in counted_tables, fields))
+    return tuple(compiled)
+
+
+def _uses_template(records):
+    return any(kind == TEMPLATE for _, _, fields in records for _, kind, _ in fields)
+
+
+def compile_spec(spec):
+    """
+    Validates a parsed spec and compiles it into a mapping plan.
+
+    :param dict spec: the parsed spec
+    :return: the compiled plan, made only of picklable builtins
+    :rtype: dict
+    """
+    if not isinstance(spec, dict) or spec.get("version") != 1:
+        raise MappingSpecError("spec must be a mapping with \"version\": 1")
+    if ("sections" in spec) == ("records" in spec):
+        raise MappingSpecError("spec must have exactly one of \"sections\" or \"records\"")
+    if "sections" in spec and not spec.get("section_column"):
+        raise MappingSpecError("a sectioned spec needs a \"section_column\"")
+    if not spec.get("patient_column"):
+        raise MappingSpecError("spec needs a \"patient_column\"")
+
+    counters = spec.get("counters", {})
+    scope = counters.get("scope")
+    if scope not in (None, "table", "section"):
+        raise MappingSpecError(f"unknown counter scope {scope!r}")
+    counted_tables = frozenset(counters.get("tables", []))
+    row_key = spec.get("row_key", [])
+    if not isinstance(row_key, list) or not all(isinstance(column, str) for column in row_key):
+        raise MappingSpecError("\"row_key\" must be a list of column names")
+    local_id = None
+    if counters.get("local_id"):
+        local_id = _compile_template(counters["local_id"], "counters.local_id")
+
+    plan = {
+        "engine_version": ENGINE_VERSION,
+        "patient_column": spec["patient_column"],
+        "section_column": spec.get("section_column"),
+        "keep_unmapped_patients": bool(spec.get("keep_unmapped_patients", False)),
+        "counter_scope": scope,
+        "counted_tables": counted_tables,
+        "local_id": local_id,
+        "row_key": tuple(row_key),
+        "sections": None,
+        "records": None
+    }
+
+    if "records" in spec:
+        plan["records"] = _compile_records(spec["records"], counted_tables, "records")
+    else:
+        if not isinstance(spec["sections"], dict):
+            raise MappingSpecError("\"sections\" must map section names to table mappings")
+        plan["sections"] = {}
+        for section, records in spec["sections"].items():
+            compiled = _compile_records(records, counted_tables, f"sections.{section}")
+            plan["sections"][section.strip().lower()] = (_uses_template(compiled), compiled)
+
+    return plan
+
+
+def load_plan(spec_path, cache_dir=None):
+    """
+    Loads the compiled plan for a spec file, compiling and caching it
+    if the spec has not been seen before.
+
+    :param str spec_path: path to the JSON or YAML spec
+    :param str cache_dir: where compiled plans are kept; see default_cache_dir()
+    :return: the compiled plan
+    :rtype: dict
+    """
+    with open(spec_path, "rb") as spec_file:
+        spec_bytes = spec_file.read()
+
+    digest = hashlib.sha256(spec_bytes + f":{ENGINE_VERSION}".encode()).hexdigest()
+    cache_path = os.path.join(cache_dir or default_cache_dir(), f"{digest}.plan")
+
+    try:
+        with open(cache_path, "rb") as plan_file:
+            return pickle.load(plan_file)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        pass
+
+    plan = compile_spec(read_spec(spec_bytes, spec_path))
+
+    # the cache is only an optimization; a read-only home directory
+    # must not stop the ingest
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as plan_file:
+            pickle.dump(plan, plan_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
+
+    return plan
+
+
+def _record_columns(records):
+    columns = []
+    for _, _, fields in records:
+        for _, kind, arg in fields:
+            if kind == COLUMN:
+                names = [arg]
+            elif kind == TRANSFORM:
+                names = list(arg[1])
+            elif kind == TEMPLATE:
+                names = [name for _, is_var, name in arg if is_var is False]
+            else:
+                names = []
+            columns.extend(name for name in names if name not in columns)
+    return columns
+
+
+def required_columns(plan):
+    """
+    Lists the CSV columns a plan reads, in the order they are first used.
+
+    :param dict plan: a compiled plan
+    :return: maps each section name to its columns; flat plans use the key None
+    :rtype: dict[str | None, list[str]]
+    """
+    if plan["records"] is not None:
+        return {None: _record_columns(plan["records"])}
+    return {section: _record_columns(records)
+            for section, (_, records) in plan["sections"].items()}
+
+
+def _bind_transform(name, transforms):
+    """
+    Returns the transform <name>, memoized if it is declared pure; the
+    functions are kept in <transforms>, so that every field using a
+    transform shares its memo.
+    """
+    if name not in transforms:
+        function = TRANSFORMS[name]
+        memo_size = getattr(function, "memo_size", None)
+        if memo_size:
+            function = functools.lru_cache(maxsize=memo_size)(function)
+        transforms[name] = function
+    return transforms[name]
+
+
+class _RecordBuilder(object):
+    """
+    Builds the record tuples of one table mapping: build(row, patient_id,
+    count) returns the record of <row>, <count> being the value of {@count}.
+    """
+    def __init__(self, table, section, counted, fields, local_id, shape, patient_column, strings):
+        self._fields = fields
+        self._local_id = local_id if counted else None
+        self._shape = shape
+        self._patient_column = patient_column
+        self._strings = strings
+        self._variables = {"section": section.replace(" ", "_"), "table": table.lower()}
+        self._columns = [i for i, (_, kind, arg) in enumerate(fields)
+                         if kind == COLUMN and arg != patient_column]
+        self._new = [0] * len(fields)
+        self._built = 0
+        self._learner = self._generate(learning=True)
+        self.build = self._learn
+
+    def _learn(self, row, patient_id, count):
+        record = self._learner(row, patient_id, count)
+        self._built += 1
+        if self._built == LEARN_RECORDS:
+            self.build = self._generate(interned={i for i in self._columns
+                                                  if 2 * self._new[i] <= LEARN_RECORDS})
+        return record
+
+    def _note(self, i, value):
+        """
+        Interns the value of field <i>, counting it if it is new.
+        """
+        shared = self._strings.get(value)
+        if shared is None:
+            self._new[i] += 1
+            shared = self._strings[value]
+        return shared
+
+    def _template(self, parts):
+        """
+        Returns the function filling a template in, as a str.format()
+        string whose fields 0 and 1 are the patient id and the count, and
+        2 onwards the columns.
+        """
+        pattern = ""
+        columns = []
+        for literal, is_var, name in parts:
+            if is_var and name in self._variables:
+                literal += self._variables[name]
+            pattern += literal.replace("{", "{{").replace("}", "}}")
+            if is_var is None or is_var and name in self._variables:
+                continue
+            if is_var:
+                pattern += "{0}" if name == "patient" else "{1}"
+            else:
+                pattern += f"{{{len(columns) + 2}}}"
+                columns.append(name)
+
+        fill = pattern.format
+        if not columns:
+            return lambda row, patient_id, count: fill(patient_id, count)
+        if len(columns) == 1:
+            column, = columns
+            return lambda row, patient_id, count: fill(patient_id, count, row[column])
+        get_columns = operator.itemgetter(*columns)
+        return lambda row, patient_id, count: fill(patient_id, count, *get_columns(row))
+
+    def _value(self, i, kind, arg, learning, interned):
+        """
+        Returns the function computing field <i> from (row, patient_id,
+        count).
+        """
+        if kind == COLUMN:
+            if arg == self._patient_column:
+                # the same value as the patient id, interned already
+                return lambda row, patient_id, count: patient_id
+            if learning:
+                note = self._note
+                return lambda row, patient_id, count: note(i, row[arg])
+            if i in interned:
+                strings = self._strings
+                return lambda row, patient_id, count: strings[row[arg]]
+            return lambda row, patient_id, count: row[arg]
+        if kind == CONST:
+            return lambda row, patient_id, count: arg
+        if kind == TRANSFORM:
+            # memoized transforms return shared values already
+            function, columns = arg
+            if len(columns) == 1:
+                column, = columns
+                return lambda row, patient_id, count: function(row[column]) if column in row else function()
+            return lambda row, patient_id, count: function(*[row[column] for column in columns if column in row])
+        return self._template(arg)
+
+    def _generate(self, learning=False, interned=()):
+        """
+        Returns the function building the records, interning every column
+        while <learning>, or else those in <interned>.
+        """
+        getters = [self._value(i, kind, arg, learning, interned)
+                   for i, (_, kind, arg) in enumerate(self._fields)]
+        if self._local_id:
+            getters.append(self._template(self._local_id))
+        return _builder(self._shape, getters)
+
+
+def _builder(shape, getters):
+    """
+    Returns build(row, patient_id, count), calling each of <getters> for a
+    field of the record; most tables have a handful of fields, called
+    without a loop.
+    """
+    if len(getters) == 2:
+        first, second = getters
+        return lambda row, patient_id, count: (shape, first(row, patient_id, count),
+                                               second(row, patient_id, count))
+    if len(getters) == 3:
+        first, second, third = getters
+        return lambda row, patient_id, count: (shape, first(row, patient_id, count),
+                                               second(row, patient_id, count), third(row, patient_id, count))
+    if len(getters) == 4:
+        first, second, third, fourth = getters
+        return lambda row, patient_id, count: (shape, first(row, patient_id, count),
+                                               second(row, patient_id, count), third(row, patient_id, count),
+                                               fourth(row, patient_id, count))
+    getters = tuple(getters)
+    return lambda row, patient_id, count: (shape, *[getter(row, patient_id, count) for getter in getters])
+
+
+def _bind_records(records, section, local_id, store, transforms, patient_column, strings):
+    bound = []
+    for table, counted, fields in records:
+        bound_fields = []
+        for key, kind, arg in fields:
+            if kind == TRANSFORM:
+                arg = (_bind_transform(arg[0], transforms), arg[1])
+            bound_fields.append((key, kind, arg))
+        shape = tuple(key for key, _, _ in fields)
+        if counted and local_id:
+            shape += ("localId",)
+        builder = _RecordBuilder(table, section, counted, tuple(bound_fields), local_id, store.shape(shape),
+                                 patient_column, strings)
+        bound.append((table, counted, builder))
+    return tuple(bound)
+
+
+class MappingEngine(object):
+    """
+    Applies a compiled plan to CSV rows, accumulating the CanDIGv1
+    records of every patient.
+    """
+    def __init__(self, plan, stable_ids=False, transforms=None):
+        """
+        Parameters
+        ==========
+        plan: dict
+            A plan returned by compile_spec() or load_plan().
+        stable_ids: bool
+            Derive {@count} from the row instead of counting records.
+        transforms: dict
+            The bound transforms of another engine on the same plan, to
+            share their memos; see fresh().
+
+        """
+        self._plan = plan
+        self._patient_column = plan["patient_column"]
+        self._section_column = plan["section_column"]
+        self._keep_unmapped_patients = plan["keep_unmapped_patients"]
+        self._counter_scope = plan["counter_scope"]
+        self._local_id = plan["local_id"]
+        self._row_key = plan["row_key"]
+        self.stable_ids = stable_ids
+        self._occurrences = {}
+        self._records = None
+        self._sections = None
+        self._store = CompactStore()
+        self._intern = Interner()
+        # the transforms of the plan, pure ones memoized
+        self._transforms = {} if transforms is None else transforms
+
+        if plan["records"] is not None:
+            self._records = _bind_records(plan["records"], "", self._local_id, self._store, self._transforms,
+                                          self._patient_column, self._intern)
+        else:
+            self._sections = {section: (increments, _bind_records(records, section, self._local_id, self._store,
+                                                                    self._transforms, self._patient_column,
+                                                                    self._intern))
+                              for section, (increments, records) in plan["sections"].items()}
+
+        self.counts = {}
+
+    def fresh(self):
+        """
+        Returns an empty engine on the same plan, sharing this one's
+        memoized transforms, e.g. to map a watched directory again without
+        loading the plan.
+        """
+        return MappingEngine(self._plan, self.stable_ids, self._transforms)
+
+    @property
+    def sections(self):
+        """
+        The names of the sections this engine maps.
+        """
+        return set(self._sections or ())
+
+    @property
+    def section_column(self):
+        return self._section_column
+
+    @property
+    def patient_column(self):
+        return self._patient_column
+
+    @property
+    def keeps_unmapped_patients(self):
+        """
+        Whether rows of unmapped sections still add their patient.
+        """
+        return self._keep_unmapped_patients
+
+    def add_patient(self, patient_id):
+        """
+        Adds a patient with no data besides its id, if not already known.
+        """
+        self._store.add(patient_id, {
+            "Patient": {
+                "patientId": patient_id
+            }
+        })
+
+    def patient_ids(self):
+        """
+        Returns the ids of the patients mapped so far, in the order they
+        were first seen.
+        """
+        return self._store.keys()
+
+    def patient_data(self, patient_id, tables=None):
+        """
+        Returns the CanDIGv1 tables of a patient as a new dict, only those
+        named in <tables> if given; changes to it are kept only once passed
+        to set_patient_data() or update_patient_data().
+        """
+        return self._store.get(patient_id, tables)
+
+    def set_patient_data(self, patient_id, data):
+        """
+        Replaces the tables of a patient.
+        """
+        self._store.set(patient_id, data)
+
+    def update_patient_data(self, patient_id, data):
+        """
+        Replaces the tables of a patient found in <data>, adding those it
+        doesn't have yet, and keeps the others.
+        """
+        self._store.update(patient_id, data)
+
+    def forget_patients(self, patient_ids):
+        """
+        Drops the records and counters of the patients in <patient_ids>, so
+        that their rows can be mapped again, e.g. after the files they came
+        from changed.  Patients mapped again come after the others.  Only
+        sectioned plans keep one entry per patient.
+        """
+        if self._records is not None:
+            raise ValueError("the entries of a flat plan aren't kept per patient")
+        patient_ids = set(patient_ids)
+        for patient_id in patient_ids:
+            self._store.discard(patient_id)
+        self.counts = {key: count for key, count in self.counts.items() if key[0] not in patient_ids}
+        self._occurrences = {key: occurrence for key, occurrence in self._occurrences.items()
+                             if key[0] not in patient_ids}
+
+    def attach_profiler(self, profiler):
+        """
+        Reports the rows seen per section and the time spent in each table
+        mapping to <profiler>.  Unprofiled engines pay nothing for this.
+        """
+        update, map_record = self.update, self._map_record
+        section_column = self._section_column
+
+        def profiled_map_record(table, counted, builder, row, patient_id, section):
+            start = time.perf_counter()
+            record = map_record(table, counted, builder, row, patient_id, section)
+            profiler.add_time(f"{section or '*'}: {table}", time.perf_counter() - start)
+            return record
+
+        def profiled_update(row):
+            profiler.count(row.get(section_column, "").strip().lower() if section_column else "*")
+            update(row)
+
+        self._map_record = profiled_map_record
+        self.update = profiled_update
+
+    def count(self, patient_id, key):
+        """
+        Returns the current value of a patient's counter for <key>, a
+        table or section name depending on the counter scope.
+        """
+        return self.counts.get((patient_id, key), 0)
+
+    def increment(self, patient_id, key):
+        """
+        Increments a patient's counter for <key> and returns the new value.
+        """
+        count = self.counts.get((patient_id, key), 0) + 1
+        self.counts[(patient_id, key)] = count
+        return count
+
+    def stable_id(self, patient_id, key, row_key):
+        """
+        Returns the stable id of the record of a patient identified by a
+        counter key (a table or section name) and a row key.
+        """
+        digest = hashlib.sha1("\x1f".join((patient_id, key, row_key)).encode("utf-8")).hexdigest()
+        return digest[:12]
+
+    def _stable_row_key(self, row, patient_id, key, table):
+        """
+        Returns the row key of <row>: its row_key columns, or a digest of its
+        content.  Identical rows are told apart by their number of
+        occurrences.
+        """
+        values = [row.get(column) for column in self._row_key]
+        if values and all(values):
+            row_key = "\x1f".join(values)
+        else:
+            content = "\x1f".join(f"{column}={value}" for column, value in sorted(row.items(), key=str))
+            row_key = hashlib.sha1(content.encode("utf-8")).hexdigest()
+        occurrence = self._occurrences.get((patient_id, key, table, row_key), 0) + 1
+        self._occurrences[(patient_id, key, table, row_key)] = occurrence
+        if occurrence > 1:
+            row_key += f"#{occurrence}"
+        return row_key
+
+    def _map_record(self, table, counted, builder, row, patient_id, section):
+        count = None
+        if self.stable_ids and (self._counter_scope == "section" or counted and self._counter_scope == "table"):
+            key = table if self._counter_scope == "table" else section
+            count = self.stable_id(patient_id, key, self._stable_row_key(row, patient_id, section, table))
+        elif counted and self._counter_scope == "table":
+            count = self.increment(patient_id, table)
+        elif self._counter_scope == "section":
+            count = self.count(patient_id, section)
+        return builder.build(row, patient_id, count)
+
+    def update(self, row):
+        """
+        Maps one CSV row.  Sectioned plans merge the result into the data
+        of the row's patient; flat plans add a new metadata entry.
+
+        :param dict[str, str] row: maps each CSV fieldname to its value in a CSV row
+        :return: None
+        """
+        if self._records is not None:
+            entry = len(self._store)
+            self._store.add(entry)
+            patient_id = self._intern[row[self._patient_column]]
+            for table, counted, builder in self._records:
+                self._store.merge(entry, table, self._map_record(table, counted, builder, row, patient_id, ""))
+            return
+
+        section = row[self._section_column].strip().lower()
+        mapping = self._sections.get(section)
+        if mapping is None and not self._keep_unmapped_patients:
+            return
+
+        patient_id = self._intern[row[self._patient_column]]
+        self.add_patient(patient_id)
+        if mapping is None:
+            return
+
+        increments, records = mapping
+        for table, counted, builder in records:
+            self._store.merge(patient_id, table, self._map_record(table, counted, builder, row, patient_id, section))
+
+        if increments and self._counter_scope == "section":
+            self.increment(patient_id, section)
+
+    def metadata(self):
+        """
+        Returns the accumulated entries, in the order they were first seen,
+        as an iterable materializing one entry at a time.
+        """
+        return MetadataView(self._store)
+
+
+def load_engine(spec_path, cache_dir=None, stable_ids=False):
+    """
+    Returns a MappingEngine for the spec at <spec_path>.
+    """
+    return MappingEngine(load_plan(spec_path, cache_dir), stable_ids)
@@ -0,0 +1,155 @@
+"""
+A small staged pipeline with bounded queues.
+
+pipeline(source, *stages) runs the <source> iterator in a thread of its own
+and every Stage in another, connected by queues holding at most <maxsize>
+items, and yields the output of the last stage to the caller.  A stage that
+gets ahead blocks on the full queue in front of it, so memory stays bounded
+however large the input is, while reading, mapping and writing overlap:
+the caller (usually the stage writing to a database or accumulating
+results) never waits on I/O the other stages can do in the meantime.
+
+Items keep their order through every stage.  A Stage with several workers
+runs its function on a thread pool and still emits the results in order.
+An exception raised by the source or a stage is re-raised in the caller.
+
+Work through the pipeline in batches (lists of rows, one individual, ...)
+rather than single rows, or the queues cost more than they save.
+"""
+
+import collections
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_MAXSIZE = 8
+
+_DONE = object()
+_POLL_SECONDS = 0.1
+
+
+class Stage(object):
+    """
+    One step of a pipeline: <fn> applied to every item.
+    """
+    def __init__(self, fn, workers=1):
+        """
+        Parameters
+        ==========
+        fn: callable
+            Takes an item and returns the item passed to the next stage.
+        workers: int
+            How many items are processed concurrently.
+
+        """
+        self.fn = fn
+        self.workers = max(1, workers)
+
+
+class _Failure(object):
+    def __init__(self, error):
+        self.error = error
+
+
+def _put(channel, item, stop):
+    """
+    Puts <item> on <channel>, waiting for room unless the pipeline stops.
+    """
+    while not stop.is_set():
+        try:
+            channel.put(item, timeout=_POLL_SECONDS)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(channel, stop):
+    while not stop.is_set():
+        try:
+            return channel.get(timeout=_POLL_SECONDS)
+        except queue.Empty:
+            continue
+    return _DONE
+
+
+def _feed(source, outbox, stop):
+    try:
+        for item in source:
+            if not _put(outbox, item, stop):
+                return
+    except BaseException as e:
+        _put(outbox, _Failure(e), stop)
+        return
+    _put(outbox, _DONE, stop)
+
+
+def _run_stage(stage, inbox, outbox, stop):
+    executor = None
+    if stage.workers > 1:
+        executor = ThreadPoolExecutor(max_workers=stage.workers)
+    pending = collections.deque()
+    try:
+        while True:
+            item = _get(inbox, stop)
+            if item is _DONE or isinstance(item, _Failure):
+                while pending:
+                    _put(outbox, pending.popleft().result(), stop)
+                _put(outbox, item, stop)
+                return
+            if executor is None:
+                _put(outbox, stage.fn(item), stop)
+                continue
+            pending.append(executor.submit(stage.fn, item))
+            # keep every worker busy, but no more items in flight than that
+            if len(pending) >= 2 * stage.workers:
+                _put(outbox, pending.popleft().result(), stop)
+    except BaseException as e:
+        _put(outbox, _Failure(e), stop)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+def pipeline(source, *stages, maxsize=DEFAULT_MAXSIZE):
+    """
+    Yields the items of <source> passed through <stages>, in order.
+
+    :param source: iterable of items, read in a thread of its own
+    :param stages: Stage instances applied one after the other
+    :param int maxsize: capacity of each queue between two steps
+    """
+    stop = threading.Event()
+    channels = [queue.Queue(maxsize) for _ in range(len(stages) + 1)]
+    threads = [threading.Thread(target=_feed, args=(source, channels[0], stop), daemon=True)]
+    for index, stage in enumerate(stages):
+        threads.append(threading.Thread(target=_run_stage, args=(stage, channels[index], channels[index + 1], stop),
+                                        daemon=True))
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            item = channels[-1].get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        # unblocks the threads if the caller stops early or fails
+        stop.set()
+
+
+def batched(iterable, size):
+    """
+    Yields lists of up to <size> consecutive items of <iterable>.
+    """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,223 @@
+"""
+PostgreSQL databases as validate.py repos; see backends.py.
+
+Records are loaded from SQLite staging repos: every table is sent with COPY
+into a temporary table and moved over with INSERT ... ON CONFLICT DO
+NOTHING, and the tables and indexes missing from the database are created
+from the staging repo's, with the PostgreSQL type of each SQLite column's
+affinity.
+"""
+
+import concurrent.futures
+import contextlib
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+
+from ingest_common.backends import sqlite_tables
+from ingest_common.pipeline import batched
+
+# connections per database, and rows sent per COPY
+POOL_SIZE = 4
+COPY_BATCH = 10000
+
+# held while creating tables, so that loaders starting together don't race
+SCHEMA_LOCK_KEY = 0x43616e444947
+
+_INDEX_PREFIX = re.compile(r'\s*CREATE\s+(UNIQUE\s+)?INDEX\s+(IF\s+NOT\s+EXISTS\s+)?', re.IGNORECASE)
+
+
+def _psycopg2():
+    try:
+        import psycopg2
+        import psycopg2.pool
+    except ImportError:
+        raise OSError("the psycopg2 package is required for PostgreSQL repos")
+    return psycopg2
+
+
+def _postgres_type(declared):
+    """
+    Returns the PostgreSQL type of a SQLite column, by the affinity SQLite
+    gives its declared type.
+    """
+    declared = declared.upper()
+    if "INT" in declared:
+        return "BIGINT"
+    if "CHAR" in declared or "CLOB" in declared or "TEXT" in declared or not declared:
+        return "TEXT"
+    if "BLOB" in declared:
+        return "BYTEA"
+    if "REAL" in declared or "FLOA" in declared or "DOUB" in declared:
+        return "DOUBLE PRECISION"
+    if "NUM" in declared or "DEC" in declared:
+        return "NUMERIC"
+    # DATETIME, BOOLEAN, ...: peewee stores those as text or integers
+    return "TEXT"
+
+
+def _copy_value(value):
+    """
+    Returns a value as a field of COPY's text format.
+    """
+    if value is None:
+        return "\\N"
+    if isinstance(value, bytes):
+        return "\\\\x" + value.hex()
+    if isinstance(value, str):
+        return value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+    return str(value)
+
+
+class _CopyBuffer(object):
+    """
+    A file-like object over rows, read by COPY ... FROM STDIN in text format.
+    """
+    def __init__(self, rows):
+        self._lines = ("\t".join(_copy_value(value) for value in row) + "\n" for row in rows)
+        self._pending = ""
+
+    def read(self, size=-1):
+        # joined once per read: only the end of the last line is left over
+        parts = [self._pending]
+        length = len(self._pending)
+        while size < 0 or length < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            parts.append(line)
+            length += len(line)
+        data = "".join(parts)
+        if 0 <= size < length:
+            data, self._pending = data[:size], data[size:]
+        else:
+            self._pending = ""
+        return data
+
+
+class PostgresBackend(object):
+    """
+    A PostgreSQL database, loaded from SQLite staging repos.
+    """
+    # records are always staged locally first
+    staged_only = True
+
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(self, url, staging_dir=None):
+        """
+        Parameters
+        ==========
+        url: string
+            The postgresql:// URL of the database.
+        staging_dir: string
+            Where staging repos are kept; the temp directory by default.
+
+        """
+        self.url = url
+        self.repo = None
+        self._staging_dir = staging_dir or tempfile.gettempdir()
+
+    def local_path(self, suffix):
+        return os.path.join(self._staging_dir, f'candig-repo-{os.getpid()}.{suffix}')
+
+    def _pool(self):
+        with self._pools_lock:
+            if self.url not in self._pools:
+                self._pools[self.url] = _psycopg2().pool.ThreadedConnectionPool(1, POOL_SIZE, self.url)
+            return self._pools[self.url]
+
+    @contextlib.contextmanager
+    def connection(self):
+        """
+        Lends a pooled connection, committing what was done with it, or
+        rolling it back on error.
+        """
+        pool = self._pool()
+        connection = pool.getconn()
+        try:
+            yield connection
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+        finally:
+            pool.putconn(connection)
+
+    def open(self, datarepo):
+        """
+        Checks that the database can be reached; records are written to
+        staging repos, so there is no SqlDataRepository to return.
+        """
+        with self.connection():
+            pass
+        return None
+
+    def create_schema(self, filename):
+        """
+        Creates the tables and indexes of the SQLite repo <filename> that the
+        database doesn't have yet.
+        """
+        source = sqlite3.connect(filename)
+        try:
+            with self.connection() as connection, connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_LOCK_KEY,))
+                for table in sqlite_tables(source):
+                    columns = source.execute(f'PRAGMA table_info("{table}")').fetchall()
+                    definitions = [f'"{name}" {_postgres_type(declared)}' + (" NOT NULL" if not_null else "")
+                                   for _, name, declared, not_null, _, _ in columns]
+                    key = [name for _, name, _, _, _, pk in sorted(columns, key=lambda column: column[5]) if pk]
+                    if key:
+                        definitions.append("PRIMARY KEY (" + ", ".join(f'"{name}"' for name in key) + ")")
+                    cursor.execute(f'CREATE TABLE IF NOT EXISTS "{table}" ({", ".join(definitions)})')
+                for (sql,) in source.execute(
+                        "SELECT sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL"):
+                    cursor.execute(_INDEX_PREFIX.sub(
+                        lambda match: f"CREATE {match.group(1) or ''}INDEX IF NOT EXISTS ", sql, count=1))
+        finally:
+            source.close()
+
+    def _copy_file(self, filename):
+        source = sqlite3.connect(filename)
+        try:
+            with self.connection() as connection, connection.cursor() as cursor:
+                for number, table in enumerate(sqlite_tables(source)):
+                    names = [row[1] for row in source.execute(f'PRAGMA table_info("{table}")')]
+                    columns = ", ".join(f'"{name}"' for name in names)
+                    temp_table = f"staging_{number}"
+                    cursor.execute(f'CREATE TEMPORARY TABLE {temp_table} '
+                                   f'(LIKE "{table}" INCLUDING DEFAULTS) ON COMMIT DROP')
+                    rows = source.execute(f'SELECT {columns} FROM "{table}"')
+                    for chunk in batched(rows, COPY_BATCH):
+                        cursor.copy_expert(f"COPY {temp_table} ({columns}) FROM STDIN", _CopyBuffer(chunk))
+                    cursor.execute(f'INSERT INTO "{table}" ({columns}) SELECT {columns} FROM {temp_table} '
+                                   f'ON CONFLICT DO NOTHING')
+        finally:
+            source.close()
+
+    def copy_rows(self, filenames, rebuild_indexes=False):
+        """
+        Copies every row of the SQLite repos in <filenames> into the
+        database, each in a single transaction and over its own pooled
+        connection.  Rows already present are left alone.  The indexes are
+        kept, as other loaders may be using them.
+        """
+        if not filenames:
+            return
+        self.create_schema(filenames[0])
+        with concurrent.futures.ThreadPoolExecutor(min(POOL_SIZE, len(filenames))) as executor:
+            for _ in executor.map(self._copy_file, filenames):
+                pass
+
+    def close(self, keep=True):
+        """
+        Nothing to close: the pool is shared, and the database is never
+        deleted.
+        """
+
+    def __repr__(self):
+        # the URL may hold a password
+        return "PostgresBackend(...)"
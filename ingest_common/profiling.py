@@ -0,0 +1,108 @@
+"""
+Profiling support for the ingest scripts and validate.py.
+
+A Profiler runs cProfile and tracemalloc for the duration of a run and
+collects row counts and timings reported by the code being profiled.  When
+stopped it writes to its report directory:
+
+    cprofile.pstats   raw cProfile output, for pstats/snakeviz
+    cprofile.txt      the 50 most expensive functions by cumulative time
+    allocations.txt   the 30 biggest allocation sites at peak memory
+    summary.json      wall time, stage timings, row counts and mapping timings
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import time
+import tracemalloc
+
+
+class Profiler(object):
+    """
+    Collects profiling data for one run and writes it to <report_dir>.
+    """
+    def __init__(self, report_dir):
+        """
+        Parameters
+        ==========
+        report_dir: string
+            Directory the reports are written to; created if missing.
+
+        """
+        self.report_dir = report_dir
+        self.rows = {}
+        self.timings = {}
+        self.stages = {}
+        self._profile = cProfile.Profile()
+        self._started = None
+        self._lap_start = None
+        self._peak_snapshot = None
+        self._peak_traced = 0
+
+    def start(self):
+        tracemalloc.start(10)
+        self._started = self._lap_start = time.perf_counter()
+        self._profile.enable()
+
+    def count(self, key, n=1):
+        """
+        Adds <n> to the row count of <key>, e.g. a DataPageName.
+        """
+        self.rows[key] = self.rows.get(key, 0) + n
+
+    def add_time(self, key, seconds):
+        """
+        Adds <seconds> to the time spent on <key>, e.g. one table mapping.
+        """
+        self.timings[key] = self.timings.get(key, 0.0) + seconds
+
+    def lap(self, stage):
+        """
+        Records the time since the previous lap as <stage>, and keeps an
+        allocation snapshot if memory use is the highest seen so far.
+        """
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self._lap_start
+        self._lap_start = now
+
+        traced, _ = tracemalloc.get_traced_memory()
+        if traced >= self._peak_traced:
+            self._peak_traced = traced
+            self._peak_snapshot = tracemalloc.take_snapshot()
+        # don't bill the snapshot to the next stage
+        self._lap_start = time.perf_counter()
+
+    def stop(self):
+        """
+        Stops profiling and writes the reports.
+        """
+        self._profile.disable()
+        wall_time = time.perf_counter() - self._started
+        if self._peak_snapshot is None:
+            self._peak_snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        os.makedirs(self.report_dir, exist_ok=True)
+        self._profile.dump_stats(os.path.join(self.report_dir, "cprofile.pstats"))
+        with open(os.path.join(self.report_dir, "cprofile.txt"), "w") as report:
+            stats = pstats.Stats(self._profile, stream=report)
+            stats.sort_stats("cumulative").print_stats(50)
+
+        with open(os.path.join(self.report_dir, "allocations.txt"), "w") as report:
+            report.write(f"Peak traced memory: {peak / (1 << 20):.1f} MiB\n\n")
+            for stat in self._peak_snapshot.statistics("lineno")[:30]:
+                report.write(f"{stat}\n")
+
+        summary = {
+            "wall_time": round(wall_time, 4),
+            "peak_traced_bytes": peak,
+            "stages": {stage: round(seconds, 4) for stage, seconds in self.stages.items()},
+            "rows": dict(sorted(self.rows.items(), key=lambda item: -item[1])),
+            "timings": {key: round(seconds, 4)
+                        for key, seconds in sorted(self.timings.items(), key=lambda item: -item[1])}
+        }
+        with open(os.path.join(self.report_dir, "summary.json"), "w") as report:
+            json.dump(summary, report, indent=2)
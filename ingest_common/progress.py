@@ -0,0 +1,207 @@
+"""
+Progress reporting for long ingest and validation runs.
+
+A Progress tracks how much of a known total has been done (bytes of input
+for the ingest scripts, individuals for validate.py) and how many items
+(rows, records) were processed, and at most once per interval reports the
+throughput, an ETA and the current resident memory: as a line of text for
+the operator, and as a JSON status file a scheduler can poll:
+
+    {
+      "state": "running",
+      "pid": 4242,
+      "unit": "bytes",
+      "done": 73400320,
+      "total": 209715200,
+      "items": 180000,
+      "items_unit": "rows",
+      "items_per_second": 24013.2,
+      "elapsed_seconds": 7.5,
+      "eta_seconds": 13.9,
+      "rss_bytes": 61440000,
+      "current": "export/adverse_events.csv",
+      "updated": "2024-05-01T02:13:07"
+    }
+
+Used as a context manager, a Progress reports the run done when the block
+ends, or failed if it raised.  The status file is replaced atomically, so
+it is never seen half written.  update() only compares a clock reading
+between two reports, so calling it once per batch of rows costs next to
+nothing.
+"""
+
+import json
+import os
+import resource
+import sys
+import time
+
+DEFAULT_INTERVAL = 10.0
+
+STATE_RUNNING, STATE_DONE, STATE_FAILED = "running", "done", "failed"
+
+
+def current_rss():
+    """
+    Returns the resident memory of this process in bytes; its peak where
+    the current value can't be read.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+def to_stderr(line):
+    """
+    Reports a line of progress on standard error.
+    """
+    print(line, file=sys.stderr, flush=True)
+
+
+def _duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+def _amount(value, unit):
+    if unit != "bytes":
+        return f"{value}"
+    for suffix in ("B", "KiB", "MiB", "GiB"):
+        if value < 1024 or suffix == "GiB":
+            return f"{value:.0f} {suffix}" if suffix == "B" else f"{value:.1f} {suffix}"
+        value /= 1024
+
+
+class Progress(object):
+    """
+    The progress of one run towards a total.
+    """
+    def __init__(self, total=None, unit="bytes", items_unit="rows", status_path=None, report=None,
+                 interval=DEFAULT_INTERVAL):
+        """
+        Parameters
+        ==========
+        total: int
+            How much there is to do, in <unit>; None if unknown.
+        unit: string
+            What the total counts: "bytes", "individuals", ...
+        items_unit: string
+            What the items counted alongside are: "rows", "records", ...
+        status_path: string
+            Where to write the JSON status; None for no status file.
+        report: callable
+            Called with a line of text at every report, e.g. a logger's
+            info method; None to only write the status file.
+        interval: float
+            Seconds between two reports.
+
+        """
+        self.total = total
+        self.unit = unit
+        self.items_unit = items_unit
+        self.status_path = status_path
+        self.done = 0
+        self.items = 0
+        self.current = None
+        self._report = report
+        self._interval = interval
+        self._started = time.monotonic()
+        self._next_report = self._started + interval
+
+    def update(self, done=None, advance=0, items=0, current=None):
+        """
+        Records progress: <done> so far, or <advance> more, and <items> more
+        items, while working on <current>.  Reports if the interval is up.
+        """
+        if done is not None:
+            self.done = done
+        else:
+            self.done += advance
+        self.items += items
+        if current is not None:
+            self.current = current
+        now = time.monotonic()
+        if now >= self._next_report:
+            self.report(now=now)
+
+    def status(self, state=STATE_RUNNING, now=None):
+        """
+        Returns the status as a dict, as written to the status file.
+        """
+        elapsed = (now or time.monotonic()) - self._started
+        eta = None
+        if self.total and self.done and elapsed > 0:
+            eta = max(0.0, (self.total - self.done) * elapsed / self.done)
+        return {
+            "state": state,
+            "pid": os.getpid(),
+            "unit": self.unit,
+            "done": self.done,
+            "total": self.total,
+            "items": self.items,
+            "items_unit": self.items_unit,
+            "items_per_second": round(self.items / elapsed, 1) if elapsed > 0 else None,
+            "elapsed_seconds": round(elapsed, 1),
+            "eta_seconds": round(eta, 1) if eta is not None else None,
+            "rss_bytes": current_rss(),
+            "current": self.current,
+            "updated": time.strftime("%Y-%m-%dT%H:%M:%S")
+        }
+
+    def report(self, state=STATE_RUNNING, now=None):
+        """
+        Writes the status file and reports a line of text now.
+        """
+        status = self.status(state, now)
+        self._next_report = time.monotonic() + self._interval
+        if self.status_path:
+            tmp_path = f"{self.status_path}.tmp"
+            with open(tmp_path, "w") as status_file:
+                json.dump(status, status_file, indent=2)
+            os.replace(tmp_path, self.status_path)
+        if self._report:
+            self._report(self.describe(status))
+
+    def describe(self, status):
+        """
+        Returns a status as a line of text.
+        """
+        # byte amounts carry their own unit
+        unit = "" if self.unit == "bytes" else f" {self.unit}"
+        done = _amount(status["done"], self.unit)
+        if status["total"]:
+            total = _amount(status["total"], self.unit)
+            done = f"{100.0 * status['done'] / status['total']:.1f}% ({done} of {total}{unit})"
+        else:
+            done += unit
+        line = f"Progress: {done}, {status['items']} {self.items_unit}"
+        if status["items_per_second"] is not None:
+            line += f" ({status['items_per_second']:.0f}/s)"
+        if status["state"] == STATE_RUNNING and status["eta_seconds"] is not None:
+            line += f", ETA {_duration(status['eta_seconds'])}"
+        line += f", RSS {status['rss_bytes'] / (1 << 20):.0f} MiB"
+        if status["state"] != STATE_RUNNING:
+            line += f", {status['state']} after {_duration(status['elapsed_seconds'])}"
+        elif status["current"]:
+            line += f", at {status['current']}"
+        return line
+
+    def finish(self, state=STATE_DONE):
+        """
+        Reports the final status.
+        """
+        if state == STATE_DONE and self.total is not None:
+            self.done = self.total
+        self.report(state)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.finish(STATE_FAILED if exc_type else STATE_DONE)
@@ -0,0 +1,156 @@
+"""
+Cross-file referential integrity checks for validate.py.
+
+validate.py loads the records of every individual on their own, so nothing
+stops a pipeline record from naming a sample no clinical file has, or a
+chemotherapy from naming a treatment plan that was never recorded.  A
+ReferenceIndex is built in one pass over the documents loaded together,
+holding only ids:
+
+    patients          every patientId
+    samples           sampleId -> patientId
+    treatment plans   (patientId, treatmentPlanId) of every Treatment
+
+after which check() tells in constant time whether a record refers to
+anything missing, so orphan records are reported before they are inserted.
+A kind of id nothing was indexed for (no Sample at all, say) isn't checked:
+the documents don't have it, which says nothing about the records naming
+one, as with a pipeline file validated without the clinical data its
+samples belong to.
+Documents may be metadata files, shard manifests or columnar outputs; only
+clinical ones are indexed, the Patient of a pipeline individual merely
+says whose records they are.
+"""
+
+import json
+import os
+
+from ingest_common.columnar import is_columnar, manifest_path, read_tables
+from ingest_common.shards import is_manifest, manifest_shards
+from ingest_common.streams import open_input
+
+PIPELINE_KEY = "pipeline_metadata"
+
+# tables whose records name a sample, and those naming a treatment plan
+SAMPLE_TABLES = ("Surgery", "Extraction", "Sequencing", "Alignment", "VariantCalling", "FusionDetection",
+                 "ExpressionAnalysis")
+TREATMENT_PLAN_TABLES = ("Chemotherapy", "Radiotherapy", "Immunotherapy", "Surgery", "Celltransplant")
+
+
+def _records(records):
+    if isinstance(records, dict):
+        return [records]
+    return records
+
+
+class ReferenceIndex(object):
+    """
+    The patients, samples and treatment plans of a set of documents.
+    """
+    def __init__(self):
+        self.patients = set()
+        self.samples = {}
+        self.treatment_plans = set()
+
+    def add_record(self, table, record, patient_id=None):
+        """
+        Indexes one record; <patient_id> is the one of its individual, used
+        when the record has none of its own.
+        """
+        patient_id = record.get("patientId") or patient_id
+        if table == "Patient" and patient_id:
+            self.patients.add(patient_id)
+        elif table == "Sample" and record.get("sampleId"):
+            self.samples[record["sampleId"]] = patient_id
+        elif table == "Treatment" and record.get("treatmentPlanId"):
+            self.treatment_plans.add((patient_id, record["treatmentPlanId"]))
+
+    def add_entries(self, entries):
+        """
+        Indexes the records of metadata entries, one individual each.
+        """
+        for entry in entries:
+            patient_id = entry.get("Patient", {}).get("patientId")
+            for table, records in entry.items():
+                for record in _records(records):
+                    self.add_record(table, record, patient_id)
+
+    def add_tables(self, tables):
+        """
+        Indexes (table, records) pairs, as read_tables() yields them.
+        """
+        for table, records in tables:
+            for record in records:
+                self.add_record(table, record)
+
+    def add_document(self, document, path):
+        """
+        Indexes a parsed document read from <path>: metadata, a shard
+        manifest or a columnar manifest.  Pipeline documents hold nothing
+        to index.
+        """
+        if is_columnar(document):
+            if document.get("metadata_key") != PIPELINE_KEY:
+                self.add_tables(read_tables(path, document))
+        elif is_manifest(document):
+            if document.get("metadata_key") != PIPELINE_KEY:
+                for shard in manifest_shards(document, path):
+                    self.add_path(shard)
+        else:
+            for key, entries in document.items():
+                if key != PIPELINE_KEY:
+                    self.add_entries(entries)
+
+    def add_path(self, path):
+        """
+        Reads and indexes the document at <path>.
+        """
+        if os.path.isdir(path):
+            path = manifest_path(path)
+        with open_input(path) as document_file:
+            self.add_document(json.load(document_file), path)
+
+    def update(self, other):
+        """
+        Indexes everything ReferenceIndex <other> holds, as if its documents
+        were added after this one's.
+        """
+        self.patients |= other.patients
+        self.samples.update(other.samples)
+        self.treatment_plans |= other.treatment_plans
+
+    def unchecked(self):
+        """
+        Returns the kinds of ids check() skips, those nothing was indexed for.
+        """
+        kinds = (("patients", self.patients), ("samples", self.samples), ("treatment plans", self.treatment_plans))
+        return [kind for kind, ids in kinds if not ids]
+
+    def check(self, table, record, patient_id=None):
+        """
+        Returns what <record> of <table> refers to that isn't indexed, as
+        messages; an empty list if nothing.  Kinds of ids nothing was
+        indexed for are not checked.
+        """
+        problems = []
+        patient_id = record.get("patientId") or patient_id
+        if self.patients and patient_id and patient_id not in self.patients:
+            problems.append(f"{table} record refers to unknown patient {patient_id}")
+
+        sample_id = record.get("sampleId")
+        if self.samples and table in SAMPLE_TABLES and sample_id:
+            if sample_id not in self.samples:
+                problems.append(f"{table} record refers to unknown sample {sample_id}")
+            elif patient_id and self.samples[sample_id] != patient_id:
+                problems.append(f"{table} record of patient {patient_id} refers to sample {sample_id} "
+                                f"of patient {self.samples[sample_id]}")
+
+        plan_id = record.get("treatmentPlanId")
+        if (self.treatment_plans and table in TREATMENT_PLAN_TABLES and plan_id
+                and (patient_id, plan_id) not in self.treatment_plans):
+            problems.append(f"{table} record refers to unknown treatment plan {plan_id}")
+        return problems
+
+    def __repr__(self):
+        return (f"ReferenceIndex({len(self.patients)} patients, {len(self.samples)} samples, "
+                f"{len(self.treatment_plans)} treatment plans)")
@@ -0,0 +1,207 @@
+"""
+Cached validation outcomes for validate.py.
+
+Coordinators submit the same metadata many times over with a few edits, and
+every record is validated again: its field names probed one by one against
+the datamodel, and the record inserted into a repo that is thrown away.  A
+ResultCache keeps the outcome of every record validated, in a small sqlite
+database, keyed by the fingerprint of
+
+    (cache version, table, patientId of its individual, record)
+
+where the cache version names the candig packages validating the records,
+so that an upgrade starts afresh.  An outcome is what validating the record
+did:
+
+    {
+      "local_id": "P-01_D-1",            # None if the record was skipped
+      "messages": [],                    # logged finding its localId
+      "renames": [["ageAtDiagnoses", "ageAtDiagnosis"]],
+      "build_messages": ["Rename \\"ageAtDiagnoses\\" to \\"ageAtDiagnosis\\""]
+    }
+
+The outcome of a record written to the repo is only stored once the write
+succeeded.  The cache holds at most <max_entries> outcomes; the least
+recently used ones are evicted when it is committed.
+
+Several processes may share a cache, such as the workers of validate.py
+--serve.  Outcomes stored are kept in memory and written <write_every> at a
+time, each batch in a short transaction of its own, so that a worker only
+holds the database's write lock while writing a batch, never while it
+validates records.  The database is in WAL mode, so that reading doesn't
+wait for writers either.
+
+A run also keeps track of the localIds it has validated, so that a record
+whose outcome was replayed, and which was therefore never inserted into a
+throwaway repo, is still reported as a duplicate when its localId comes
+again.
+"""
+
+import json
+import sqlite3
+import threading
+
+from ingest_common.fingerprints import fingerprint
+
+# bump when the outcomes stored change meaning
+CACHE_FORMAT = 1
+
+MAX_ENTRIES = 200000
+
+# outcomes stored between two writes to the database
+WRITE_EVERY = 100
+
+
+class ResultCache(object):
+    """
+    The validation outcomes of the records validated before.
+    """
+    def __init__(self, path, version="", max_entries=MAX_ENTRIES, write_every=WRITE_EVERY, timeout=30):
+        """
+        Parameters
+        ==========
+        path: string
+            The sqlite database holding the outcomes; created if missing.
+        version: string
+            The version of what validates the records; outcomes stored under
+            another version are never used.
+        max_entries: int
+            The number of outcomes kept.
+        write_every: int
+            The number of outcomes stored before they are written.
+        timeout: float
+            How many seconds to wait for another process writing to the
+            database.
+
+        """
+        self.path = path
+        self.version = f"{CACHE_FORMAT}:{version}"
+        self.max_entries = max_entries
+        self.write_every = write_every
+        self.throwaway = False
+        # a --pipeline load validates records in a background thread
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS results ("
+                         "key TEXT PRIMARY KEY, outcome TEXT NOT NULL, used INTEGER NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+        self._db.commit()
+        self._clock = self._db.execute("SELECT COALESCE(MAX(used), 0) FROM results").fetchone()[0]
+        self._used = {}
+        self._unwritten = {}
+        self._pending = {}
+        self._claims = {}
+        self.hits = self.misses = 0
+
+    def begin(self, throwaway=False):
+        """
+        Starts a new run, loading into a repo that is thrown away afterwards
+        if <throwaway>: records validated before needn't be inserted again.
+        """
+        with self._lock:
+            self.throwaway = throwaway
+            self._pending.clear()
+            self._claims.clear()
+            self.hits = self.misses = 0
+
+    def key(self, table, record, patient_id):
+        """
+        Returns the key of the outcome of <record>, before validating it
+        changes it.
+        """
+        return fingerprint([self.version, table, patient_id, record])
+
+    def get(self, key):
+        """
+        Returns the outcome stored under <key>, or None.
+        """
+        with self._lock:
+            row = self._unwritten.get(key)
+            if row is None:
+                row = self._db.execute("SELECT outcome FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._clock += 1
+            self._used[key] = self._clock
+            return json.loads(row[0])
+
+    def put(self, key, outcome):
+        """
+        Stores the outcome of a record.
+        """
+        with self._lock:
+            self._clock += 1
+            self._unwritten[key] = (json.dumps(outcome), self._clock)
+            if len(self._unwritten) >= self.write_every:
+                self._write()
+
+    def _write(self):
+        """
+        Writes the outcomes stored since the last write, in a transaction of
+        their own.  Called with the lock held.
+        """
+        if self._unwritten:
+            self._db.executemany("INSERT OR REPLACE INTO results (key, outcome, used) VALUES (?, ?, ?)",
+                                 [(key, outcome, used) for key, (outcome, used) in self._unwritten.items()])
+            self._unwritten.clear()
+        self._db.commit()
+
+    def defer(self, table, local_id, key, outcome):
+        """
+        Keeps the outcome of a record until store() says it was written.
+        """
+        with self._lock:
+            self._pending[(table, local_id)] = (key, outcome)
+
+    def store(self, table, local_id):
+        """
+        Stores the outcome deferred for a record that was written.
+        """
+        with self._lock:
+            pending = self._pending.pop((table, local_id), None)
+        if pending:
+            self.put(*pending)
+
+    def claim(self, table, local_id, skipped):
+        """
+        Notes that a record of <table> with <local_id> was validated in this
+        run, and whether its insert was <skipped>.  Returns None the first
+        time, or whether the insert of the first one was skipped.
+        """
+        with self._lock:
+            if (table, local_id) in self._claims:
+                return self._claims[(table, local_id)]
+            self._claims[(table, local_id)] = skipped
+            return None
+
+    def evict(self):
+        """
+        Deletes the least recently used outcomes beyond <max_entries>.
+        """
+        with self._lock:
+            self._db.execute("DELETE FROM results WHERE key IN "
+                             "(SELECT key FROM results ORDER BY used DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def commit(self):
+        """
+        Writes the outcomes stored, records which outcomes were used, evicts
+        the oldest and commits.
+        """
+        with self._lock:
+            self._write()
+            self._db.executemany("UPDATE results SET used = ? WHERE key = ?",
+                                 [(used, key) for key, used in self._used.items()])
+            self._used.clear()
+        self.evict()
+        with self._lock:
+            self._db.commit()
+
+    def close(self):
+        self.commit()
+        self._db.close()
+
+    def __repr__(self):
+        return f"ResultCache({self.path!r}, {self.hits} hits, {self.misses} misses)"
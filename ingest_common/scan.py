@@ -0,0 +1,190 @@
+"""
+Cheap relevance checks for Medidata Rave CSV exports.
+
+Rave writes one CSV per DataPage, and most pages in an export are never
+mapped.  Rather than tokenizing every row of such a page only to throw it
+away, scan_file() memory-maps the export and looks at the header and the
+first data row.  If the first row belongs to an unmapped page, the rest of
+the file is lowercased a chunk at a time and searched with bytes.find for
+each mapped page name.  Only when none of them appears anywhere is the file
+reported as irrelevant, so files mixing several pages are never skipped by
+mistake.  A name found inside another field merely makes the file parsed.
+
+read_batches() sniffs the encoding and delimiter of every export with a
+dialects.FormatCache before scanning and parsing it, and can report how
+many bytes of the inputs it has got through to a progress.Progress.
+"""
+
+import csv
+import mmap
+
+from ingest_common.dialects import CsvFormat, FormatCache
+from ingest_common.pipeline import batched
+from ingest_common.streams import bytes_read
+
+RELEVANT, IRRELEVANT, EMPTY = "relevant", "irrelevant", "empty"
+ROWS, PATIENTS, ERROR = "rows", "patients", "error"
+ROW_BATCH = 1000
+
+# UTF-16/32 exports can't be searched bytewise for ASCII page names
+_WIDE_BOMS = (b"\xff\xfe", b"\xfe\xff")
+
+# bytes lowercased and searched at a time
+SEARCH_CHUNK = 1 << 20
+
+
+def section_names(sections):
+    """
+    Returns the lowercased <sections> as the bytes searched for, or None if
+    one isn't ASCII: bytes.lower() only folds ASCII letters, so such a name
+    could be missed.
+    """
+    if not all(section.isascii() for section in sections):
+        return None
+    return tuple(section.encode("ascii") for section in sections)
+
+
+def _holds_any(buffer, start, names):
+    """
+    Whether <buffer> holds one of <names> past <start>, ignoring ASCII case.
+    """
+    overlap = max(len(name) for name in names) - 1
+    for offset in range(start, len(buffer), SEARCH_CHUNK):
+        chunk = buffer[offset:offset + SEARCH_CHUNK + overlap].lower()
+        if any(chunk.find(name) != -1 for name in names):
+            return True
+    return False
+
+
+def _first_line(buffer, start):
+    end = buffer.find(b"\n", start)
+    if end == -1:
+        end = len(buffer)
+    return buffer[start:end].decode("utf-8-sig", "replace"), end + 1
+
+
+def scan_file(path, section_column, sections, names=None, delimiter=","):
+    """
+    Decides whether a Rave export holds any rows of the mapped <sections>.
+
+    :param str path: path to the CSV export
+    :param str section_column: name of the DataPageName column
+    :param set[str] sections: lowercased names of the mapped sections
+    :param names: section_names(sections), when checking many files
+    :param str delimiter: the field delimiter of the export
+    :return: RELEVANT, IRRELEVANT or EMPTY (no data rows)
+    """
+    with open(path, "rb") as csv_file:
+        try:
+            buffer = mmap.mmap(csv_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # mmap refuses empty files
+            return EMPTY
+
+        with buffer:
+            if buffer[:2] in _WIDE_BOMS:
+                return RELEVANT
+
+            header_line, data_start = _first_line(buffer, 0)
+            header = next(csv.reader([header_line], delimiter=delimiter), [])
+            if section_column not in header:
+                # not a DataPage export; let the ingest deal with it
+                return RELEVANT
+            if data_start >= len(buffer):
+                return EMPTY
+
+            first_line, _ = _first_line(buffer, data_start)
+            first_row = next(csv.reader([first_line], delimiter=delimiter), [])
+            index = header.index(section_column)
+            if index < len(first_row) and first_row[index].strip().lower() in sections:
+                return RELEVANT
+
+            names = names or section_names(sections)
+            if not names or _holds_any(buffer, data_start, names):
+                return RELEVANT
+            return IRRELEVANT
+
+
+def read_column(input_file, column, csv_format=None):
+    """
+    Yields the values of a single column of an InputFile, without building
+    a dict per row.
+    """
+    csv_format = csv_format or CsvFormat()
+    with input_file.open(csv_format.encoding, "", csv_format.errors) as csv_file:
+        reader = csv_format.row_reader(csv_file)
+        header = next(reader, [])
+        if column not in header:
+            return
+        index = header.index(column)
+        for row in reader:
+            if index < len(row):
+                yield row[index]
+
+
+def input_status(input_file, section_column, sections, names=None, delimiter=","):
+    """
+    Returns the scan_file() status of an InputFile.  Compressed inputs can't
+    be memory-mapped and are always reported relevant, as are unreadable
+    ones, which the caller reports when it opens them.
+    """
+    try:
+        if input_file.is_plain:
+            return scan_file(input_file.path, section_column, sections, names, delimiter)
+    except OSError:
+        pass
+    return RELEVANT
+
+
+def total_size(inputs):
+    """
+    Returns the total size in bytes of a list of InputFiles, as
+    read_batches() reports progress through them.
+    """
+    return sum(input_file.size for input_file in inputs)
+
+
+def read_batches(engine, inputs, prefilter=True, batch_size=ROW_BATCH, progress=None):
+    """
+    Reads the CSV InputFiles to be mapped by <engine> and yields
+    (input_file, kind, items) tuples, where <kind> is
+
+        ROWS       <items> is a list of up to <batch_size> rows, as dicts
+        PATIENTS   <items> lists the patient ids of an export of an unmapped
+                   page, when the engine keeps such patients
+        ERROR      <items> is the OSError raised reading the file
+
+    With <prefilter>, exports holding no page mapped by the engine are
+    skipped without being parsed into dicts.  Only the engine's mapping is
+    consulted, never its state, so the batches can be read in another
+    thread while the engine maps the previous ones.
+
+    With a <progress>, the bytes read and rows parsed are reported to it
+    once per batch, out of the total_size() of the inputs.
+    """
+    sections = engine.sections
+    formats = FormatCache()
+    names = section_names(sections) if prefilter else None
+    done = 0
+    for input_file in inputs:
+        try:
+            size = input_file.size if progress else 0
+            csv_format = formats.format_of(input_file)
+            status = RELEVANT
+            if prefilter:
+                status = input_status(input_file, engine.section_column, sections, names, csv_format.delimiter)
+            if status == RELEVANT:
+                with input_file.open(csv_format.encoding, errors=csv_format.errors) as csv_file:
+                    for rows in batched(csv_format.reader(csv_file), batch_size):
+                        if progress:
+                            position = min(bytes_read(csv_file) or 0, size)
+                            progress.update(done=done + position, items=len(rows), current=input_file.name)
+                        yield input_file, ROWS, rows
+            elif status == IRRELEVANT and engine.keeps_unmapped_patients:
+                yield input_file, PATIENTS, list(read_column(input_file, engine.patient_column, csv_format))
+        except OSError as e:
+            yield input_file, ERROR, e
+            return
+        if progress:
+            done += size
+            progress.update(done=done, current=input_file.name)
@@ -0,0 +1,262 @@
+"""
+The CanDIGv1 tables and what validate.py requires of their records.
+
+LOCAL_ID_FIELDS lists, for every table validate.py loads, the fields its
+localId is built from; records of the other tables may give a localId of
+their own instead.  validate.py's CandigRepo uses the same tuples.
+
+A SchemaIndex adds the field names of every table, read from the candig
+protocol messages when candig is installed and cached as JSON (per candig
+version) in the ingest cache directory, so that the ingest scripts can
+check a mapping before running it:
+
+    index = load_schema_index()
+    corrections, errors = index.check_plan(plan)
+
+Without candig and without a cached index only the localId fields are
+checked; the index's fields are then None, and the ingest scripts warn,
+or stop with --strict-schema.
+"""
+
+import difflib
+import json
+import os
+
+from ingest_common.mapping import MappingEngine, MappingSpecError, default_cache_dir, load_plan
+
+# why a SchemaIndex has no field names, for the ingest scripts to report
+NO_FIELD_NAMES = ("the field names of the CanDIG tables are unknown: candig could not be read, and no schema "
+                  "index is cached or given with --schema-index")
+
+CLINICAL_LOCAL_ID_FIELDS = {
+    "Patient": ("patientId",),
+    "Enrollment": ("patientId", "enrollmentApprovalDate"),
+    "Consent": ("patientId", "consentDate"),
+    "Diagnosis": ("patientId", "diagnosisDate"),
+    "Sample": ("patientId", "sampleId"),
+    "Treatment": ("patientId", "startDate"),
+    "Outcome": ("patientId", "dateOfAssessment"),
+    "Complication": ("patientId", "date"),
+    "Tumourboard": ("patientId", "dateOfMolecularTumorBoard"),
+    "Chemotherapy": ("patientId", "treatmentPlanId", "systematicTherapyAgentName"),
+    "Radiotherapy": ("patientId", "courseNumber", "treatmentPlanId", "startDate"),
+    "Immunotherapy": ("patientId", "treatmentPlanId", "startDate"),
+    "Surgery": ("patientId", "treatmentPlanId", "startDate", "sampleId"),
+    "Celltransplant": ("patientId", "treatmentPlanId", "startDate"),
+    "Slide": ("patientId", "slideId"),
+    "Study": ("patientId", "startDate"),
+    "Labtest": ("patientId", "startDate")
+}
+PIPELINE_LOCAL_ID_FIELDS = {
+    "Extraction": ("sampleId", "extractionId"),
+    "Sequencing": ("sampleId", "sequencingId"),
+    "Alignment": ("sampleId", "alignmentId"),
+    "VariantCalling": ("sampleId", "variantCallingId"),
+    "FusionDetection": ("sampleId", "fusionDetectionId"),
+    "ExpressionAnalysis": ("sampleId", "expressionAnalysisId")
+}
+LOCAL_ID_FIELDS = dict(CLINICAL_LOCAL_ID_FIELDS, **PIPELINE_LOCAL_ID_FIELDS)
+
+# tables whose localId is always built from LOCAL_ID_FIELDS
+NO_EXPLICIT_LOCAL_ID = ("Patient", "Sample")
+
+# fields every record may have, whatever its table
+COMMON_FIELDS = ("localId", "patientId")
+
+
+def _candig_fields():
+    """
+    Reads the field names of every table from the candig protocol messages.
+    """
+    from candig.schemas import protocol
+
+    fields = {}
+    for table in LOCAL_ID_FIELDS:
+        message = getattr(protocol, table, None)
+        if message is not None:
+            fields[table] = sorted(field.json_name for field in message.DESCRIPTOR.fields)
+    return fields
+
+
+def _candig_version():
+    import candig.server
+    return getattr(candig.server, "__version__", "unknown")
+
+
+class SchemaIndex(object):
+    """
+    The field names and localId fields of the CanDIGv1 tables.
+    """
+    def __init__(self, fields=None):
+        """
+        Parameters
+        ==========
+        fields: dict
+            Maps table names to their field names; None if unknown, in
+            which case field names are not checked.
+
+        """
+        self.fields = None
+        if fields is not None:
+            self.fields = {table: frozenset(names).union(COMMON_FIELDS) for table, names in fields.items()}
+
+    def correction(self, table, field):
+        """
+        Returns the field of <table> closest to <field>, or None.
+        """
+        matches = difflib.get_close_matches(field, self.fields.get(table, ()), n=1, cutoff=0.8)
+        return matches[0] if matches else None
+
+    def check_fields(self, table, keys, counted=False, where=""):
+        """
+        Checks the fields one table mapping produces.
+
+        :param str table: the table mapped to
+        :param keys: the names of the fields it produces
+        :param bool counted: whether the engine gives the records a localId
+        :param str where: where the mapping is, for the messages
+        :return: (corrections, errors): the field renames worth applying,
+            as a dict, and the problems that can't be corrected
+        """
+        corrections, errors = {}, []
+        if table not in LOCAL_ID_FIELDS:
+            errors.append(f"{where}: validate.py does not load table {table!r}")
+            return corrections, errors
+
+        if self.fields is not None and table in self.fields:
+            for key in keys:
+                if key in self.fields[table]:
+                    continue
+                correction = self.correction(table, key)
+                if correction:
+                    corrections[key] = correction
+                else:
+                    errors.append(f"{where}: {table} has no field {key!r}")
+
+        keys = {corrections.get(key, key) for key in keys}
+        has_local_id = "localId" in keys or counted
+        if table in NO_EXPLICIT_LOCAL_ID or not has_local_id:
+            # validate.py fills in a missing patientId from the individual
+            missing = [field for field in LOCAL_ID_FIELDS[table] if field not in keys and field != "patientId"]
+            if missing:
+                errors.append(f"{where}: {table} records need {', '.join(missing)} "
+                              f"(or a localId) to be loaded")
+        return corrections, errors
+
+    def check_plan(self, plan):
+        """
+        Checks every table mapping of a compiled plan, applying the field
+        renames check_fields() finds to the plan in place.
+
+        :return: (corrections, errors): the renames applied and the problems
+            that could not be corrected, as messages
+        :rtype: tuple[list[str], list[str]]
+        """
+        counted_tables = plan["counted_tables"] if plan["local_id"] else frozenset()
+        corrected, problems = [], []
+
+        def check(records, where):
+            checked = []
+            for i, (table, counted, fields) in enumerate(records):
+                record_where = f"{where}[{i}]"
+                corrections, errors = self.check_fields(table, [key for key, _, _ in fields],
+                                                        table in counted_tables, record_where)
+                for old, new in corrections.items():
+                    corrected.append(f"{record_where}: renamed {table} field {old!r} to {new!r}")
+                problems.extend(errors)
+                checked.append((table, counted, tuple((corrections.get(key, key), kind, arg)
+                                                      for key, kind, arg in fields)))
+            return tuple(checked)
+
+        if plan["records"] is not None:
+            plan["records"] = check(plan["records"], "records")
+        else:
+            for section, (increments, records) in plan["sections"].items():
+                plan["sections"][section] = (increments, check(records, f"sections.{section}"))
+        return corrected, problems
+
+    @staticmethod
+    def incomplete_records(entries):
+        """
+        Yields (table, record) for every record of <entries> that validate.py
+        would skip because a field its localId is built from is empty.
+        """
+        for entry in entries:
+            for table, records in entry.items():
+                if table not in LOCAL_ID_FIELDS:
+                    continue
+                if isinstance(records, dict):
+                    records = [records]
+                for record in records:
+                    if record.get("localId") and table not in NO_EXPLICIT_LOCAL_ID:
+                        continue
+                    if any(not record.get(field) for field in LOCAL_ID_FIELDS[table] if field != "patientId"):
+                        yield table, record
+
+    def to_json(self):
+        """
+        Returns the field names as JSON-serializable lists, for load_schema_index().
+        """
+        return {table: sorted(names) for table, names in (self.fields or {}).items()}
+
+
+def load_schema_index(path=None, cache_dir=None):
+    """
+    Returns the SchemaIndex of the installed candig, building and caching it
+    on first use; one without field names (see NO_FIELD_NAMES) if there is
+    neither candig nor a cached index.
+
+    :param str path: an index written by to_json(), to use instead
+    :param str cache_dir: where the index is cached; see default_cache_dir()
+    """
+    if path:
+        with open(path) as index_file:
+            return SchemaIndex(json.load(index_file))
+
+    try:
+        version = _candig_version()
+    except ImportError:
+        return SchemaIndex()
+
+    cache_path = os.path.join(cache_dir or default_cache_dir(), f"schema-{version}.json")
+    try:
+        with open(cache_path) as index_file:
+            return SchemaIndex(json.load(index_file))
+    except (OSError, ValueError):
+        pass
+
+    try:
+        index = SchemaIndex(_candig_fields())
+    except (ImportError, AttributeError):
+        return SchemaIndex()
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path, "w") as index_file:
+            json.dump(index.to_json(), index_file)
+    except OSError:
+        pass
+    return index
+
+
+def count_incomplete(index, entries):
+    """
+    Returns the number of incomplete_records() of <entries> per table.
+    """
+    counts = {}
+    for table, _ in index.incomplete_records(entries):
+        counts[table] = counts.get(table, 0) + 1
+    return counts
+
+
+def load_checked_engine(spec_path, index, cache_dir=None, stable_ids=False):
+    """
+    Returns a MappingEngine for the spec at <spec_path> after checking it
+    against <index>, with misspelled field names corrected, and the list of
+    corrections made.  Raises MappingSpecError listing the problems that
+    can't be corrected, so that a bad mapping fails before any row is read.
+    """
+    plan = load_plan(spec_path, cache_dir)
+    corrections, errors = index.check_plan(plan)
+    if errors:
+        raise MappingSpecError("\n".join(errors))
+    return MappingEngine(plan, stable_ids), corrections
@@ -0,0 +1,122 @@
+"""
+The HTTP side of validate.py --serve.
+
+run_service() answers on a host:port or a unix socket, and hands every
+document POSTed to /validate to a pool of worker processes:
+
+    POST /validate   body: a metadata document; returns the report
+    GET /health      returns the number of workers
+
+Each worker is set up once by the pool's initializer, e.g. to import the
+datamodel and open its repo, so that a document only costs its own
+validation.  validate.py imports this module for --serve only.
+"""
+
+import http.server
+import json
+import multiprocessing
+import os
+import signal
+import socketserver
+import sys
+
+
+class ServiceHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Handles the requests of the validation service.
+    """
+    def _reply(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != '/health':
+            self._reply(404, {'error': f'no such endpoint {self.path}'})
+            return
+        self._reply(200, {'status': 'ok', 'workers': self.server.workers})
+
+    def do_POST(self):
+        path, _, query = self.path.partition('?')
+        if path != '/validate':
+            self._reply(404, {'error': f'no such endpoint {path}'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            metadata = json.loads(self.rfile.read(length))
+        except ValueError as e:
+            self._reply(400, {'error': f'invalid JSON document: {e}'})
+            return
+        if not isinstance(metadata, dict) or len(metadata) != 1 \
+                or list(metadata)[0] not in ('metadata', 'pipeline_metadata'):
+            self._reply(400, {'error': 'expected a document with a "metadata" or "pipeline_metadata" list'})
+            return
+
+        args = dict(self.server.args)
+        if 'overwrite=1' in query.split('&'):
+            args['--overwrite'] = True
+        self._reply(200, self.server.pool.apply(self.server.validate, (metadata, args)))
+
+    def address_string(self):
+        # unix socket peers have no address
+        return str(self.client_address[0]) if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        self.server.logger.info(f'{self.address_string()} {format % args}')
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def run_service(address, workers, validate, args, logger, initializer=None, initargs=()):
+    """
+    Serves until interrupted by Ctrl-C or SIGTERM.
+
+    Parameters
+    ==========
+    address: string
+        host:port for HTTP, or the path of a unix socket.
+    workers: int
+        The number of worker processes.
+    validate: function
+        Called in a worker as validate(metadata, args) for every document;
+        returns the JSON-serializable report.
+    args: dict
+        The options passed to <validate>; ?overwrite=1 sets '--overwrite'.
+    logger: logger
+        Where requests are logged.
+    initializer, initargs:
+        Set up every worker process, as for multiprocessing.Pool.
+
+    """
+    unix = not (':' in address and '/' not in address)
+    pool = multiprocessing.Pool(workers, initializer=initializer, initargs=initargs)
+    # stop cleanly on SIGTERM too; set after forking so the workers keep the default, and before
+    # listening so that the socket is removed whenever it was created
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    server = None
+    try:
+        if unix:
+            if os.path.exists(address):
+                os.remove(address)
+            server = ThreadingUnixHTTPServer(address, ServiceHandler)
+        else:
+            host, port = address.rsplit(':', 1)
+            server = http.server.ThreadingHTTPServer((host, int(port)), ServiceHandler)
+        server.pool, server.validate, server.args, server.logger = pool, validate, args, logger
+        server.workers = workers
+        logger.info(f'Validating documents POSTed to {address}/validate with {workers} workers')
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server is not None:
+            server.server_close()
+        pool.terminate()
+        pool.join()
+        if unix and os.path.exists(address):
+            os.remove(address)
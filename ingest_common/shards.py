@@ -0,0 +1,96 @@
+"""
+Splitting ingest output into shards by patient.
+
+Each metadata entry goes to shard crc32(patientId) % N, so a patient always
+lands in the same shard whatever the input order, and shards can be loaded
+independently.  The shards are listed in a small manifest written in place
+of the single output file:
+
+    {
+      "shards": ["out.shard-0-of-4.json", ...],
+      "partition": "crc32(patientId) % 4",
+      "metadata_key": "metadata",
+      "individuals": [250, ...]
+    }
+
+Shard paths are relative to the manifest.
+"""
+
+import contextlib
+import json
+import os
+import zlib
+
+from ingest_common.accumulator import MetadataWriter
+from ingest_common.streams import open_output
+
+COMPRESSION_SUFFIXES = (".gz", ".zst")
+
+
+def shard_of(patient_id, shards):
+    """
+    Returns the shard number of a patient.
+    """
+    return zlib.crc32(patient_id.encode("utf-8")) % shards
+
+
+def shard_path(output_file, shard, shards):
+    """
+    Derives the name of a shard from the output file name, keeping the
+    extension and compression suffix: out.json.gz -> out.shard-0-of-4.json.gz
+    """
+    suffix = ""
+    base = output_file
+    if base.endswith(COMPRESSION_SUFFIXES):
+        base, suffix = os.path.splitext(base)
+    base, extension = os.path.splitext(base)
+    width = len(str(shards - 1))
+    return f"{base}.shard-{shard:0{width}d}-of-{shards}{extension}{suffix}"
+
+
+def write_shards(entries, output_file, shards, metadata_key="metadata", indent=None):
+    """
+    Writes <entries> to <shards> shard files and a manifest at <output_file>.
+    Every shard is kept open, and each entry written to its shard as it
+    comes, so that <entries> can be streamed.
+
+    :param iterable[dict] entries: metadata entries, each with a Patient record
+    :param str output_file: path of the manifest
+    :param int shards: number of shards
+    :param int indent: indentation of the shards, as for json.dump()
+    :return: the manifest
+    :rtype: dict
+    """
+    paths = [shard_path(output_file, shard, shards) for shard in range(shards)]
+    with contextlib.ExitStack() as stack:
+        writers = [MetadataWriter(stack.enter_context(open_output(path)), metadata_key, indent) for path in paths]
+        for entry in entries:
+            writers[shard_of(entry["Patient"]["patientId"], shards)].write(entry)
+        for writer in writers:
+            writer.close()
+
+    manifest_dir = os.path.dirname(os.path.abspath(output_file))
+    manifest = {
+        "shards": [os.path.relpath(os.path.abspath(path), manifest_dir) for path in paths],
+        "partition": f"crc32(patientId) % {shards}",
+        "metadata_key": metadata_key,
+        "individuals": [writer.count for writer in writers]
+    }
+    with open_output(output_file) as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    return manifest
+
+
+def is_manifest(document):
+    """
+    Whether a parsed JSON document is a shard manifest.
+    """
+    return isinstance(document, dict) and isinstance(document.get("shards"), list)
+
+
+def manifest_shards(manifest, manifest_path):
+    """
+    Returns the absolute paths of the shards listed in a manifest.
+    """
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+    return [os.path.join(manifest_dir, path) for path in manifest["shards"]]
@@ -0,0 +1,194 @@
+"""
+Transparent compression for ingest inputs and outputs.
+
+Inputs may be plain, gzip or zstd compressed (detected from their first
+bytes), or members of a zip bundle; outputs are compressed according to
+their suffix (.gz or .zst).  Everything is streamed, so a compressed export
+never has to be unpacked to disk.  zstd needs the optional zstandard
+package.
+"""
+
+import gzip
+import io
+import os
+import sys
+import zipfile
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+ZIP_MAGIC = b"PK\x03\x04"
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise OSError("the zstandard package is required for .zst files")
+    return zstandard
+
+
+def _sniff(path):
+    with open(path, "rb") as raw_file:
+        return raw_file.read(4)
+
+
+def open_binary_input(path):
+    """
+    Opens a plain, gzip or zstd file for binary reading, decompressing it
+    on the fly.
+    """
+    magic = _sniff(path)
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.open(path, "rb")
+    if magic == ZSTD_MAGIC:
+        raw_file = open(path, "rb")
+        return io.BufferedReader(_zstandard().ZstdDecompressor().stream_reader(raw_file, closefd=True))
+    return open(path, "rb")
+
+
+def open_input(path, encoding=None, newline=None, errors=None):
+    """
+    Opens a plain, gzip or zstd file for text reading.  A zip bundle with
+    a single member is opened as that member.
+    """
+    if path != "-" and _sniff(path) == ZIP_MAGIC:
+        members = list(zip_members(path))
+        if len(members) != 1:
+            raise OSError(f"{path} holds {len(members)} files; expected exactly one")
+        return members[0].open(encoding, newline, errors)
+    if path == "-":
+        if encoding is None:
+            return sys.stdin
+        return io.TextIOWrapper(sys.stdin.buffer, encoding=encoding, newline=newline, errors=errors)
+    return io.TextIOWrapper(open_binary_input(path), encoding=encoding, newline=newline, errors=errors)
+
+
+def bytes_read(text_file):
+    """
+    Returns how many bytes of its input an open text file has read so far,
+    counted as stored (compressed bytes of a gzip file), or None if that
+    can't be told, as for zstd files and standard input.  Reads are
+    buffered, so the count runs a little ahead of the rows parsed.
+    """
+    binary_file = getattr(text_file, "buffer", None)
+    if isinstance(binary_file, gzip.GzipFile):
+        binary_file = binary_file.fileobj
+    elif isinstance(binary_file, io.BufferedReader) and not isinstance(binary_file.raw, io.FileIO):
+        # a zstd stream counts the decompressed bytes
+        return None
+    try:
+        return binary_file.tell()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def input_size(path):
+    """
+    Returns the size in bytes of the input at <path> as bytes_read() counts
+    it, or None for standard input.
+    """
+    if path == "-":
+        return None
+    if _sniff(path) == ZIP_MAGIC:
+        return sum(member.size for member in zip_members(path))
+    return os.path.getsize(path)
+
+
+def open_output(path, encoding=None):
+    """
+    Opens <path> for text writing, compressing it if it ends in .gz or
+    .zst.  "-" is standard output.
+    """
+    if path == "-":
+        return sys.stdout
+    if path.endswith(".gz"):
+        return gzip.open(path, "wt", encoding=encoding)
+    if path.endswith(".zst"):
+        raw_file = open(path, "wb")
+        writer = _zstandard().ZstdCompressor().stream_writer(raw_file, closefd=True)
+        return io.TextIOWrapper(writer, encoding=encoding)
+    return open(path, "w", encoding=encoding)
+
+
+class InputFile(object):
+    """
+    One input to an ingest script: a file on disk or a member of a zip bundle.
+    """
+    def __init__(self, path, member=None):
+        self.path = path
+        self.member = member
+
+    @property
+    def name(self):
+        if self.member:
+            return f"{self.path}!{self.member}"
+        return self.path
+
+    @property
+    def is_plain(self):
+        """
+        Whether the input is an uncompressed file that can be memory-mapped.
+        """
+        if self.member:
+            return False
+        magic = _sniff(self.path)
+        return not (magic.startswith(GZIP_MAGIC) or magic == ZSTD_MAGIC)
+
+    @property
+    def size(self):
+        """
+        The size of the input in bytes, uncompressed for zip members.
+        """
+        if self.member:
+            with zipfile.ZipFile(self.path) as bundle:
+                return bundle.getinfo(self.member).file_size
+        return os.path.getsize(self.path)
+
+    def open_binary(self):
+        if self.member:
+            return zipfile.ZipFile(self.path).open(self.member)
+        return open_binary_input(self.path)
+
+    def open(self, encoding=None, newline=None, errors=None):
+        return io.TextIOWrapper(self.open_binary(), encoding=encoding, newline=newline, errors=errors)
+
+    def __repr__(self):
+        return f"InputFile({self.name!r})"
+
+
+def zip_members(path):
+    """
+    Yields an InputFile for every file in a zip bundle, skipping
+    directories and macOS resource forks.
+    """
+    with zipfile.ZipFile(path) as bundle:
+        for info in bundle.infolist():
+            if info.is_dir() or info.filename.startswith("__MACOSX/"):
+                continue
+            yield InputFile(path, info.filename)
+
+
+def list_inputs(input_files_dir, input_files):
+    """
+    Returns the inputs found in <input_files>, the entries of
+    <input_files_dir>; zip bundles are expanded into their members.
+    """
+    inputs = []
+    for input_file in input_files:
+        path = os.path.join(input_files_dir, input_file)
+        if os.path.isfile(path) and zipfile.is_zipfile(path):
+            inputs.extend(zip_members(path))
+        else:
+            inputs.append(InputFile(path))
+    return inputs
+
+
+def input_files_in(path):
+    """
+    Returns the inputs in a directory, sorted by name so that runs don't
+    depend on the order the filesystem lists them in, or the members of a
+    zip bundle.
+    """
+    if os.path.isfile(path) and zipfile.is_zipfile(path):
+        return list(zip_members(path))
+    return list_inputs(path, sorted(os.listdir(path)))
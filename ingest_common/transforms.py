@@ -0,0 +1,75 @@
+"""
+Named value transforms that can be referenced from a mapping spec.
+
+A transform takes the values of the CSV columns listed in the spec and
+returns the string to store in the CanDIGv1 field.
+
+Transforms declared @pure() only depend on their arguments.  Their value
+domains are small (a handful of sites, dates, histologies), so the mapping
+engine memoizes them, with a bounded memo per transform: most rows then
+cost a dictionary lookup.  Constant lookup tables live at module level
+rather than being rebuilt on every call.
+"""
+
+# distinct arguments whose results are kept, per transform and engine
+MEMO_SIZE = 4096
+
+SITE_PROVINCES = {"BCCA Vancouver Cancer Centre": "British Columbia",
+                  "Princess Margaret Cancer Centre": "Ontario"}
+
+
+def pure(maxsize=MEMO_SIZE):
+    """
+    Declares a transform pure, so that the mapping engine memoizes the
+    results of up to <maxsize> distinct arguments.
+    """
+    def declare(function):
+        function.memo_size = maxsize
+        return function
+    return declare
+
+
+@pure()
+def date_from_datetime(datetime_str):
+    """
+    Give an string YY/MM/DD HH:MM:SS, return just the date string.
+    """
+    # doing this in the simplest possible way now - just returning
+    # the first part of the string split at whitespace.  No validation
+    # done.
+    words = datetime_str.split()
+    if not words:
+        return ""
+    return words[0]
+
+
+@pure()
+def province_from_site(site_str):
+    """
+    Infers the province from the site string
+    """
+    return SITE_PROVINCES.get(site_str.strip(), "Unknown")
+
+
+@pure()
+def lower(s):
+    """
+    Lowercases the value.
+    """
+    return s.lower()
+
+
+@pure()
+def strip_quotes(s):
+    """
+    Removes surrounding double quotes from the value.
+    """
+    return s.strip('"')
+
+
+TRANSFORMS = {
+    "date_from_datetime": date_from_datetime,
+    "province_from_site": province_from_site,
+    "lower": lower,
+    "strip_quotes": strip_quotes
+}
@@ -0,0 +1,421 @@
+"""
+Continuous ingest of drop folders.
+
+A Watcher reports what changed in a directory, a batch at a time:
+
+    watcher = Watcher(input_dir)
+    for changes in watcher.batches():
+        ...   # changes.added, changes.changed, changes.removed: file names
+
+It compares listings of the directory (names, sizes and modification
+times), so no change is ever missed, and is woken up by inotify on Linux or
+polls every few seconds elsewhere.  A batch is only reported once the
+directory has been quiet for <debounce> seconds: an export copied in file
+by file becomes a single batch, and a file still being written isn't read
+half way.  The first batch lists every file already there.  Hidden files
+and the .tmp/.part files of copies in progress are ignored.
+
+An InputCache keeps the batches read_batches() returned for every file of
+the directory, and the patients each file has rows for, so that a new batch
+only reads the files that were added or changed.  Rows are kept as tuples of
+values sharing the header of their file.  That is every mapped row of the
+directory held in memory for as long as the watch runs.
+
+watch_inputs() keeps one engine for the whole watch.  localIds are numbered
+per patient across files and vital status is finalized over all of them, so
+the mapped output of one file can't be reused on its own; instead the
+patients with rows in the files that changed, before or after the change,
+are forgotten by the engine and mapped again from the rows of every file,
+in the order of a cold run, and only they are finalized again.  The other
+patients are neither mapped nor encoded again: the output is rewritten
+whole, since readers only ever see a complete one, but from the JSON of
+their entries kept since they were last written.  Patients mapped again
+move to the end of the output.
+
+run_watcher() runs the loop shared by every --watch mode: it reports what
+is watched, hands each batch to a function, and stops cleanly on Ctrl-C or
+SIGTERM.
+"""
+
+import collections
+import contextlib
+import ctypes
+import ctypes.util
+import os
+import select
+import signal
+import sys
+import time
+
+from ingest_common.accumulator import MetadataWriter
+from ingest_common.scan import read_batches, ROWS, PATIENTS, ERROR
+from ingest_common.streams import list_inputs, open_output
+
+DEBOUNCE = 2.0
+POLL_INTERVAL = 5.0
+
+IGNORED_SUFFIXES = (".tmp", ".part", ".partial", "~")
+
+# inotify(7): the events that can change a listing of the directory
+IN_MODIFY = 0x002
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+Changes = collections.namedtuple("Changes", "added changed removed")
+
+
+def _inotify(path):
+    """
+    Returns a non-blocking inotify descriptor watching <path>, or None where
+    inotify isn't available.
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, os.fsencode(path), WATCH_MASK) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+def is_ignored(name):
+    """
+    Whether a file name is hidden or names a copy in progress.
+    """
+    return name.startswith(".") or name.endswith(IGNORED_SUFFIXES)
+
+
+def diff_listings(old, new):
+    """
+    Returns the Changes from one listing ({name: (size, mtime_ns)}) to
+    another.
+    """
+    return Changes(sorted(new.keys() - old.keys()),
+                   sorted(name for name in new.keys() & old.keys() if new[name] != old[name]),
+                   sorted(old.keys() - new.keys()))
+
+
+class Watcher(object):
+    """
+    Reports the files added, changed and removed in a directory.
+    """
+    def __init__(self, path, names=None, debounce=DEBOUNCE, poll_interval=POLL_INTERVAL, use_inotify=True,
+                 excluded=()):
+        """
+        Parameters
+        ==========
+        path: string
+            The directory watched.
+        names: set
+            Only report these file names; all of them by default.
+        excluded: set
+            Never report these file names, e.g. an output written into the
+            directory watched.
+        debounce: float
+            Seconds the directory must stay quiet before a batch is
+            reported.
+        poll_interval: float
+            Seconds between two listings when nothing wakes the watcher up.
+        use_inotify: bool
+            Use inotify when available, rather than polling.
+
+        """
+        self.path = path
+        self._names = names
+        self._excluded = frozenset(excluded)
+        self._debounce = debounce
+        self._poll_interval = poll_interval
+        self._fd = _inotify(path) if use_inotify else None
+        self._reported = {}
+
+    @property
+    def uses_inotify(self):
+        return self._fd is not None
+
+    def listing(self):
+        """
+        Returns {name: (size, mtime_ns)} for the files in the directory.
+        """
+        listing = {}
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                if is_ignored(entry.name) or entry.name in self._excluded or \
+                        (self._names is not None and entry.name not in self._names):
+                    continue
+                try:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        listing[entry.name] = (stat.st_size, stat.st_mtime_ns)
+                except FileNotFoundError:
+                    # removed while listing
+                    pass
+        return listing
+
+    def _wait(self, timeout):
+        """
+        Waits up to <timeout> seconds; returns whether inotify reported
+        anything in the meantime.
+        """
+        if self._fd is None:
+            time.sleep(timeout)
+            return False
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return False
+        try:
+            while os.read(self._fd, 64 * 1024):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def batches(self):
+        """
+        Yields the Changes of the directory every time it changed and then
+        stayed quiet for the debounce time.  Runs until interrupted.
+        """
+        while True:
+            listing = self.listing()
+            if listing == self._reported:
+                self._wait(self._poll_interval)
+                continue
+            while True:
+                woken = self._wait(self._debounce)
+                settled = self.listing()
+                if not woken and settled == listing:
+                    break
+                listing = settled
+            changes = diff_listings(self._reported, listing)
+            self._reported = listing
+            yield changes
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def _compact(batch):
+    input_file, kind, items = batch
+    if kind != ROWS or not items:
+        return batch
+    header = tuple(items[0])
+    width = len(header)
+    # rows with more fields than the header keep their extra ones as dicts
+    rows = [tuple(row.values()) if len(row) == width else row for row in items]
+    return input_file, kind, (header, rows)
+
+
+def _patient_getter(header, patient_column):
+    """
+    Returns a function giving the patient id of a compacted row of <header>,
+    None for rows without one.
+    """
+    if patient_column not in header:
+        return lambda row: None if type(row) is tuple else row.get(patient_column)
+    column = header.index(patient_column)
+    return lambda row: row[column] if type(row) is tuple else row.get(patient_column)
+
+
+def _patients(batch, patient_column):
+    """
+    Returns the ids of the patients a compacted batch has rows for.
+    """
+    input_file, kind, items = batch
+    if kind == PATIENTS:
+        return set(items)
+    if kind != ROWS or not items:
+        return set()
+    header, rows = items
+    patients = set(map(_patient_getter(header, patient_column), rows))
+    patients.discard(None)
+    return patients
+
+
+def _only(batch, patients, patient_column):
+    """
+    Returns a compacted batch with the rows of <patients> only.
+    """
+    input_file, kind, items = batch
+    if kind == PATIENTS:
+        return input_file, kind, [patient_id for patient_id in items if patient_id in patients]
+    if kind != ROWS or not items:
+        return batch
+    header, rows = items
+    patient = _patient_getter(header, patient_column)
+    return input_file, kind, (header, [row for row in rows if patient(row) in patients])
+
+
+def _expand(batch):
+    input_file, kind, items = batch
+    if kind != ROWS or not items:
+        return batch
+    header, rows = items
+    return input_file, kind, [dict(zip(header, row)) if type(row) is tuple else row for row in rows]
+
+
+class InputCache(object):
+    """
+    The batches read from every file of a watched directory.
+    """
+    def __init__(self, engine, directory, prefilter=True):
+        """
+        Parameters
+        ==========
+        engine: MappingEngine
+            The engine whose mapping selects the rows read; see
+            scan.read_batches().
+        directory: string
+            The directory watched.
+        prefilter: bool
+            Skip the exports of pages the mapping doesn't use.
+
+        """
+        self._engine = engine
+        self._directory = directory
+        self._prefilter = prefilter
+        self._batches = {}
+        self._patients = {}
+
+    def __len__(self):
+        return len(self._batches)
+
+    def _forget(self, name):
+        self._batches.pop(name, None)
+        return self._patients.pop(name, set())
+
+    def refresh(self, changes):
+        """
+        Reads the files added or changed and forgets the ones removed.
+        Returns (patients, errors): the ids of the patients the files had
+        or now have rows for, and the (input_file, OSError) of the files
+        that couldn't be read; they are left out until they change again.
+        """
+        patients = set()
+        errors = []
+        for name in changes.removed:
+            patients |= self._forget(name)
+        for name in changes.added + changes.changed:
+            patients |= self._forget(name)
+            batches = [_compact(batch) for batch in read_batches(
+                self._engine, list_inputs(self._directory, [name]), self._prefilter)]
+            failed = [(input_file, items) for input_file, kind, items in batches if kind == ERROR]
+            if failed:
+                errors.extend(failed)
+            else:
+                self._batches[name] = batches
+                self._patients[name] = set().union(*(_patients(batch, self._engine.patient_column)
+                                                     for batch in batches))
+                patients |= self._patients[name]
+        return patients, errors
+
+    def batches(self, patients=None):
+        """
+        Yields the batches of every file, in the order a cold run reads them;
+        with the rows of <patients> only, if given.
+        """
+        for name in sorted(self._batches):
+            if patients is not None and self._patients[name].isdisjoint(patients):
+                continue
+            for batch in self._batches[name]:
+                if patients is not None:
+                    batch = _only(batch, patients, self._engine.patient_column)
+                yield _expand(batch)
+
+
+@contextlib.contextmanager
+def replaced_output(path):
+    """
+    Opens a hidden file next to <path> for writing and moves it over <path>
+    once written, so that readers, and watchers of the directory, never see
+    a half written output.
+    """
+    directory, name = os.path.split(path)
+    tmp_path = os.path.join(directory, f".{name}")
+    with open_output(tmp_path) as output_file:
+        yield output_file
+    os.replace(tmp_path, path)
+
+
+def _to_stderr(message):
+    print(message, file=sys.stderr)
+
+
+def run_watcher(watcher, handle, watched, report=None):
+    """
+    Calls handle(changes) for every batch of changes <watcher> reports,
+    until interrupted by Ctrl-C or SIGTERM, then closes the watcher.
+
+    :param str watched: what is watched, named in the first message
+    :param report: called with the messages; printed on standard error by
+        default
+    """
+    report = report or _to_stderr
+    report(f'Watching {watched} ({"inotify" if watcher.uses_inotify else "polling"})')
+    # stop cleanly on SIGTERM too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        for changes in watcher.batches():
+            handle(changes)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+
+def watch_inputs(engine, directory, output, map_batches, finalize, prefilter=True, indent=None, watcher=None):
+    """
+    Maps the CSV exports in <directory> with <engine>, and again every time
+    files are added, changed or removed, reading only those files and
+    mapping only the patients they have rows for, and replaces <output>
+    with the metadata.  Runs until interrupted.
+
+    :param map_batches: called with <engine> and the batches to map
+    :param finalize: called with <engine> and the ids of the patients just
+        mapped, to finalize them
+    """
+    if watcher is None:
+        output_directory, output_name = os.path.split(os.path.abspath(output))
+        excluded = {output_name} if os.path.realpath(output_directory) == os.path.realpath(directory) else ()
+        watcher = Watcher(directory, excluded=excluded)
+    cache = InputCache(engine, directory, prefilter)
+    # the JSON of the entry of every patient not mapped since it was last written
+    encoded = {}
+
+    def handle(changes):
+        start = time.perf_counter()
+        patients, errors = cache.refresh(changes)
+        for input_file, e in errors:
+            print(f'Error opening {input_file.name}: ', e, file=sys.stderr)
+        engine.forget_patients(patients)
+        for patient_id in patients:
+            encoded.pop(patient_id, None)
+        kept = len(engine.metadata())
+        map_batches(engine, cache.batches(patients))
+        mapped = engine.patient_ids()[kept:]
+        finalize(engine, mapped)
+        try:
+            with replaced_output(output) as output_file:
+                writer = MetadataWriter(output_file, indent=indent)
+                for patient_id in engine.patient_ids():
+                    if patient_id not in encoded:
+                        encoded[patient_id] = writer.encode(engine.patient_data(patient_id))
+                    writer.write_encoded(encoded[patient_id])
+                writer.close()
+        except OSError as e:
+            print(f'Error opening {output}: ', e, file=sys.stderr)
+            return
+        print(f'{len(changes.added)} added, {len(changes.changed)} changed, {len(changes.removed)} removed, '
+              f'{len(mapped)} patients mapped: wrote {output} in {time.perf_counter() - start:.1f}s',
+              file=sys.stderr)
+
+    run_watcher(watcher, handle, directory)
@@ -0,0 +1,78 @@
+import io
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from ingest_common.accumulator import CompactStore, dump_metadata, Interner, MetadataView
+
+ENTRIES = [{"Patient": {"patientId": "P-01", "gender": "F"},
+            "Treatment": [{"patientId": "P-01", "localId": "t1"}, {"patientId": "P-01", "localId": "t2"}]},
+           {"Patient": {"patientId": "P-02"}, "Outcome": {"patientId": "P-02", "vitalStatus": "Alive"}}]
+
+
+class InternerTest(unittest.TestCase):
+    def test_shared_instance(self):
+        interner = Interner()
+        first = "".join(["P-", "01"])
+        second = "".join(["P-", "01"])
+        self.assertIsNot(first, second)
+        self.assertIs(interner[first], first)
+        self.assertIs(interner[second], first)
+
+
+class CompactStoreTest(unittest.TestCase):
+    def test_merge(self):
+        store = CompactStore()
+        store.add("P-01", {"Patient": {"patientId": "P-01"}})
+        store.merge("P-01", "Patient", store.record({"gender": "F"}))
+        store.merge("P-01", "Treatment", store.record({"patientId": "P-01", "localId": "t1"}))
+        store.merge("P-01", "Treatment", store.record({"patientId": "P-01", "localId": "t2"}))
+        # adding a group again keeps it
+        store.add("P-01")
+        store.add("P-02", ENTRIES[1])
+        self.assertEqual(list(MetadataView(store)), ENTRIES)
+        self.assertEqual(store.keys(), ["P-01", "P-02"])
+        self.assertIn("P-02", store)
+        self.assertEqual(len(store), 2)
+
+    def test_shapes_shared(self):
+        store = CompactStore()
+        first = store.record({"patientId": "P-01", "gender": "F"})
+        second = store.record({"patientId": "P-02", "gender": "M"})
+        self.assertIs(first[0], second[0])
+
+    def test_get_set_update(self):
+        store = CompactStore()
+        store.add("P-01", ENTRIES[0])
+        self.assertEqual(store.get("P-01", ("Patient", "Outcome")), {"Patient": ENTRIES[0]["Patient"]})
+
+        # changes to what get() returns are only kept once set
+        data = store.get("P-01")
+        data["Patient"]["gender"] = "M"
+        self.assertEqual(store.get("P-01"), ENTRIES[0])
+
+        store.update("P-01", {"Outcome": {"patientId": "P-01"}, "Patient": data["Patient"]})
+        self.assertEqual(store.get("P-01"), {"Patient": {"patientId": "P-01", "gender": "M"},
+                                             "Treatment": ENTRIES[0]["Treatment"],
+                                             "Outcome": {"patientId": "P-01"}})
+        store.set("P-01", ENTRIES[1])
+        self.assertEqual(store.get("P-01"), ENTRIES[1])
+
+
+class DumpTest(unittest.TestCase):
+    def test_same_as_json_dump(self):
+        for entries in (ENTRIES, []):
+            for indent in (None, 2, 4):
+                output_file = io.StringIO()
+                dump_metadata(iter(entries), output_file, indent=indent)
+                self.assertEqual(output_file.getvalue(), json.dumps({"metadata": entries}, indent=indent))
+
+        output_file = io.StringIO()
+        dump_metadata(ENTRIES, output_file, metadata_key="pipeline_metadata")
+        self.assertEqual(output_file.getvalue(), json.dumps({"pipeline_metadata": ENTRIES}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from ingest_common.backends import drop_indexes, is_postgres, open_backend, remove_repo, SqliteBackend, sqlite_tables
+
+
+class _Repo(object):
+    """
+    The parts of a SqlDataRepository and its peewee database the backend
+    uses, over a sqlite3 connection.
+    """
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.database = self
+
+    def execute_sql(self, sql, params=()):
+        return self.connection.execute(sql, params)
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+def _create(path, rows):
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE Individual (id TEXT PRIMARY KEY, name TEXT)")
+    connection.execute("CREATE UNIQUE INDEX individual_name_unique ON Individual (id, name)")
+    connection.execute("CREATE INDEX individual_name ON Individual (name)")
+    connection.executemany("INSERT INTO Individual VALUES (?, ?)", rows)
+    connection.commit()
+    connection.close()
+
+
+class BackendTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "repo.db")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_open_backend(self):
+        self.assertTrue(is_postgres("postgresql://user@host/db"))
+        self.assertTrue(is_postgres("postgres://user@host/db"))
+        self.assertFalse(is_postgres("repo.db"))
+        backend = open_backend(self.path)
+        self.assertIsInstance(backend, SqliteBackend)
+        self.assertEqual(backend.local_path("staging"), f"{self.path}.staging")
+
+    def test_drop_indexes(self):
+        _create(self.path, [])
+        repo = _Repo(self.path)
+        self.assertEqual(drop_indexes(repo.database), ["CREATE INDEX individual_name ON Individual (name)"])
+        indexes = [name for (name,) in repo.execute_sql("SELECT name FROM sqlite_master WHERE type = 'index'")]
+        self.assertNotIn("individual_name", indexes)
+        self.assertIn("individual_name_unique", indexes)
+        self.assertEqual(sqlite_tables(repo.connection), ["Individual"])
+        repo.close()
+
+    def test_copy_rows(self):
+        _create(self.path, [("I-0", "dataset")])
+        staging = [os.path.join(self.directory.name, f"repo.db.shard-{i}") for i in range(2)]
+        _create(staging[0], [("I-0", "dataset"), ("I-1", "one")])
+        _create(staging[1], [("I-0", "dataset"), ("I-2", "two")])
+
+        backend = SqliteBackend(self.path)
+        backend.repo = _Repo(self.path)
+        backend.copy_rows(staging, rebuild_indexes=True)
+        self.assertEqual(backend.repo.execute_sql("SELECT * FROM Individual ORDER BY id").fetchall(),
+                         [("I-0", "dataset"), ("I-1", "one"), ("I-2", "two")])
+        # the indexes dropped for the copy are back
+        indexes = [name for (name,) in backend.repo.execute_sql("SELECT name FROM sqlite_master WHERE type = 'index'")]
+        self.assertIn("individual_name", indexes)
+        backend.close()
+
+    def test_remove_repo(self):
+        staging = os.path.join(self.directory.name, "repo.db.shard-0")
+        _create(staging, [("I-0", "dataset")])
+        for suffix in ("-journal", ".staging"):
+            open(staging + suffix, "w").close()
+        open(self.path, "w").close()
+        remove_repo(staging)
+        self.assertEqual(os.listdir(self.directory.name), ["repo.db"])
+        # nothing left to remove
+        remove_repo(staging)
+
+
+if __name__ == '__main__':
+    unittest.main()
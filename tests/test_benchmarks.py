@@ -0,0 +1,74 @@
+"""
+Generates a tiny synthetic cohort with benchmarks/generate_cohort.py, and
+runs an ingest script on it with --profile and the benchmark harness.
+"""
+
+import json
+import os
+import pstats
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+COMPARISON = os.path.join(ROOT, "COMPARISON", "data_ingest.py")
+
+sys.path.insert(0, ROOT)
+from ingest_common.mapping import load_engine
+
+REPORTS = ["allocations.txt", "cprofile.pstats", "cprofile.txt", "summary.json"]
+
+
+class BenchmarkTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.env = dict(os.environ, DHDP_INGEST_CACHE=os.path.join(cls.directory.name, "cache"))
+        cls.cohort = os.path.join(cls.directory.name, "cohort")
+        subprocess.run([sys.executable, os.path.join(ROOT, "benchmarks", "generate_cohort.py"), cls.cohort,
+                        "--patients", "5"], check=True, env=cls.env, stdout=subprocess.DEVNULL)
+        with open(os.path.join(cls.cohort, "manifest.json")) as f:
+            cls.manifest = json.load(f)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_profile(self):
+        report_dir = os.path.join(self.directory.name, "profile")
+        output = os.path.join(self.directory.name, "comparison.json")
+        subprocess.run([sys.executable, COMPARISON, "--no-schema-check", "--profile", report_dir,
+                        os.path.join(self.cohort, "comparison"), output],
+                       check=True, env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.assertEqual(sorted(os.listdir(report_dir)), REPORTS)
+        with open(os.path.join(report_dir, "summary.json")) as f:
+            summary = json.load(f)
+        self.assertEqual(list(summary["stages"]), ["load_mapping", "read", "finalize", "write"])
+
+        # a row count for every page mapped, and a timing for every table it maps to
+        sections = load_engine(os.path.join(ROOT, "COMPARISON", "mapping.json"),
+                               os.path.join(self.directory.name, "cache")).sections
+        pages = self.manifest["cohorts"]["comparison"]["pages"]
+        self.assertEqual(summary["rows"], {page.lower(): rows for page, rows in pages.items()
+                                           if page.lower() in sections})
+        self.assertEqual({key.split(": ")[0] for key in summary["timings"]}, set(summary["rows"]))
+
+        # read in the main thread, where cProfile sees it
+        functions = {name for _, _, name in pstats.Stats(os.path.join(report_dir, "cprofile.pstats")).stats}
+        self.assertIn("read_batches", functions)
+
+    def test_benchmarks(self):
+        result = subprocess.run([sys.executable, os.path.join(ROOT, "benchmarks", "run_benchmarks.py"),
+                                 self.cohort, "--workdir", os.path.join(self.directory.name, "bench"),
+                                 "--targets", "comparison,cbioportal"],
+                                env=self.env, capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        lines = {line.split(":")[0].strip(): line for line in result.stdout.splitlines()}
+        for target in ("comparison", "cbioportal"):
+            self.assertIn(f"{target}: {self.manifest['cohorts'][target]['rows']} rows, ", lines[target])
+            self.assertTrue(os.path.exists(os.path.join(self.directory.name, "bench", f"{target}.json")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from ingest_common import columnar
+from ingest_common.columnar import is_columnar, manifest_path, MANIFEST, read_tables, rename_columns, split_columns, \
+    write_tables
+
+ENTRIES = [
+    {"Patient": {"patientId": "P-01", "gender": "F"},
+     "Treatment": [{"patientId": "P-01", "localId": "P-01_treatment_1", "startDate": "02/02/2016"},
+                   {"localId": "P-01_treatment_2", "stopDate": "03/03/2016"}]},
+    {"Patient": {"patientId": "P-02", "dateOfDeath": "2/26/2018"},
+     "Outcome": {"patientId": "P-02", "localId": "P-02_outcome_1", "vitalStatus": "Dead"}}
+]
+
+TABLES = {
+    "Patient": [{"patientId": "P-01", "gender": "F"}, {"patientId": "P-02", "dateOfDeath": "2/26/2018"}],
+    "Treatment": [{"patientId": "P-01", "localId": "P-01_treatment_1", "startDate": "02/02/2016"},
+                  {"localId": "P-01_treatment_2", "stopDate": "03/03/2016", "patientId": "P-01"}],
+    "Outcome": [{"patientId": "P-02", "localId": "P-02_outcome_1", "vitalStatus": "Dead"}]
+}
+
+
+class ColumnarTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def assertTables(self, tables):
+        self.assertEqual([(table, list(records)) for table, records in tables], list(TABLES.items()))
+
+    def test_split_columns(self):
+        tables = split_columns(ENTRIES)
+        self.assertEqual(list(tables), ["Patient", "Treatment", "Outcome"])
+        self.assertEqual(tables["Patient"], {"patientId": ["P-01", "P-02"], "gender": ["F", None],
+                                             "dateOfDeath": [None, "2/26/2018"]})
+        self.assertEqual(tables["Treatment"], {"patientId": ["P-01", "P-01"],
+                                               "localId": ["P-01_treatment_1", "P-01_treatment_2"],
+                                               "startDate": ["02/02/2016", None],
+                                               "stopDate": [None, "03/03/2016"]})
+
+    def test_round_trip(self):
+        manifest = write_tables(ENTRIES, self.directory.name)
+        self.assertTrue(is_columnar(manifest))
+        self.assertEqual(manifest["tables"]["Treatment"]["rows"], 2)
+        self.assertEqual(manifest["tables"]["Treatment"]["columns"],
+                         ["patientId", "localId", "startDate", "stopDate"])
+        self.assertEqual(manifest_path(self.directory.name), os.path.join(self.directory.name, MANIFEST))
+
+        # missing values are dropped again
+        self.assertTables(read_tables(self.directory.name))
+        self.assertTables(read_tables(manifest_path(self.directory.name), manifest))
+        self.assertEqual([len(records) for _, records in read_tables(self.directory.name)], [2, 2, 1])
+
+    def test_tables_read_when_iterated(self):
+        write_tables(ENTRIES, self.directory.name)
+        tables = list(read_tables(self.directory.name))
+        for name in os.listdir(self.directory.name):
+            if name != MANIFEST:
+                os.remove(os.path.join(self.directory.name, name))
+        self.assertEqual([len(records) for _, records in tables], [2, 2, 1])
+        with self.assertRaises(OSError):
+            list(tables[0][1])
+
+    def test_json_tables_without_pyarrow(self):
+        pyarrow = columnar._pyarrow
+        columnar._pyarrow = lambda: None
+        try:
+            manifest = write_tables(ENTRIES, self.directory.name)
+        finally:
+            columnar._pyarrow = pyarrow
+        self.assertEqual({info["path"] for info in manifest["tables"].values()},
+                         {"Patient.json.gz", "Treatment.json.gz", "Outcome.json.gz"})
+        self.assertTables(read_tables(self.directory.name))
+
+    def test_renamed_columns(self):
+        manifest = write_tables(ENTRIES, self.directory.name)
+        renamed = rename_columns(manifest, {"Treatment": {"startDate": "treatmentStartDate"}})
+        renamed = rename_columns(renamed, {"Treatment": {"treatmentStartDate": "dateOfStart"}})
+        # the tables and the manifest given are left as they were
+        self.assertNotIn("renames", manifest["tables"]["Treatment"])
+        self.assertEqual(renamed["tables"]["Treatment"]["renames"], {"startDate": "dateOfStart"})
+
+        tables = dict(read_tables(manifest_path(self.directory.name), renamed))
+        self.assertEqual(list(tables["Treatment"])[0], {"patientId": "P-01", "localId": "P-01_treatment_1",
+                                                        "dateOfStart": "02/02/2016"})
+        self.assertEqual(list(tables["Patient"]), TABLES["Patient"])
+
+    def test_not_columnar(self):
+        self.assertFalse(is_columnar({"metadata": ENTRIES}))
+        self.assertFalse(is_columnar({"shards": []}))
+
+
+if __name__ == '__main__':
+    unittest.main()
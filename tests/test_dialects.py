@@ -0,0 +1,79 @@
+import codecs
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from ingest_common import dialects
+from ingest_common.dialects import CsvFormat, FormatCache, sniff, sniff_encoding, sniff_input
+from ingest_common.streams import input_files_in
+
+TEXT = "#comment, with a comma\nPatient ID\tSEX\tCANCER TYPE\nP-01\tF\tSarcoma; leio\nP-02\tM\tMélanome\n"
+
+
+class SniffTest(unittest.TestCase):
+    def test_encodings(self):
+        self.assertEqual(sniff_encoding(TEXT.encode("utf-8")), "utf-8")
+        self.assertEqual(sniff_encoding(codecs.BOM_UTF8 + TEXT.encode("utf-8")), "utf-8-sig")
+        self.assertEqual(sniff_encoding(TEXT.encode("utf-16")), "utf-16")
+        self.assertEqual(sniff_encoding(TEXT.encode("utf-32")), "utf-32")
+        self.assertEqual(sniff_encoding(TEXT.encode("cp1252")), "cp1252")
+        # a sample cut in the middle of a character is still UTF-8
+        self.assertEqual(sniff_encoding("é".encode("utf-8")[:1]), "utf-8")
+
+    def test_delimiters(self):
+        text = "# comment, with a comma\nPatient ID\tSEX\tAGE\nP-01\tF\t40\nP-02\tM\t41\n"
+        for delimiter in ",\t;|":
+            sample = text.replace("\t", delimiter).encode("utf-8")
+            self.assertEqual(sniff(sample).delimiter, delimiter)
+        # a single column
+        self.assertEqual(sniff(b"Subject\nP-01\nP-02\n").delimiter, ",")
+
+    def test_rows(self):
+        for encoding in ("utf-8", "utf-16", "cp1252"):
+            csv_format = sniff(TEXT.encode(encoding))
+            with io.TextIOWrapper(io.BytesIO(TEXT.encode(encoding)), csv_format.encoding,
+                                  errors=csv_format.errors, newline="") as text_file:
+                self.assertEqual(list(csv_format.reader(text_file)),
+                                 [{"Patient ID": "P-01", "SEX": "F", "CANCER TYPE": "Sarcoma; leio"},
+                                  {"Patient ID": "P-02", "SEX": "M", "CANCER TYPE": "Mélanome"}])
+
+    def test_fallback(self):
+        # a Windows-1252 byte in an otherwise UTF-8 file
+        self.assertEqual(b"caf\xc3\xa9 \x93quoted\x94 \x81".decode("utf-8", dialects.FALLBACK_ERRORS),
+                         "café “quoted” \x81")
+        self.assertEqual(CsvFormat("utf-16").errors, "strict")
+
+
+class InputTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name, data):
+        path = os.path.join(self.directory.name, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_sniff_input(self):
+        csv_format = sniff_input(self.write("clinical.tsv", TEXT.encode("utf-16")))
+        self.assertEqual((csv_format.encoding, csv_format.delimiter), ("utf-16", "\t"))
+
+    def test_format_cache(self):
+        self.write("a.csv", b"Subject;DataPageName\nP-01;Death\n")
+        self.write("b.csv", b"Subject;DataPageName\nP-02;Death\n")
+        self.write("c.csv", codecs.BOM_UTF16_LE + "Subject,DataPageName\n".encode("utf-16-le"))
+        formats = FormatCache()
+        a, b, c = [formats.format_of(input_file) for input_file in input_files_in(self.directory.name)]
+        self.assertIs(a, b)
+        self.assertEqual(a.delimiter, ";")
+        self.assertEqual((c.encoding, c.delimiter), ("utf-16", ","))
+
+
+if __name__ == '__main__':
+    unittest.main()
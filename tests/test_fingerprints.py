@@ -0,0 +1,88 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from ingest_common.fingerprints import DUPLICATE, fingerprint, FingerprintStore, INSERT, UNCHANGED, UPDATE
+
+FIRST = {("Patient", "P-01"): {"patientId": "P-01", "gender": "F"},
+         ("Patient", "P-02"): {"patientId": "P-02", "gender": "M"},
+         ("Diagnosis", "P-01_diagnosis_1"): {"patientId": "P-01", "cancerType": "sarcoma"}}
+
+
+def _load(store, records):
+    """
+    Plans and records <records> as validate.py --diff does, and returns the
+    plans and the records to delete.
+    """
+    store.begin()
+    plans = {}
+    for (table, local_id), record in records.items():
+        record_fingerprint = fingerprint(record)
+        plans[(table, local_id)] = store.plan(table, local_id, record_fingerprint)
+        if plans[(table, local_id)] != UNCHANGED:
+            store.record(table, local_id, record_fingerprint)
+    unseen = store.unseen()
+    for table, local_id in unseen:
+        store.forget(table, local_id)
+    store.commit()
+    return plans, sorted(unseen)
+
+
+class FingerprintTest(unittest.TestCase):
+    def test_key_order_ignored(self):
+        self.assertEqual(fingerprint({"a": 1, "b": "é"}), fingerprint({"b": "é", "a": 1}))
+        self.assertNotEqual(fingerprint({"a": 1}), fingerprint({"a": "1"}))
+
+
+class FingerprintStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "repo.db.fingerprints")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_diff_loads(self):
+        store = FingerprintStore(self.path)
+        plans, deleted = _load(store, FIRST)
+        self.assertEqual(set(plans.values()), {INSERT})
+        self.assertEqual(deleted, [])
+        store.close()
+
+        second = dict(FIRST)
+        second[("Patient", "P-02")] = {"patientId": "P-02", "gender": "F"}
+        second[("Patient", "P-03")] = {"patientId": "P-03"}
+        del second[("Diagnosis", "P-01_diagnosis_1")]
+        store = FingerprintStore(self.path)
+        plans, deleted = _load(store, second)
+        self.assertEqual(plans, {("Patient", "P-01"): UNCHANGED, ("Patient", "P-02"): UPDATE,
+                                 ("Patient", "P-03"): INSERT})
+        self.assertEqual(deleted, [("Diagnosis", "P-01_diagnosis_1")])
+
+        # loading the same input again changes nothing
+        plans, deleted = _load(store, second)
+        self.assertEqual(set(plans.values()), {UNCHANGED})
+        self.assertEqual(deleted, [])
+        store.close()
+
+    def test_duplicates_within_a_load(self):
+        store = FingerprintStore(self.path)
+        _load(store, FIRST)
+        store.begin()
+        self.assertEqual(store.plan("Patient", "P-01", "changed"), UPDATE)
+        self.assertEqual(store.plan("Patient", "P-01", fingerprint(FIRST[("Patient", "P-01")])), DUPLICATE)
+        self.assertEqual(store.plan("Patient", "P-04", "new"), INSERT)
+        self.assertEqual(store.plan("Patient", "P-04", "new"), DUPLICATE)
+        # the first plan of a localId is kept
+        self.assertEqual((store.planned("Patient", "P-01"), store.planned("Patient", "P-04")), (UPDATE, INSERT))
+        self.assertIsNone(store.planned("Patient", "P-02"))
+
+        store.begin()
+        self.assertEqual(store.plan("Patient", "P-04", "new"), INSERT)
+        store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
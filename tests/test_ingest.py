@@ -0,0 +1,205 @@
+"""
+Runs the ingest scripts on the small cohorts in tests/data and compares
+their output, byte for byte, with tests/data/expected, which is what the
+original scripts wrote for the same input files read in name order.
+"""
+
+import gzip
+import importlib.util
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+import zipfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+COMPARISON = os.path.join(ROOT, "COMPARISON", "data_ingest.py")
+INSPIRE_RAVE = os.path.join(ROOT, "INSPIRE", "medidata_rave", "data_ingest.py")
+CBIOPORTAL = os.path.join(ROOT, "INSPIRE", "cBioportal_clinphen", "data_ingest.py")
+
+sys.path.insert(0, ROOT)
+from ingest_common.columnar import read_tables
+from ingest_common.shards import manifest_shards, shard_of
+
+
+class IngestTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.directory.name, "out.json")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_script(self, script, input_path, output, *options):
+        """
+        Runs <script> on <input_path>, with its compiled plans cached in
+        the test's directory.
+        """
+        env = dict(os.environ, DHDP_INGEST_CACHE=os.path.join(self.directory.name, "cache"))
+        subprocess.run([sys.executable, script, "--no-schema-check", *options, input_path, output],
+                       check=True, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def ingest(self, script, input_path, *options, output=None):
+        """
+        Runs <script> on <input_path> and returns the bytes written.
+        """
+        output = output or self.output
+        self.run_script(script, input_path, output, *options)
+        with open(output, "rb") as f:
+            return f.read()
+
+    def assertExpected(self, output, name):
+        with open(os.path.join(DATA, "expected", f"{name}.json"), "rb") as f:
+            self.assertEqual(output, f.read())
+
+
+class GoldenOutputTest(IngestTestCase):
+    def test_comparison(self):
+        self.assertExpected(self.ingest(COMPARISON, os.path.join(DATA, "comparison")), "comparison")
+
+    def test_inspire_rave(self):
+        self.assertExpected(self.ingest(INSPIRE_RAVE, os.path.join(DATA, "inspire_rave")), "inspire_rave")
+
+    def test_cbioportal(self):
+        self.assertExpected(self.ingest(CBIOPORTAL, os.path.join(DATA, "cbioportal.csv")), "cbioportal")
+
+    def test_without_prefilter(self):
+        self.assertExpected(self.ingest(COMPARISON, os.path.join(DATA, "comparison"), "--no-prefilter"),
+                            "comparison")
+        self.assertExpected(self.ingest(INSPIRE_RAVE, os.path.join(DATA, "inspire_rave"), "--no-prefilter"),
+                            "inspire_rave")
+
+    def test_without_pipeline(self):
+        self.assertExpected(self.ingest(COMPARISON, os.path.join(DATA, "comparison"), "--no-pipeline"),
+                            "comparison")
+        self.assertExpected(self.ingest(INSPIRE_RAVE, os.path.join(DATA, "inspire_rave"), "--no-pipeline"),
+                            "inspire_rave")
+
+    def test_with_progress(self):
+        status_path = os.path.join(self.directory.name, "status.json")
+        for script, input_path, name in ((COMPARISON, os.path.join(DATA, "comparison"), "comparison"),
+                                         (CBIOPORTAL, os.path.join(DATA, "cbioportal.csv"), "cbioportal")):
+            self.assertExpected(self.ingest(script, input_path, "--progress", "--status-file", status_path), name)
+            with open(status_path) as f:
+                status = json.load(f)
+            self.assertEqual(status["state"], "done")
+            self.assertEqual(status["done"], status["total"])
+
+
+class CompressedTest(IngestTestCase):
+    def test_gzip_inputs_and_output(self):
+        inputs = os.path.join(self.directory.name, "comparison")
+        os.mkdir(inputs)
+        for name in os.listdir(os.path.join(DATA, "comparison")):
+            with open(os.path.join(DATA, "comparison", name), "rb") as f, \
+                    gzip.open(os.path.join(inputs, f"{name}.gz"), "wb") as compressed:
+                shutil.copyfileobj(f, compressed)
+        output = os.path.join(self.directory.name, "out.json.gz")
+        self.assertExpected(gzip.decompress(self.ingest(COMPARISON, inputs, output=output)), "comparison")
+
+    def test_zip_bundle(self):
+        bundle = os.path.join(self.directory.name, "inspire_rave.zip")
+        with zipfile.ZipFile(bundle, "w") as zip_file:
+            for name in sorted(os.listdir(os.path.join(DATA, "inspire_rave"))):
+                zip_file.write(os.path.join(DATA, "inspire_rave", name), f"export/{name}")
+        self.assertExpected(self.ingest(INSPIRE_RAVE, bundle), "inspire_rave")
+
+
+class UnreadableInputTest(IngestTestCase):
+    def test_error_reported(self):
+        for script, name in ((COMPARISON, "comparison"), (INSPIRE_RAVE, "inspire_rave")):
+            inputs = os.path.join(self.directory.name, name)
+            shutil.copytree(os.path.join(DATA, name), inputs)
+            with open(os.path.join(inputs, "demo.csv"), "rb") as f:
+                data = bytearray(gzip.compress(f.read()))
+            # a wrong CRC
+            data[-8] ^= 0xff
+            with open(os.path.join(inputs, "demo.csv.gz"), "wb") as f:
+                f.write(data)
+            env = dict(os.environ, DHDP_INGEST_CACHE=os.path.join(self.directory.name, "cache"))
+            result = subprocess.run([sys.executable, script, "--no-schema-check", inputs, self.output],
+                                    env=env, capture_output=True, text=True)
+            self.assertEqual(result.returncode, 1, name)
+            self.assertIn(f"Error opening {os.path.join(inputs, 'demo.csv.gz')}", result.stdout)
+            self.assertEqual(result.stderr, "")
+            self.assertFalse(os.path.exists(self.output))
+
+
+class DialectTest(IngestTestCase):
+    def test_utf16_semicolons(self):
+        inputs = os.path.join(self.directory.name, "comparison")
+        os.mkdir(inputs)
+        for name in os.listdir(os.path.join(DATA, "comparison")):
+            with open(os.path.join(DATA, "comparison", name), newline="") as f:
+                text = f.read()
+            with open(os.path.join(inputs, name), "w", encoding="utf-16", newline="") as f:
+                f.write(text.replace(",", ";"))
+        self.assertExpected(self.ingest(COMPARISON, inputs), "comparison")
+
+    def test_tab_separated_with_comments(self):
+        with open(os.path.join(DATA, "cbioportal.csv"), newline="") as f:
+            text = f.read()
+        path = os.path.join(self.directory.name, "cbioportal.txt")
+        with open(path, "w", encoding="utf-8-sig", newline="") as f:
+            f.write("#Patient Identifier,Sample Identifier\n#STRING,STRING\n" + text.replace(",", "\t"))
+        self.assertExpected(self.ingest(CBIOPORTAL, path), "cbioportal")
+
+
+class ShardedTest(IngestTestCase):
+    def test_shards_partition_the_output(self):
+        with open(os.path.join(DATA, "expected", "inspire_rave.json")) as f:
+            expected = json.load(f)["metadata"]
+        self.ingest(INSPIRE_RAVE, os.path.join(DATA, "inspire_rave"), "--shards", "3")
+        with open(self.output) as f:
+            manifest = json.load(f)
+        for shard, path in enumerate(manifest_shards(manifest, self.output)):
+            with open(path) as f:
+                self.assertEqual(json.load(f)["metadata"],
+                                 [entry for entry in expected if shard_of(entry["Patient"]["patientId"], 3) == shard])
+
+
+class ColumnarTest(IngestTestCase):
+    def test_tables_hold_the_output(self):
+        for script, input_path, name in ((COMPARISON, os.path.join(DATA, "comparison"), "comparison"),
+                                         (CBIOPORTAL, os.path.join(DATA, "cbioportal.csv"), "cbioportal")):
+            with open(os.path.join(DATA, "expected", f"{name}.json")) as f:
+                expected = json.load(f)["metadata"]
+            output = os.path.join(self.directory.name, name)
+            self.run_script(script, input_path, output, "--columnar")
+            tables = {}
+            for entry in expected:
+                for table, records in entry.items():
+                    for record in [records] if isinstance(records, dict) else records:
+                        record.setdefault("patientId", entry["Patient"]["patientId"])
+                        tables.setdefault(table, []).append(record)
+            self.assertEqual({table: list(records) for table, records in read_tables(output)}, tables)
+
+
+@unittest.skipIf(importlib.util.find_spec("candig"), "candig is installed")
+class SchemaCheckTest(IngestTestCase):
+    def check(self, *options):
+        env = dict(os.environ, DHDP_INGEST_CACHE=os.path.join(self.directory.name, "cache"))
+        return subprocess.run([sys.executable, CBIOPORTAL, *options, os.path.join(DATA, "cbioportal.csv"),
+                               self.output], env=env, capture_output=True, text=True)
+
+    def test_unknown_field_names(self):
+        result = self.check()
+        self.assertEqual(result.returncode, 0)
+        self.assertIn("only the localId fields of the mapping are checked", result.stderr)
+        with open(self.output, "rb") as f:
+            self.assertExpected(f.read(), "cbioportal")
+
+        os.remove(self.output)
+        result = self.check("--strict-schema")
+        self.assertEqual(result.returncode, 1)
+        self.assertIn("the field names of the CanDIG tables are unknown", result.stdout)
+        self.assertFalse(os.path.exists(self.output))
+
+
+if __name__ == '__main__':
+    unittest.main()
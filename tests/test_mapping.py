@@ -0,0 +1,261 @@
+import importlib.util
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+sys.path.insert(0, ROOT)
+from ingest_common import mapping
+from ingest_common.mapping import compile_spec, load_engine, load_plan, MappingEngine, MappingSpecError, \
+    required_columns
+from ingest_common.scan import read_batches
+from ingest_common.streams import input_files_in
+from ingest_common.transforms import date_from_datetime, province_from_site, strip_quotes
+
+SPEC = {
+    "version": 1,
+    "patient_column": "Subject",
+    "section_column": "DataPageName",
+    "row_key": ["RecordId"],
+    "counters": {"scope": "table", "tables": ["Treatment", "Outcome"],
+                 "local_id": "{@patient}_{@table}_{@count}"},
+    "sections": {
+        "Demographics": [
+            {"table": "Patient", "fields": {
+                "patientId": "Subject",
+                "gender": "GENDER",
+                "provinceOfResidence": {"transform": "province_from_site", "args": ["Site"]}
+            }}
+        ],
+        "systemic therapy log": [
+            {"table": "Treatment", "fields": {
+                "patientId": "Subject",
+                "startDate": {"transform": "date_from_datetime", "args": ["STRT_DT"]},
+                "note": {"template": "{@section}/{THER_TX_NAME}"}
+            }}
+        ]
+    }
+}
+
+
+def _row(patient, page, **columns):
+    return dict({"Subject": patient, "DataPageName": page, "Site": "Other"}, **columns)
+
+
+def _map(engine, rows):
+    for row in rows:
+        engine.update(row)
+    return list(engine.metadata())
+
+
+def _load_script(*path):
+    spec = importlib.util.spec_from_file_location("data_ingest", os.path.join(ROOT, *path, "data_ingest.py"))
+    script = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(script)
+    return script
+
+
+def _by_local_id(entries):
+    records = {}
+    for entry in entries:
+        for table, data in entry.items():
+            for record in data if isinstance(data, list) else [data]:
+                if "localId" in record:
+                    records[(table, record["localId"])] = record
+    return records
+
+
+class CompileTest(unittest.TestCase):
+    def test_malformed_specs(self):
+        for spec in ({"version": 2},
+                     {"version": 1, "patient_column": "Subject"},
+                     {"version": 1, "patient_column": "Subject", "sections": {}},
+                     dict(SPEC, counters={"scope": "file"}),
+                     dict(SPEC, sections={"death": [{"table": "Outcome", "fields": {"x": {"transform": "nope"}}}]}),
+                     dict(SPEC, sections={"death": [{"table": "Outcome", "fields": {"x": {"template": "{@when}"}}}]}),
+                     dict(SPEC, sections={"death": [{"table": "Outcome", "fields": {"x": 1}}]})):
+            with self.assertRaises(MappingSpecError):
+                compile_spec(spec)
+
+    def test_required_columns(self):
+        self.assertEqual(required_columns(compile_spec(SPEC)),
+                         {"demographics": ["Subject", "GENDER", "Site"],
+                          "systemic therapy log": ["Subject", "STRT_DT", "THER_TX_NAME"]})
+
+    def test_plan_cached(self):
+        with tempfile.TemporaryDirectory() as directory:
+            spec_path = os.path.join(directory, "mapping.json")
+            with open(spec_path, "w") as f:
+                json.dump(SPEC, f)
+            cache_dir = os.path.join(directory, "cache")
+            plan = load_plan(spec_path, cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            self.assertEqual(load_plan(spec_path, cache_dir), plan)
+
+
+class EngineTest(unittest.TestCase):
+    def test_sections(self):
+        engine = MappingEngine(compile_spec(SPEC))
+        metadata = _map(engine, [
+            _row("P-01", "Demographics", GENDER="F", Site="Princess Margaret Cancer Centre "),
+            _row("P-01", "Systemic Therapy Log", STRT_DT="02/02/2016 1:00", THER_TX_NAME="chemo"),
+            _row("P-02", "Vital Signs"),
+            _row("P-01", "Systemic Therapy Log", STRT_DT="", THER_TX_NAME="radiation")])
+        self.assertEqual(metadata, [{
+            "Patient": {"patientId": "P-01", "gender": "F", "provinceOfResidence": "Ontario"},
+            "Treatment": [
+                {"patientId": "P-01", "startDate": "02/02/2016", "note": "systemic_therapy_log/chemo",
+                 "localId": "P-01_treatment_1"},
+                {"patientId": "P-01", "startDate": "", "note": "systemic_therapy_log/radiation",
+                 "localId": "P-01_treatment_2"}]
+        }])
+
+    def test_unmapped_patients_kept(self):
+        engine = MappingEngine(compile_spec(dict(SPEC, keep_unmapped_patients=True)))
+        self.assertEqual(_map(engine, [_row("P-02", "Vital Signs")]), [{"Patient": {"patientId": "P-02"}}])
+
+    def test_records(self):
+        spec = {"version": 1, "patient_column": "Patient ID",
+                "records": [{"table": "Patient", "fields": {"patientId": "Patient ID", "gender": "SEX"}},
+                            {"table": "Sample", "fields": {"sampleId": "Sample ID", "patientId": "Patient ID"}}]}
+        engine = MappingEngine(compile_spec(spec))
+        metadata = _map(engine, [{"Patient ID": "P-01", "SEX": "F", "Sample ID": "S-1"},
+                                 {"Patient ID": "P-01", "SEX": "F", "Sample ID": "S-2"}])
+        self.assertEqual(metadata, [
+            {"Patient": {"patientId": "P-01", "gender": "F"}, "Sample": {"sampleId": "S-1", "patientId": "P-01"}},
+            {"Patient": {"patientId": "P-01", "gender": "F"}, "Sample": {"sampleId": "S-2", "patientId": "P-01"}}])
+
+    def test_stable_ids_ignore_row_order(self):
+        rows = [_row("P-01", "Systemic Therapy Log", RecordId=str(i), STRT_DT="", THER_TX_NAME=name)
+                for i, name in enumerate(("chemo", "radiation", "surgery"))]
+        forward = _map(MappingEngine(compile_spec(SPEC), stable_ids=True), rows)
+        backward = _map(MappingEngine(compile_spec(SPEC), stable_ids=True), rows[::-1])
+        by_id = {record["localId"]: record for record in forward[0]["Treatment"]}
+        self.assertEqual(len(by_id), 3)
+        self.assertEqual({record["localId"]: record for record in backward[0]["Treatment"]}, by_id)
+
+    def test_same_output_once_learned(self):
+        # past LEARN_RECORDS, the builders stop interning the unique columns
+        rows = [_row("P-01", "Systemic Therapy Log", STRT_DT=f"{i % 12 + 1}/1/2016", THER_TX_NAME=f"t{i}")
+                for i in range(2 * mapping.LEARN_RECORDS)]
+        treatments = _map(MappingEngine(compile_spec(SPEC)), rows)[0]["Treatment"]
+        self.assertEqual(treatments, [{"patientId": "P-01", "startDate": f"{i % 12 + 1}/1/2016",
+                                       "note": f"systemic_therapy_log/t{i}", "localId": f"P-01_treatment_{i + 1}"}
+                                      for i in range(len(rows))])
+
+    def test_templates(self):
+        spec = {"version": 1, "patient_column": "Patient ID",
+                "counters": {"scope": "table", "tables": ["Sample"], "local_id": "{@patient}-{@count}"},
+                "records": [{"table": "Sample", "fields": {
+                    "sampleId": {"template": "{{{Sample ID}}}/{@table}/{Site}-{Site}"},
+                    "note": {"template": "{@count}"},
+                    "kind": {"template": "tissue"},
+                    "patientId": "Patient ID"}}]}
+        metadata = _map(MappingEngine(compile_spec(spec)), [{"Patient ID": "P-01", "Sample ID": "S-1", "Site": "a"}])
+        self.assertEqual(metadata, [{"Sample": {"sampleId": "{S-1}/sample/a-a", "note": "1", "kind": "tissue",
+                                                "patientId": "P-01", "localId": "P-01-1"}}])
+
+    def test_fresh_engine(self):
+        engine = MappingEngine(compile_spec(SPEC))
+        _map(engine, [_row("P-01", "Demographics", GENDER="F")])
+        fresh = engine.fresh()
+        self.assertEqual(list(fresh.metadata()), [])
+        self.assertEqual(_map(fresh, [_row("P-02", "Demographics", GENDER="M")]),
+                         [{"Patient": {"patientId": "P-02", "gender": "M", "provinceOfResidence": "Unknown"}}])
+
+    def test_forget_patients(self):
+        rows = [_row("P-01", "Systemic Therapy Log", STRT_DT="", THER_TX_NAME="chemo"),
+                _row("P-02", "Systemic Therapy Log", STRT_DT="", THER_TX_NAME="radio"),
+                _row("P-01", "Systemic Therapy Log", STRT_DT="", THER_TX_NAME="surgery")]
+        for stable_ids in (False, True):
+            engine = MappingEngine(compile_spec(SPEC), stable_ids)
+            cold = _map(engine, rows)
+            engine.forget_patients({"P-01"})
+            self.assertEqual(engine.patient_ids(), ["P-02"])
+            # the same localIds, the patient mapped again last
+            self.assertEqual(_map(engine, [row for row in rows if row["Subject"] == "P-01"]), [cold[1], cold[0]])
+
+        flat = MappingEngine(compile_spec({"version": 1, "patient_column": "Subject", "records": [
+            {"table": "Patient", "fields": {"patientId": "Subject"}}]}))
+        with self.assertRaises(ValueError):
+            flat.forget_patients({"P-01"})
+
+    def test_patient_data_update(self):
+        engine = MappingEngine(compile_spec(SPEC))
+        _map(engine, [_row("P-01", "Demographics", GENDER="F"),
+                      _row("P-01", "Systemic Therapy Log", STRT_DT="", THER_TX_NAME="chemo")])
+        self.assertEqual(list(engine.patient_data("P-01", ("Patient",))), ["Patient"])
+        engine.update_patient_data("P-01", {"Outcome": {"patientId": "P-01", "vitalStatus": "Alive"}})
+        data = engine.patient_data("P-01")
+        self.assertEqual(list(data), ["Patient", "Treatment", "Outcome"])
+        self.assertEqual(data["Outcome"], {"patientId": "P-01", "vitalStatus": "Alive"})
+
+
+class ScriptStableIdsTest(unittest.TestCase):
+    """
+    Maps the test cohorts with --stable-ids, and with their rows in
+    reverse, up to the Outcomes finalize_vital_status() adds.  Only the
+    localIds are compared: the survival of a dead patient goes to the
+    first of their Outcomes, which depends on the row order.
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def ingest(self, script, inputs, reverse=False):
+        engine = load_engine(script.DEFAULT_MAPPING, self.directory.name, stable_ids=True)
+        batches = list(read_batches(engine, input_files_in(inputs)))
+        if reverse:
+            batches = [(input_file, kind, items[::-1]) for input_file, kind, items in reversed(batches)]
+        script.map_batches(engine, batches)
+        script.finalize_vital_status(engine)
+        return engine, _by_local_id(engine.metadata())
+
+    def test_comparison(self):
+        script = _load_script("COMPARISON")
+        # without the follow-ups, the living have only the Outcome finalize_vital_status() adds
+        inputs = os.path.join(self.directory.name, "comparison")
+        shutil.copytree(os.path.join(DATA, "comparison"), inputs, ignore=shutil.ignore_patterns("fu.csv"))
+        for path in (os.path.join(DATA, "comparison"), inputs):
+            engine, records = self.ingest(script, path)
+            reversed_records = self.ingest(script, path, reverse=True)[1]
+            self.assertEqual(reversed_records.keys(), records.keys())
+
+        alive = [record for (table, _), record in records.items()
+                 if table == "Outcome" and record.get("vitalStatus") == "Alive"]
+        self.assertTrue(alive)
+        for record in alive:
+            patient = record["patientId"]
+            self.assertEqual(record["localId"],
+                             f"{patient}_outcome_{engine.stable_id(patient, 'Outcome', 'vital status')}")
+
+    def test_inspire_rave(self):
+        script = _load_script("INSPIRE", "medidata_rave")
+        engine, records = self.ingest(script, os.path.join(DATA, "inspire_rave"))
+        reversed_records = self.ingest(script, os.path.join(DATA, "inspire_rave"), reverse=True)[1]
+        self.assertEqual(reversed_records.keys(), records.keys())
+        alive = [record for (table, _), record in records.items()
+                 if table == "Outcome" and record["vitalStatus"] == "Alive"]
+        self.assertTrue(alive)
+        for record in alive:
+            patient = record["patientId"]
+            self.assertEqual(record["localId"], f"survival_{engine.stable_id(patient, 'survival', 'vital status')}")
+
+
+class TransformTest(unittest.TestCase):
+    def test_transforms(self):
+        self.assertEqual(date_from_datetime("01/01/1960 00:00:00"), "01/01/1960")
+        self.assertEqual(date_from_datetime("  "), "")
+        self.assertEqual(province_from_site("BCCA Vancouver Cancer Centre "), "British Columbia")
+        self.assertEqual(province_from_site("Elsewhere"), "Unknown")
+        self.assertEqual(strip_quotes('"NED"'), "NED")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import random
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from ingest_common.pipeline import batched, pipeline, Stage
+
+
+def _square(x):
+    return x * x
+
+
+def _slow_square(x):
+    time.sleep(random.random() / 500)
+    return x * x
+
+
+def _fail_on_five(x):
+    if x == 5:
+        raise ValueError("five")
+    return x
+
+
+class PipelineTest(unittest.TestCase):
+    def test_order_kept(self):
+        self.assertEqual(list(pipeline(range(100))), list(range(100)))
+        self.assertEqual(list(pipeline(range(100), Stage(_square), Stage(str))), [str(x * x) for x in range(100)])
+
+    def test_order_kept_by_thread_workers(self):
+        self.assertEqual(list(pipeline(range(200), Stage(_slow_square, workers=4), maxsize=2)),
+                         [x * x for x in range(200)])
+
+    def test_stage_error_raised(self):
+        with self.assertRaisesRegex(ValueError, "five"):
+            list(pipeline(range(10), Stage(_fail_on_five), Stage(_square)))
+        with self.assertRaisesRegex(ValueError, "five"):
+            list(pipeline(range(10), Stage(_fail_on_five, workers=3)))
+
+    def test_source_error_raised(self):
+        def source():
+            yield 1
+            raise OSError("unreadable")
+
+        with self.assertRaisesRegex(OSError, "unreadable"):
+            list(pipeline(source(), Stage(_square)))
+
+    def test_memory_bounded(self):
+        produced = []
+
+        def source():
+            for x in range(1000):
+                produced.append(x)
+                yield x
+
+        items = pipeline(source(), Stage(_square), maxsize=4)
+        self.assertEqual(next(items), 0)
+        time.sleep(0.2)
+        # a queue of 4 before and after the stage, and one item in each thread
+        self.assertLessEqual(len(produced), 1 + 2 * 4 + 2)
+
+        # stopping early stops the threads
+        threads = threading.active_count()
+        items.close()
+        time.sleep(0.3)
+        self.assertLess(threading.active_count(), threads)
+
+    def test_batched(self):
+        self.assertEqual(list(batched(range(7), 3)), [[0, 1, 2], [3, 4, 5], [6]])
+        self.assertEqual(list(batched([], 3)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
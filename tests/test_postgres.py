@@ -0,0 +1,112 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from ingest_common.postgres import _CopyBuffer, _postgres_type, PostgresBackend
+
+# the database the load test writes to; it is skipped when psycopg2 is
+# missing or the database can't be reached
+TEST_URL = os.environ.get("DHDP_TEST_POSTGRES_URL", "postgresql://postgres@localhost/postgres")
+
+
+def _connect():
+    try:
+        import psycopg2
+    except ImportError:
+        return None
+    try:
+        return psycopg2.connect(TEST_URL, connect_timeout=3)
+    except psycopg2.OperationalError:
+        return None
+
+
+class CopyBufferTest(unittest.TestCase):
+    ROWS = [(1, "P-01", None), (2, "tab\there", b"\x00\xff"), (3, "back\\slash\nnew line", 1.5)]
+    TEXT = "1\tP-01\t\\N\n2\ttab\\there\t\\\\x00ff\n3\tback\\\\slash\\nnew line\t1.5\n"
+
+    def test_read_all(self):
+        self.assertEqual(_CopyBuffer(self.ROWS).read(), self.TEXT)
+
+    def test_read_in_chunks(self):
+        for size in (1, 5, 8, 1000):
+            buffer = _CopyBuffer(self.ROWS)
+            chunks = []
+            while True:
+                chunk = buffer.read(size)
+                if not chunk:
+                    break
+                self.assertLessEqual(len(chunk), size)
+                chunks.append(chunk)
+            self.assertEqual("".join(chunks), self.TEXT)
+
+
+class PostgresTypeTest(unittest.TestCase):
+    def test_affinities(self):
+        self.assertEqual(_postgres_type("INTEGER"), "BIGINT")
+        self.assertEqual(_postgres_type("VARCHAR(255)"), "TEXT")
+        self.assertEqual(_postgres_type(""), "TEXT")
+        self.assertEqual(_postgres_type("BLOB"), "BYTEA")
+        self.assertEqual(_postgres_type("REAL"), "DOUBLE PRECISION")
+        self.assertEqual(_postgres_type("DECIMAL(10, 2)"), "NUMERIC")
+        self.assertEqual(_postgres_type("DATETIME"), "TEXT")
+
+
+class PostgresLoadTest(unittest.TestCase):
+    def setUp(self):
+        self.connection = _connect()
+        if self.connection is None:
+            self.skipTest(f"no PostgreSQL database at {TEST_URL}")
+        self.connection.autocommit = True
+        self.directory = tempfile.TemporaryDirectory()
+        self.table = f"test_{uuid.uuid4().hex[:12]}"
+        self.staging = os.path.join(self.directory.name, "staging.db")
+        source = sqlite3.connect(self.staging)
+        source.execute(f'CREATE TABLE "{self.table}" (id VARCHAR(64) NOT NULL, name TEXT, age INTEGER, '
+                       f'weight REAL, photo BLOB, created DATETIME, PRIMARY KEY (id))')
+        source.execute(f'CREATE INDEX "{self.table}_name" ON "{self.table}" (name)')
+        source.executemany(f'INSERT INTO "{self.table}" VALUES (?, ?, ?, ?, ?, ?)',
+                           [(f"P-{i:03}", f"patient\t{i}", i, i / 4, bytes([i]), "2020-01-01 00:00:00")
+                            for i in range(250)])
+        source.commit()
+        source.close()
+
+    def tearDown(self):
+        if self.connection is None:
+            return
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS "{self.table}"')
+        self.connection.close()
+        self.directory.cleanup()
+
+    def _query(self, sql, *args):
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, args)
+            return cursor.fetchall()
+
+    def test_load_twice(self):
+        backend = PostgresBackend(TEST_URL, staging_dir=self.directory.name)
+        backend.copy_rows([self.staging])
+        self.assertEqual(self._query(f'SELECT count(*) FROM "{self.table}"'), [(250,)])
+
+        # rows already there are left alone
+        backend.copy_rows([self.staging])
+        self.assertEqual(self._query(f'SELECT count(*) FROM "{self.table}"'), [(250,)])
+
+        columns = "name, age, weight, encode(photo, 'hex'), created"
+        self.assertEqual(self._query(f'SELECT {columns} FROM "{self.table}" WHERE id = %s', "P-010"),
+                         [("patient\t10", 10, 2.5, "0a", "2020-01-01 00:00:00")])
+        types = dict(self._query("SELECT column_name, data_type FROM information_schema.columns "
+                                 "WHERE table_name = %s", self.table))
+        self.assertEqual(types, {"id": "text", "name": "text", "age": "bigint", "weight": "double precision",
+                                 "photo": "bytea", "created": "text"})
+        indexes = [name for (name,) in self._query("SELECT indexname FROM pg_indexes WHERE tablename = %s",
+                                                   self.table)]
+        self.assertIn(f"{self.table}_name", indexes)
+
+
+if __name__ == '__main__':
+    unittest.main()
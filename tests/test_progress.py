@@ -0,0 +1,72 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from ingest_common.progress import current_rss, Progress, STATE_DONE, STATE_FAILED, STATE_RUNNING
+
+
+class ProgressTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.status_path = os.path.join(self.directory.name, "status.json")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read_status(self):
+        with open(self.status_path) as f:
+            return json.load(f)
+
+    def test_status(self):
+        progress = Progress(total=1000, unit="individuals", items_unit="records")
+        progress.update(advance=250, items=1000, current="P-250")
+        status = progress.status(now=progress._started + 10)
+        self.assertEqual((status["state"], status["done"], status["total"], status["items"]),
+                         (STATE_RUNNING, 250, 1000, 1000))
+        self.assertEqual((status["items_per_second"], status["elapsed_seconds"], status["eta_seconds"]),
+                         (100.0, 10.0, 30.0))
+        self.assertEqual(progress.describe(status),
+                         f"Progress: 25.0% (250 of 1000 individuals), 1000 records (100/s), ETA 0:00:30, "
+                         f"RSS {status['rss_bytes'] / (1 << 20):.0f} MiB, at P-250")
+
+    def test_bytes(self):
+        progress = Progress(total=None)
+        progress.update(done=3 << 20)
+        status = progress.status(now=progress._started + 1)
+        self.assertIsNone(status["eta_seconds"])
+        self.assertTrue(progress.describe(status).startswith("Progress: 3.0 MiB, 0 rows"))
+
+    def test_reported_once_per_interval(self):
+        lines = []
+        progress = Progress(total=10, status_path=self.status_path, report=lines.append, interval=3600)
+        for _ in range(10):
+            progress.update(advance=1, items=5)
+        self.assertEqual(lines, [])
+        self.assertFalse(os.path.exists(self.status_path))
+
+        progress = Progress(total=10, status_path=self.status_path, report=lines.append, interval=0)
+        progress.update(advance=1, items=5)
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(self.read_status()["done"], 1)
+
+    def test_context_manager(self):
+        with Progress(total=10, status_path=self.status_path) as progress:
+            progress.update(done=4)
+        self.assertEqual((self.read_status()["state"], self.read_status()["done"]), (STATE_DONE, 10))
+
+        with self.assertRaises(ValueError):
+            with Progress(total=10, status_path=self.status_path) as progress:
+                progress.update(done=4)
+                raise ValueError
+        self.assertEqual((self.read_status()["state"], self.read_status()["done"]), (STATE_FAILED, 4))
+        self.assertEqual(os.listdir(self.directory.name), ["status.json"])
+
+    def test_rss(self):
+        self.assertGreater(current_rss(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
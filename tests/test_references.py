@@ -0,0 +1,100 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from ingest_common.columnar import write_tables
+from ingest_common.references import ReferenceIndex
+from ingest_common.shards import write_shards
+
+ENTRIES = [{"Patient": {"patientId": "P-01"},
+            "Sample": [{"sampleId": "S-1"}, {"sampleId": "S-2", "patientId": "P-01"}],
+            "Treatment": {"patientId": "P-01", "treatmentPlanId": "TP-1"}},
+           {"Patient": {"patientId": "P-02"},
+            "Sample": {"patientId": "P-02", "sampleId": "S-3"}}]
+PIPELINE = {"pipeline_metadata": [{"Patient": {"patientId": "P-09"},
+                                   "Extraction": {"sampleId": "S-9", "extractionId": "E-9"}}]}
+
+
+class ReferenceIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def assertIndexed(self, index):
+        self.assertEqual(index.patients, {"P-01", "P-02"})
+        self.assertEqual(index.samples, {"S-1": "P-01", "S-2": "P-01", "S-3": "P-02"})
+        self.assertEqual(index.treatment_plans, {("P-01", "TP-1")})
+
+    def test_check(self):
+        index = ReferenceIndex()
+        index.add_entries(ENTRIES)
+        self.assertIndexed(index)
+        self.assertEqual(index.check("Chemotherapy", {"treatmentPlanId": "TP-1"}, "P-01"), [])
+        self.assertEqual(index.check("Extraction", {"sampleId": "S-3", "patientId": "P-02"}), [])
+        self.assertEqual(index.check("Diagnosis", {"patientId": "P-03"}),
+                         ["Diagnosis record refers to unknown patient P-03"])
+        self.assertEqual(index.check("Sequencing", {"sampleId": "S-4"}, "P-01"),
+                         ["Sequencing record refers to unknown sample S-4"])
+        self.assertEqual(index.check("Alignment", {"sampleId": "S-3"}, "P-01"),
+                         ["Alignment record of patient P-01 refers to sample S-3 of patient P-02"])
+        self.assertEqual(index.check("Radiotherapy", {"treatmentPlanId": "TP-1"}, "P-02"),
+                         ["Radiotherapy record refers to unknown treatment plan TP-1"])
+        # only the tables naming samples are checked against them
+        self.assertEqual(index.check("Slide", {"sampleId": "S-4"}, "P-01"), [])
+
+    def test_update(self):
+        index, other = ReferenceIndex(), ReferenceIndex()
+        index.add_entries(ENTRIES[:1])
+        other.add_entries(ENTRIES[1:])
+        index.update(other)
+        self.assertIndexed(index)
+        self.assertEqual(other.patients, {"P-02"})
+
+    def test_unindexed_kinds(self):
+        # a pipeline file checked on its own indexes nothing, so nothing is dropped
+        index = ReferenceIndex()
+        index.add_document(PIPELINE, "pipeline.json")
+        self.assertEqual(index.unchecked(), ["patients", "samples", "treatment plans"])
+        self.assertEqual(index.check("Extraction", {"sampleId": "S-9", "extractionId": "E-9"}, "P-09"), [])
+
+        # patients but no samples: only the patients are checked
+        index.add_entries([{"Patient": {"patientId": "P-01"}}])
+        self.assertEqual(index.unchecked(), ["samples", "treatment plans"])
+        self.assertEqual(index.check("Extraction", {"sampleId": "S-9"}, "P-09"),
+                         ["Extraction record refers to unknown patient P-09"])
+        self.assertEqual(index.check("Chemotherapy", {"treatmentPlanId": "TP-9"}, "P-01"), [])
+
+    def test_metadata_file(self):
+        path = os.path.join(self.directory.name, "metadata.json")
+        with open(path, "w") as f:
+            json.dump({"metadata": ENTRIES}, f)
+        index = ReferenceIndex()
+        index.add_path(path)
+        self.assertIndexed(index)
+
+    def test_pipeline_documents_ignored(self):
+        index = ReferenceIndex()
+        index.add_document(PIPELINE, "pipeline.json")
+        self.assertEqual((index.patients, index.samples), (set(), {}))
+
+    def test_shards(self):
+        path = os.path.join(self.directory.name, "out.json")
+        write_shards(ENTRIES, path, 3)
+        index = ReferenceIndex()
+        index.add_path(path)
+        self.assertIndexed(index)
+
+    def test_columnar(self):
+        write_tables(ENTRIES, self.directory.name)
+        index = ReferenceIndex()
+        index.add_path(self.directory.name)
+        self.assertIndexed(index)
+
+
+if __name__ == '__main__':
+    unittest.main()
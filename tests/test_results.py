@@ -0,0 +1,108 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from ingest_common.results import ResultCache
+
+OUTCOME = {"local_id": "P-01_D-1", "messages": [], "renames": [], "build_messages": []}
+
+
+class ResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "results.db")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        cache = ResultCache(self.path, version="1")
+        key = cache.key("Diagnosis", {"localId": "P-01_D-1"}, "P-01")
+        self.assertIsNone(cache.get(key))
+        cache.put(key, OUTCOME)
+        self.assertEqual(cache.get(key), OUTCOME)
+        cache.close()
+
+        cache = ResultCache(self.path, version="1")
+        self.assertEqual(cache.get(key), OUTCOME)
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+        cache.close()
+
+    def test_version_change_misses(self):
+        cache = ResultCache(self.path, version="1")
+        cache.put(cache.key("Patient", {"localId": "P-01"}, "P-01"), OUTCOME)
+        cache.close()
+
+        cache = ResultCache(self.path, version="2")
+        self.assertIsNone(cache.get(cache.key("Patient", {"localId": "P-01"}, "P-01")))
+        cache.close()
+
+    def test_deferred_outcome_stored_once_written(self):
+        cache = ResultCache(self.path)
+        cache.defer("Patient", "P-01", "key", OUTCOME)
+        self.assertIsNone(cache.get("key"))
+        cache.store("Patient", "P-01")
+        self.assertEqual(cache.get("key"), OUTCOME)
+        cache.close()
+
+    def test_claim(self):
+        cache = ResultCache(self.path)
+        cache.begin(throwaway=True)
+        self.assertIsNone(cache.claim("Patient", "P-01", True))
+        self.assertTrue(cache.claim("Patient", "P-01", False))
+        cache.begin(throwaway=True)
+        self.assertIsNone(cache.claim("Patient", "P-01", False))
+        cache.close()
+
+    def test_least_recently_used_evicted(self):
+        cache = ResultCache(self.path, max_entries=2)
+        for key in ("a", "b", "c"):
+            cache.put(key, OUTCOME)
+        cache.get("a")
+        cache.close()
+
+        cache = ResultCache(self.path, max_entries=2)
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("c"))
+        cache.close()
+
+    def test_concurrent_writers(self):
+        # two --serve workers, each storing outcomes for a while before
+        # committing; neither may hold the write lock for longer than the
+        # other waits for it
+        puts = 300
+        errors = []
+
+        def worker(name):
+            try:
+                cache = ResultCache(self.path, write_every=10, timeout=0.2)
+                cache.begin(throwaway=True)
+                for i in range(puts):
+                    cache.put(f"{name}-{i}", OUTCOME)
+                    time.sleep(0.002)
+                cache.commit()
+                cache.close()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(name,)) for name in ("first", "second")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+        cache = ResultCache(self.path)
+        for name in ("first", "second"):
+            for i in range(puts):
+                self.assertEqual(cache.get(f"{name}-{i}"), OUTCOME)
+        cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from ingest_common import scan
+from ingest_common.mapping import compile_spec, MappingEngine
+from ingest_common.scan import EMPTY, IRRELEVANT, PATIENTS, read_batches, RELEVANT, ROWS, scan_file
+from ingest_common.streams import input_files_in
+
+SECTIONS = {"demographics", "death"}
+SPEC = {"version": 1, "patient_column": "Subject", "section_column": "DataPageName",
+        "sections": {"Demographics": [{"table": "Patient", "fields": {"patientId": "Subject"}}]}}
+
+
+class ScanTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name, data):
+        path = os.path.join(self.directory.name, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+
+class ScanFileTest(ScanTestCase):
+    def scan(self, data, **kwargs):
+        return scan_file(self.write("export.csv", data), "DataPageName", SECTIONS, **kwargs)
+
+    def test_first_row(self):
+        self.assertEqual(self.scan(b"Subject,DataPageName\nP-01,Demographics \n"), RELEVANT)
+        self.assertEqual(self.scan(b"Subject,DataPageName\nP-01,Vital Signs\nP-02,Vital Signs\n"), IRRELEVANT)
+
+    def test_mixed_pages(self):
+        self.assertEqual(self.scan(b"Subject,DataPageName\nP-01,Vital Signs\nP-02,DEATH\n"), RELEVANT)
+        self.assertEqual(self.scan(b'Subject,DataPageName\r\nP-01,Vital Signs\r\nP-02," Death"\r\n'), RELEVANT)
+
+    def test_empty(self):
+        self.assertEqual(self.scan(b""), EMPTY)
+        self.assertEqual(self.scan(b"Subject,DataPageName\n"), EMPTY)
+
+    def test_other_files_parsed(self):
+        self.assertEqual(self.scan(b"Patient ID,SEX\nP-01,F\n"), RELEVANT)
+        self.assertEqual(self.scan("Subject,DataPageName\nP-01,Vital Signs\n".encode("utf-16")), RELEVANT)
+
+    def test_delimiter(self):
+        self.assertEqual(self.scan(b"Subject;DataPageName\nP-01;Vital Signs\n", delimiter=";"), IRRELEVANT)
+        self.assertEqual(self.scan(b"Subject;DataPageName\nP-01;Death\n", delimiter=";"), RELEVANT)
+
+    def test_name_across_chunks(self):
+        search_chunk = scan.SEARCH_CHUNK
+        scan.SEARCH_CHUNK = 16
+        try:
+            data = b"Subject,DataPageName\nP-01,Vital Signs\n" + b"P-02,Vital Signs\n" * 5
+            for padding in range(16):
+                self.assertEqual(self.scan(data + b"x" * padding + b"\nP-03,Death\n"), RELEVANT)
+            self.assertEqual(self.scan(data), IRRELEVANT)
+        finally:
+            scan.SEARCH_CHUNK = search_chunk
+
+
+class ReadBatchesTest(ScanTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write("demo.csv", b"Subject,DataPageName\nP-01,Demographics\nP-02,Demographics\nP-03,Demographics\n")
+        self.write("vitals.csv", b"Subject,DataPageName\nP-04,Vital Signs\n")
+
+    def batches(self, spec, **kwargs):
+        engine = MappingEngine(compile_spec(spec))
+        return [(os.path.basename(input_file.name), kind, items)
+                for input_file, kind, items in read_batches(engine, input_files_in(self.directory.name), **kwargs)]
+
+    def test_unmapped_pages_skipped(self):
+        batches = self.batches(SPEC, batch_size=2)
+        self.assertEqual([(name, kind, len(items)) for name, kind, items in batches],
+                         [("demo.csv", ROWS, 2), ("demo.csv", ROWS, 1)])
+        self.assertEqual(batches[0][2][0], {"Subject": "P-01", "DataPageName": "Demographics"})
+
+        self.assertEqual([(name, kind) for name, kind, _ in self.batches(SPEC, prefilter=False)],
+                         [("demo.csv", ROWS), ("vitals.csv", ROWS)])
+
+    def test_unmapped_patients_listed(self):
+        batches = self.batches(dict(SPEC, keep_unmapped_patients=True))
+        self.assertEqual(batches[-1], ("vitals.csv", PATIENTS, ["P-04"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
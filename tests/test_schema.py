@@ -0,0 +1,103 @@
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from ingest_common.mapping import compile_spec, load_plan, MappingSpecError
+from ingest_common.schema import count_incomplete, load_checked_engine, load_schema_index, SchemaIndex
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+MAPPINGS = [os.path.join(ROOT, "COMPARISON", "mapping.json"),
+            os.path.join(ROOT, "INSPIRE", "medidata_rave", "mapping.json"),
+            os.path.join(ROOT, "INSPIRE", "cBioportal_clinphen", "mapping.json")]
+
+FIELDS = {"Patient": ["patientId", "gender", "dateOfBirth"],
+          "Diagnosis": ["patientId", "diagnosisDate", "cancerType"]}
+
+SPEC = {"version": 1, "patient_column": "Subject", "section_column": "DataPageName",
+        "counters": {"scope": "table", "tables": ["Diagnosis"], "local_id": "{@patient}_{@table}_{@count}"},
+        "sections": {"diagnosis": [
+            {"table": "Diagnosis", "fields": {"patientId": "Subject", "cancerTyp": "MALIGNANCY"}}]}}
+
+
+class SchemaIndexTest(unittest.TestCase):
+    def test_check_fields(self):
+        index = SchemaIndex(FIELDS)
+        self.assertEqual(index.check_fields("Patient", ["patientId", "gendre"]), ({"gendre": "gender"}, []))
+        corrections, errors = index.check_fields("Patient", ["patientId", "shoeSize"], where="demo")
+        self.assertEqual((corrections, errors), ({}, ["demo: Patient has no field 'shoeSize'"]))
+        self.assertEqual(index.check_fields("Vitals", ["patientId"], where="vitals"),
+                         ({}, ["vitals: validate.py does not load table 'Vitals'"]))
+
+    def test_local_id_fields(self):
+        index = SchemaIndex()
+        self.assertEqual(index.check_fields("Diagnosis", ["patientId"], counted=True), ({}, []))
+        self.assertEqual(index.check_fields("Diagnosis", ["patientId", "localId"]), ({}, []))
+        self.assertEqual(index.check_fields("Diagnosis", ["patientId"], where="diagnosis"),
+                         ({}, ["diagnosis: Diagnosis records need diagnosisDate (or a localId) to be loaded"]))
+        # always built from its fields
+        self.assertEqual(len(index.check_fields("Sample", ["patientId", "localId"])[1]), 1)
+
+    def test_check_plan_renames(self):
+        plan = compile_spec(SPEC)
+        corrected, problems = SchemaIndex(FIELDS).check_plan(plan)
+        self.assertEqual(corrected, ["sections.diagnosis[0]: renamed Diagnosis field 'cancerTyp' to 'cancerType'"])
+        self.assertEqual(problems, [])
+        self.assertEqual([key for key, _, _ in plan["sections"]["diagnosis"][1][0][2]], ["patientId", "cancerType"])
+
+    def test_shipped_mappings(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            for spec_path in MAPPINGS:
+                self.assertEqual(SchemaIndex().check_plan(load_plan(spec_path, cache_dir))[1], [], spec_path)
+
+    def test_incomplete_records(self):
+        entries = [{"Patient": {"patientId": "P-01"},
+                    "Diagnosis": [{"patientId": "P-01", "diagnosisDate": ""},
+                                  {"patientId": "P-01", "diagnosisDate": "", "localId": "P-01_diagnosis_2"},
+                                  {"patientId": "P-01", "diagnosisDate": "1/1/2015"}],
+                    "Sample": {"patientId": "P-01", "localId": "S-1"}}]
+        self.assertEqual(count_incomplete(SchemaIndex(), entries), {"Diagnosis": 1, "Sample": 1})
+
+
+class LoadTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name, document):
+        path = os.path.join(self.directory.name, name)
+        with open(path, "w") as f:
+            json.dump(document, f)
+        return path
+
+    def test_index_file(self):
+        path = self.write("index.json", SchemaIndex(FIELDS).to_json())
+        index = load_schema_index(path)
+        self.assertEqual(index.fields["Patient"], frozenset(FIELDS["Patient"] + ["localId"]))
+
+    @unittest.skipIf(importlib.util.find_spec("candig"), "candig is installed")
+    def test_no_field_names(self):
+        index = load_schema_index(cache_dir=self.directory.name)
+        self.assertIsNone(index.fields)
+        self.assertEqual(index.check_fields("Patient", ["patientId", "shoeSize"]), ({}, []))
+
+    def test_checked_engine(self):
+        index = SchemaIndex(FIELDS)
+        engine, corrections = load_checked_engine(self.write("spec.json", SPEC), index, self.directory.name)
+        self.assertEqual(len(corrections), 1)
+        engine.update({"Subject": "P-01", "DataPageName": "Diagnosis", "MALIGNANCY": "sarcoma"})
+        self.assertEqual(list(engine.metadata())[0]["Diagnosis"],
+                         {"patientId": "P-01", "cancerType": "sarcoma", "localId": "P-01_diagnosis_1"})
+
+        bad = dict(SPEC, sections={"diagnosis": [{"table": "Diagnosis", "fields": {"shoeSize": "SIZE"}}]})
+        with self.assertRaises(MappingSpecError):
+            load_checked_engine(self.write("bad.json", bad), index, self.directory.name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+"""
+Runs the validation service on a unix socket in a temporary directory:
+run_service() with a worker function of this module, and validate.py
+--serve itself when candig is installed.
+"""
+
+import http.client
+import importlib.util
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+from ingest_common.service import run_service
+
+DOCUMENT = {"metadata": [{"Patient": {"patientId": "P-01", "gender": "F"}},
+                         {"Patient": {"patientId": "P-02", "gender": "M"}}]}
+
+# the state of a worker process, set up by _init_worker
+_worker = {}
+
+
+def _init_worker(name):
+    _worker["name"] = name
+    _worker["initialized"] = _worker.get("initialized", 0) + 1
+    _worker["documents"] = 0
+
+
+def _validate(metadata, args):
+    _worker["documents"] += 1
+    return {"pid": os.getpid(), "name": _worker["name"], "initialized": _worker["initialized"],
+            "documents": _worker["documents"], "individuals": len(metadata["metadata"]),
+            "overwrite": bool(args.get("--overwrite"))}
+
+
+class UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path):
+        super().__init__("localhost", timeout=30)
+        self._path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self._path)
+
+
+def request(path, method, url, body=None):
+    """
+    Sends one request to the service on the unix socket <path>; returns
+    (status, parsed body).
+    """
+    connection = UnixConnection(path)
+    try:
+        connection.request(method, url, body=body)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+
+def wait_for(path, running):
+    deadline = time.monotonic() + 30
+    while not os.path.exists(path):
+        if not running() or time.monotonic() > deadline:
+            raise AssertionError(f"the service never listened on {path}")
+        time.sleep(0.05)
+
+
+class RunServiceTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.socket = os.path.join(self.directory.name, "validate.sock")
+        self.process = multiprocessing.Process(target=run_service, args=(
+            self.socket, 1, _validate, {"-d": "test"}, logging.getLogger("test_service"), _init_worker, ("worker",)))
+        self.process.start()
+        wait_for(self.socket, self.process.is_alive)
+
+    def tearDown(self):
+        self.process.terminate()
+        self.process.join(30)
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        status, report = request(self.socket, "POST", "/validate", json.dumps(DOCUMENT))
+        self.assertEqual(status, 200)
+        self.assertEqual((report["name"], report["individuals"], report["overwrite"]), ("worker", 2, False))
+        status, report = request(self.socket, "POST", "/validate?overwrite=1", json.dumps(DOCUMENT))
+        self.assertTrue(report["overwrite"])
+        self.assertEqual(request(self.socket, "GET", "/health"), (200, {"status": "ok", "workers": 1}))
+
+    def test_worker_reused(self):
+        reports = [request(self.socket, "POST", "/validate", json.dumps(DOCUMENT))[1] for _ in range(3)]
+        # one worker, set up once, validates every document
+        self.assertEqual({report["pid"] for report in reports}, {reports[0]["pid"]})
+        self.assertNotEqual(reports[0]["pid"], self.process.pid)
+        self.assertEqual([report["initialized"] for report in reports], [1, 1, 1])
+        self.assertEqual([report["documents"] for report in reports], [1, 2, 3])
+
+    def test_malformed_documents(self):
+        status, reply = request(self.socket, "POST", "/validate", b'{"metadata": [')
+        self.assertEqual(status, 400)
+        self.assertTrue(reply["error"].startswith("invalid JSON document: "))
+        status, reply = request(self.socket, "POST", "/validate", json.dumps({"patients": []}))
+        self.assertEqual(status, 400)
+        self.assertIn('"metadata" or "pipeline_metadata"', reply["error"])
+        self.assertEqual(request(self.socket, "GET", "/status")[0], 404)
+
+        # the service carries on
+        status, report = request(self.socket, "POST", "/validate", json.dumps(DOCUMENT))
+        self.assertEqual((status, report["documents"]), (200, 1))
+
+    def test_socket_removed_on_sigterm(self):
+        self.process.terminate()
+        self.process.join(30)
+        self.assertEqual(self.process.exitcode, 0)
+        self.assertFalse(os.path.exists(self.socket))
+
+
+@unittest.skipUnless(importlib.util.find_spec("candig"), "candig isn't installed")
+class ValidateServiceTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.socket = os.path.join(self.directory.name, "validate.sock")
+        self.process = subprocess.Popen([sys.executable, os.path.join(ROOT, "validate.py"), "--serve", self.socket,
+                                         "-j", "1", "-p", os.path.join(self.directory.name, "validate.log")],
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        wait_for(self.socket, lambda: self.process.poll() is None)
+
+    def tearDown(self):
+        self.process.terminate()
+        self.process.wait(30)
+        self.directory.cleanup()
+
+    def test_documents_validated_in_a_reused_repo(self):
+        for _ in range(2):
+            # the worker's repo is emptied after every document, so the same records aren't duplicates
+            status, report = request(self.socket, "POST", "/validate", json.dumps(DOCUMENT))
+            self.assertEqual(status, 200)
+            self.assertNotIn("error", report)
+            self.assertEqual(report["objects_count"], 2)
+
+    def test_malformed_json(self):
+        status, reply = request(self.socket, "POST", "/validate", b"[")
+        self.assertEqual(status, 400)
+        self.assertIn("invalid JSON document", reply["error"])
+
+
+if __name__ == '__main__':
+    unittest.main()
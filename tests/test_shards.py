@@ -0,0 +1,67 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from ingest_common.shards import is_manifest, manifest_shards, shard_of, shard_path, write_shards
+from ingest_common.streams import open_input
+
+ENTRIES = [{"Patient": {"patientId": f"P-{i:03}"}, "Diagnosis": {"localId": f"P-{i:03}_diagnosis_1"}}
+           for i in range(40)]
+
+
+class ShardsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_shard_path(self):
+        self.assertEqual(shard_path("out.json", 0, 4), "out.shard-0-of-4.json")
+        self.assertEqual(shard_path("out.json.gz", 3, 4), "out.shard-3-of-4.json.gz")
+        self.assertEqual(shard_path("dir/out.json", 7, 12), "dir/out.shard-07-of-12.json")
+
+    def test_shard_of_is_stable(self):
+        self.assertEqual(shard_of("P-001", 4), shard_of("P-001", 4))
+        self.assertEqual({shard_of(entry["Patient"]["patientId"], 4) for entry in ENTRIES}, {0, 1, 2, 3})
+
+    def test_round_trip(self):
+        for output in ("out.json", "out.json.gz"):
+            manifest_path = os.path.join(self.directory.name, output)
+            manifest = write_shards(ENTRIES, manifest_path, 3, indent=2)
+            with open_input(manifest_path) as manifest_file:
+                self.assertEqual(json.load(manifest_file), manifest)
+            self.assertTrue(is_manifest(manifest))
+            self.assertEqual(sum(manifest["individuals"]), len(ENTRIES))
+
+            for shard, path in enumerate(manifest_shards(manifest, manifest_path)):
+                self.assertTrue(os.path.isabs(path))
+                with open_input(path) as shard_file:
+                    entries = json.load(shard_file)["metadata"]
+                # each shard keeps its patients in the order they came in
+                self.assertEqual(entries, [entry for entry in ENTRIES
+                                           if shard_of(entry["Patient"]["patientId"], 3) == shard])
+                self.assertEqual(len(entries), manifest["individuals"][shard])
+
+    def test_streamed_as_json_dump(self):
+        # entries come from a generator, and more shards than patients leave some empty
+        entries = ENTRIES[:5]
+        for indent in (None, 2):
+            manifest_path = os.path.join(self.directory.name, "out.json")
+            manifest = write_shards(iter(entries), manifest_path, 8, indent=indent)
+            for shard, path in enumerate(manifest_shards(manifest, manifest_path)):
+                partition = [entry for entry in entries if shard_of(entry["Patient"]["patientId"], 8) == shard]
+                with open(path) as shard_file:
+                    self.assertEqual(shard_file.read(), json.dumps({"metadata": partition}, indent=indent))
+            self.assertIn(0, manifest["individuals"])
+
+    def test_not_a_manifest(self):
+        self.assertFalse(is_manifest({"metadata": ENTRIES}))
+        self.assertFalse(is_manifest([]))
+
+
+if __name__ == '__main__':
+    unittest.main()
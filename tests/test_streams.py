@@ -0,0 +1,87 @@
+import gzip
+import importlib.util
+import os
+import sys
+import tempfile
+import unittest
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from ingest_common.streams import bytes_read, input_files_in, input_size, open_input, open_output
+
+TEXT = "Subject,DataPageName\n" + "".join(f"P-{i:03},Demographics\n" for i in range(500))
+HAS_ZSTANDARD = importlib.util.find_spec("zstandard") is not None
+
+
+class StreamsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def round_trip(self, name):
+        with open_output(self.path(name)) as output_file:
+            output_file.write(TEXT)
+        with open_input(self.path(name)) as input_file:
+            return input_file.read()
+
+    def test_plain_and_gzip(self):
+        self.assertEqual(self.round_trip("plain.csv"), TEXT)
+        self.assertEqual(self.round_trip("export.csv.gz"), TEXT)
+        with open(self.path("export.csv.gz"), "rb") as f:
+            self.assertEqual(gzip.decompress(f.read()).decode(), TEXT)
+
+    @unittest.skipUnless(HAS_ZSTANDARD, "zstandard isn't installed")
+    def test_zstd(self):
+        self.assertEqual(self.round_trip("export.csv.zst"), TEXT)
+
+    @unittest.skipIf(HAS_ZSTANDARD, "zstandard is installed")
+    def test_zstd_missing(self):
+        with self.assertRaises(OSError):
+            open_output(self.path("export.csv.zst"))
+
+    def test_zip_bundle(self):
+        with zipfile.ZipFile(self.path("bundle.zip"), "w") as bundle:
+            bundle.writestr("export/", "")
+            bundle.writestr("export/b.csv", TEXT)
+            bundle.writestr("__MACOSX/export/._b.csv", "resource fork")
+        with open_input(self.path("bundle.zip")) as input_file:
+            self.assertEqual(input_file.read(), TEXT)
+        self.assertEqual(input_size(self.path("bundle.zip")), len(TEXT))
+
+        with zipfile.ZipFile(self.path("bundle.zip"), "a") as bundle:
+            bundle.writestr("export/a.csv", TEXT)
+        with self.assertRaises(OSError):
+            open_input(self.path("bundle.zip"))
+        members = input_files_in(self.path("bundle.zip"))
+        self.assertEqual([member.member for member in members], ["export/b.csv", "export/a.csv"])
+        self.assertFalse(members[0].is_plain)
+        with members[1].open() as input_file:
+            self.assertEqual(input_file.read(), TEXT)
+
+    def test_directory_listed_in_name_order(self):
+        for name in ("c.csv", "a.csv.gz", "b.csv"):
+            with open_output(self.path(name)) as output_file:
+                output_file.write(TEXT)
+        inputs = input_files_in(self.directory.name)
+        self.assertEqual([os.path.basename(input_file.name) for input_file in inputs], ["a.csv.gz", "b.csv", "c.csv"])
+        self.assertEqual([input_file.is_plain for input_file in inputs], [False, True, True])
+
+    def test_bytes_read(self):
+        self.round_trip("plain.csv")
+        self.round_trip("export.csv.gz")
+        for name in ("plain.csv", "export.csv.gz"):
+            with open_input(self.path(name)) as input_file:
+                input_file.readline()
+                self.assertGreater(bytes_read(input_file), 0)
+                input_file.read()
+                self.assertEqual(bytes_read(input_file), os.path.getsize(self.path(name)))
+            self.assertEqual(input_size(self.path(name)), os.path.getsize(self.path(name)))
+
+
+if __name__ == '__main__':
+    unittest.main()
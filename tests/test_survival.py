@@ -0,0 +1,52 @@
+import os
+import random
+import sys
+import unittest
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from ingest_common import survival
+from ingest_common.survival import _months_python, SurvivalBatch
+
+
+def _dates(count):
+    """
+    Random date pairs, with the ends of months and leap days well covered.
+    """
+    rng = random.Random(7)
+    edges = [datetime(2016, 1, 31), datetime(2016, 2, 29), datetime(2017, 2, 28), datetime(2018, 3, 31),
+             datetime(2018, 4, 30), datetime(2019, 12, 31), datetime(2020, 3, 1)]
+    starts, ends = [], []
+    for _ in range(count):
+        start = rng.choice(edges) if rng.random() < 0.3 else datetime(2010, 1, 1) + timedelta(rng.randrange(4000))
+        end = rng.choice(edges) if rng.random() < 0.3 else start + timedelta(rng.randrange(-400, 3000))
+        starts.append(start)
+        ends.append(end)
+    return starts, ends
+
+
+class SurvivalTest(unittest.TestCase):
+    def test_months(self):
+        batch = SurvivalBatch()
+        batch.add("P-01", "03/03/2017", "2/26/2018")
+        # a month from the 31st ends on the last day of a shorter month
+        batch.add("P-02", "1/31/2016", "2/29/2016")
+        batch.add("P-03", "5/5/2018", "5/5/2018")
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(batch.months(), {"P-01": 11 + 23 / 30, "P-02": 1, "P-03": 0})
+
+    def test_bad_date(self):
+        with self.assertRaises(ValueError):
+            SurvivalBatch().add("P-01", "2017-03-03", "2/26/2018")
+
+    def test_empty_batch(self):
+        self.assertEqual(SurvivalBatch().months(), {})
+
+    @unittest.skipIf(survival._numpy() is None, "numpy isn't installed")
+    def test_numpy_same_as_relativedelta(self):
+        starts, ends = _dates(20000)
+        self.assertEqual(survival._months_numpy(survival._numpy(), starts, ends), _months_python(starts, ends))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,280 @@
+import functools
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from ingest_common.fingerprints import FingerprintStore
+from ingest_common.schema import LOCAL_ID_FIELDS
+from validate import BATCH_SIZE, CLINICAL_TABLES, PIPELINE_TABLES, CandigRepo, Checkpoint, ReportLogger, \
+    skip_planned, write_records
+
+
+class Duplicate(Exception):
+    pass
+
+
+class Record(object):
+    def __init__(self, local_id):
+        self.localId = local_id
+
+
+class StubDatabase(object):
+    def __init__(self, connection):
+        self.connection = connection
+
+    def rollback(self):
+        self.connection.rollback()
+
+
+class StubRepo(object):
+    """
+    Stands in for candig's SqlDataRepository: the records of every table are
+    rows of one SQLite table, and inserts, removals, commits and
+    verifications are recorded.
+    """
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS records (tbl TEXT, local_id TEXT, "
+                                "PRIMARY KEY (tbl, local_id))")
+        self.connection.commit()
+        self.database = StubDatabase(self.connection)
+        self.operations = []
+        self.commits = 0
+        self.verifications = 0
+
+    def __getattr__(self, name):
+        if name.startswith("insert"):
+            return lambda obj: self.insert(name[len("insert"):], obj)
+        if name.startswith("remove"):
+            return lambda obj: self.remove(name[len("remove"):], obj)
+        raise AttributeError(name)
+
+    def insert(self, table, obj):
+        self.operations.append(("insert", table, obj.localId))
+        try:
+            self.connection.execute("INSERT INTO records VALUES (?, ?)", (table, obj.localId))
+        except sqlite3.IntegrityError:
+            raise Duplicate(obj.localId)
+
+    def remove(self, table, obj):
+        self.operations.append(("remove", table, obj.localId))
+        self.connection.execute("DELETE FROM records WHERE tbl = ? AND local_id = ?", (table, obj.localId))
+
+    def insertDataset(self, dataset):
+        pass
+
+    def commit(self):
+        self.connection.commit()
+        self.commits += 1
+
+    def verify(self):
+        self.verifications += 1
+
+    def close(self):
+        self.connection.close()
+
+    def delete(self):
+        pass
+
+
+class StubCandigRepo(CandigRepo):
+    duplicate_error = Duplicate
+
+    def open(self):
+        self._repo = self._backend.repo = StubRepo(self._filename)
+        return self
+
+
+def _committed(path, table="Patient"):
+    with sqlite3.connect(path) as connection:
+        return [row[0] for row in connection.execute("SELECT local_id FROM records WHERE tbl = ? ORDER BY rowid",
+                                                     (table,))]
+
+
+class CheckpointTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.metadata_json = os.path.join(self.directory.name, "metadata.json")
+        with open(self.metadata_json, "w") as f:
+            json.dump({"metadata": []}, f)
+        self.path = os.path.join(self.directory.name, "repo.db.checkpoint")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_save_load_clear(self):
+        checkpoint = Checkpoint(self.path, self.metadata_json)
+        self.assertIsNone(checkpoint.load())
+        checkpoint.save("metadata", 20, 130, {"Patient": 20})
+        state = Checkpoint(self.path, self.metadata_json).load()
+        self.assertEqual((state["metadata_key"], state["next_individual"], state["objects_count"], state["tables"]),
+                         ("metadata", 20, 130, {"Patient": 20}))
+        # saved atomically, through a temporary file
+        self.assertEqual(sorted(os.listdir(self.directory.name)), ["metadata.json", "repo.db.checkpoint"])
+        checkpoint.clear()
+        self.assertFalse(os.path.exists(self.path))
+        checkpoint.clear()
+
+    def test_other_version_ignored(self):
+        Checkpoint(self.path, self.metadata_json).save("metadata", 20, 130, {})
+        with open(self.metadata_json, "w") as f:
+            json.dump({"metadata": [{}]}, f)
+        self.assertIsNone(Checkpoint(self.path, self.metadata_json).load())
+
+    def test_unreadable_ignored(self):
+        with open(self.path, "w") as f:
+            f.write("{")
+        self.assertIsNone(Checkpoint(self.path, self.metadata_json).load())
+
+
+class ResumeTest(unittest.TestCase):
+    """
+    Loads patients as load_metadata() does with --checkpoint-every, failing
+    part way, then resumes from the checkpoint.
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.repo_path = os.path.join(self.directory.name, "repo.db")
+        self.metadata_json = os.path.join(self.directory.name, "metadata.json")
+        with open(self.metadata_json, "w") as f:
+            json.dump({"metadata": []}, f)
+        self.checkpoint = Checkpoint(f"{self.repo_path}.checkpoint", self.metadata_json)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def load(self, patients, checkpoint_every, fail_at=None, start=0):
+        with StubCandigRepo(self.repo_path, keep_on_error=True) as repo:
+            for index, patient in enumerate(patients):
+                if index < start:
+                    continue
+                if index > start and index % checkpoint_every == 0:
+                    repo.checkpoint()
+                    self.checkpoint.save("metadata", index, index, {})
+                if index == fail_at:
+                    raise RuntimeError("interrupted")
+                repo.add_patient(Record(patient))
+            return repo._repo
+
+    def test_failure_rolled_back_to_checkpoint(self):
+        patients = [f"P-{index:02}" for index in range(10)]
+        with self.assertRaises(RuntimeError):
+            self.load(patients, 4, fail_at=6)
+        self.assertEqual(_committed(self.repo_path), patients[:4])
+        state = self.checkpoint.load()
+        self.assertEqual(state["next_individual"], 4)
+
+        # nothing after the checkpoint is in the repo, so no duplicates
+        stub = self.load(patients, 4, start=state["next_individual"])
+        self.assertEqual(_committed(self.repo_path), patients)
+        # committed at the checkpoint and when closed, not after every record
+        self.assertEqual(stub.commits, 2)
+
+    def test_committed_after_every_record_without_checkpoints(self):
+        with StubCandigRepo(self.repo_path, keep=True) as repo:
+            for patient in ("P-01", "P-02", "P-03"):
+                repo.add_patient(Record(patient))
+            stub = repo._repo
+        self.assertEqual((stub.commits, stub.verifications), (4, 4))
+
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.repo = StubCandigRepo(os.path.join(self.directory.name, "repo.db"), keep=True).open()
+        self.stub = self.repo._repo
+
+    def tearDown(self):
+        self.stub.close()
+        self.directory.cleanup()
+
+    def test_add_many_commits_per_chunk(self):
+        records = [Record(f"P-{index}") for index in range(BATCH_SIZE + 1)]
+        self.assertEqual(self.repo.add_many("Patient", records), [])
+        self.assertEqual((self.stub.commits, self.stub.verifications), (2, 2))
+
+        self.stub.commits = 0
+        failures = self.repo.add_many("Patient", [Record("P-new"), Record("P-3"), Record("P-new")], chunk_size=2)
+        self.assertEqual([(index, type(error)) for index, error in failures], [(1, Duplicate), (2, Duplicate)])
+        self.assertEqual(self.stub.commits, 2)
+        self.assertEqual(len(_committed(self.repo._filename)), BATCH_SIZE + 2)
+
+    def test_upsert_many_replaces_duplicates(self):
+        self.repo.add_many("Patient", [Record("P-1")])
+        self.stub.operations, self.stub.commits = [], 0
+        statuses = self.repo.upsert_many("Patient", [Record("P-1"), Record("P-2")])
+        self.assertEqual(statuses, ["updated", "added"])
+        self.assertEqual(self.stub.operations, [("insert", "Patient", "P-1"), ("remove", "Patient", "P-1"),
+                                                ("insert", "Patient", "P-1"), ("insert", "Patient", "P-2")])
+        self.assertEqual(self.stub.commits, 1)
+        self.assertEqual(sorted(_committed(self.repo._filename)), ["P-1", "P-2"])
+
+    def test_upsert_many_reports_other_errors(self):
+        def insert(obj):
+            raise ValueError(obj.localId)
+        self.stub.insertPatient = insert
+        statuses = self.repo.upsert_many("Patient", [Record("P-1")])
+        self.assertIsInstance(statuses[0], ValueError)
+
+    def test_table_methods(self):
+        tables = {**CLINICAL_TABLES, **PIPELINE_TABLES}
+        self.assertEqual(set(tables), set(LOCAL_ID_FIELDS))
+        for table, (_, suffix) in tables.items():
+            getattr(self.repo, f"add_{suffix}")(Record("first"))
+            getattr(self.repo, f"update_{suffix}")(Record("first"))
+            self.assertEqual(self.stub.operations[-3:], [("insert", table, "first"), ("remove", table, "first"),
+                                                         ("insert", table, "first")])
+            self.assertEqual(_committed(self.repo._filename, table), ["first"])
+
+
+class WriteRecordsTest(unittest.TestCase):
+    """
+    Writes a batch as a --diff load does, to a repo holding P-1, stored
+    with its fingerprint, and P-2, stored without one.
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.repo = StubCandigRepo(os.path.join(self.directory.name, "repo.db"), keep=True).open()
+        self.repo.add_many("Patient", [Record("P-1"), Record("P-2")])
+        self.table_map = {"repo_add_many": functools.partial(self.repo.add_many, "Patient"),
+                          "repo_upsert_many": functools.partial(self.repo.upsert_many, "Patient"),
+                          "duplicate_error": Duplicate}
+        self.fingerprints = FingerprintStore(os.path.join(self.directory.name, "repo.db.fingerprints"))
+        self.fingerprints.record("Patient", "P-1", "old")
+        self.fingerprints.begin()
+        self.logger = ReportLogger()
+
+    def tearDown(self):
+        self.fingerprints.close()
+        self.repo._repo.close()
+        self.directory.cleanup()
+
+    def write(self, records, overwrite=False):
+        items = [(local_id, record_fingerprint, Record(local_id)) for local_id, record_fingerprint in records
+                 if not skip_planned(self.fingerprints, "Patient", local_id, record_fingerprint, overwrite,
+                                     self.logger)]
+        return write_records("Patient", items, self.table_map, {"--overwrite": overwrite}, self.logger,
+                             self.fingerprints)
+
+    def test_only_changed_records_replaced(self):
+        statuses = self.write([("P-1", "new"), ("P-2", "new"), ("P-3", "new"), ("P-3", "again")])
+        self.assertEqual(statuses, ["updated", None, "added"])
+        self.assertNotIn(("remove", "Patient", "P-2"), self.repo._repo.operations)
+        self.assertEqual(self.logger.messages, [
+            "Skipped: Duplicate Patient record name detected: P-3 ",
+            "Skipped: Duplicate Patient record name detected: P-2 ",
+            "Overwriting record for local identifier P-1 at Patient table"])
+        self.assertEqual((self.fingerprints.planned("Patient", "P-3"), len(_committed(self.repo._filename))),
+                         ("insert", 3))
+
+    def test_duplicates_overwritten(self):
+        statuses = self.write([("P-2", "new"), ("P-3", "new"), ("P-3", "again")], overwrite=True)
+        self.assertEqual(statuses, ["updated", "added", "updated"])
+
+
+if __name__ == '__main__':
+    unittest.main()
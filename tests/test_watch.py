@@ -0,0 +1,257 @@
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+from ingest_common.mapping import load_engine
+from ingest_common.scan import ERROR, read_batches, ROWS
+from ingest_common.streams import input_files_in
+from ingest_common.watch import _compact, _expand, Changes, diff_listings, InputCache, is_ignored, \
+    replaced_output, run_watcher, watch_inputs, Watcher
+
+COMPARISON = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "comparison")
+
+
+def _write(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+
+
+class ListingTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_diff_listings(self):
+        old = {"a.csv": (1, 1), "b.csv": (2, 2), "c.csv": (3, 3)}
+        new = {"a.csv": (1, 1), "b.csv": (2, 5), "d.csv": (4, 4)}
+        self.assertEqual(diff_listings(old, new), Changes(["d.csv"], ["b.csv"], ["c.csv"]))
+
+    def test_ignored(self):
+        for name in (".hidden.csv", "demo.csv.part", "demo.csv.tmp", "demo.csv~"):
+            self.assertTrue(is_ignored(name), name)
+        self.assertFalse(is_ignored("demo.csv"))
+
+    def test_listing_skips_ignored_and_excluded(self):
+        for name in ("demo.csv", "diag.csv", ".out.json", "tx.csv.part", "out.json"):
+            _write(os.path.join(self.directory.name, name), "x")
+        os.mkdir(os.path.join(self.directory.name, "sub"))
+        watcher = Watcher(self.directory.name, use_inotify=False, excluded={"out.json"})
+        self.assertEqual(sorted(watcher.listing()), ["demo.csv", "diag.csv"])
+
+        watcher = Watcher(self.directory.name, names={"demo.csv"}, use_inotify=False)
+        self.assertEqual(sorted(watcher.listing()), ["demo.csv"])
+
+    def test_batches(self):
+        path = os.path.join(self.directory.name, "demo.csv")
+        _write(path, "a")
+        watcher = Watcher(self.directory.name, debounce=0.05, poll_interval=0.05, use_inotify=False)
+        batches = watcher.batches()
+        self.assertEqual(next(batches), Changes(["demo.csv"], [], []))
+        _write(path, "ab")
+        self.assertEqual(next(batches), Changes([], ["demo.csv"], []))
+        os.remove(path)
+        self.assertEqual(next(batches), Changes([], [], ["demo.csv"]))
+        watcher.close()
+
+
+class RunWatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.sigterm = signal.getsignal(signal.SIGTERM)
+
+    def tearDown(self):
+        signal.signal(signal.SIGTERM, self.sigterm)
+        self.directory.cleanup()
+
+    def test_stops_on_interrupt(self):
+        _write(os.path.join(self.directory.name, "demo.csv"), "a")
+        watcher = Watcher(self.directory.name, debounce=0.05, poll_interval=0.05)
+        mode = "inotify" if watcher.uses_inotify else "polling"
+        messages, handled = [], []
+
+        def handle(changes):
+            handled.append(changes)
+            raise KeyboardInterrupt
+
+        run_watcher(watcher, handle, self.directory.name, report=messages.append)
+        self.assertEqual(messages, [f"Watching {self.directory.name} ({mode})"])
+        self.assertEqual(handled, [Changes(["demo.csv"], [], [])])
+        # closed
+        self.assertFalse(watcher.uses_inotify)
+
+
+class OutputTest(unittest.TestCase):
+    def test_replaced_output(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "out.json")
+            _write(path, "old")
+            with replaced_output(path) as output_file:
+                output_file.write("new")
+                with open(path) as f:
+                    self.assertEqual(f.read(), "old")
+            with open(path) as f:
+                self.assertEqual(f.read(), "new")
+            self.assertEqual(os.listdir(directory), ["out.json"])
+
+
+class CompactTest(unittest.TestCase):
+    def test_round_trip(self):
+        rows = [{"id": "P-01", "age": "40"}, {"id": "P-02", "age": "41"},
+                {"id": "P-03", "age": "42", None: ["extra"]}]
+        batch = ("demo.csv", ROWS, rows)
+        compact = _compact(batch)
+        self.assertEqual(compact[2][0], ("id", "age"))
+        self.assertEqual(_expand(compact), batch)
+
+    def test_other_batches_kept(self):
+        for batch in (("demo.csv", ROWS, []), ("demo.csv", ERROR, OSError("gone"))):
+            self.assertIs(_compact(batch), batch)
+            self.assertIs(_expand(batch), batch)
+
+
+class InputCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.inputs = os.path.join(self.directory.name, "comparison")
+        shutil.copytree(COMPARISON, self.inputs)
+        self.engine = load_engine(os.path.join(ROOT, "COMPARISON", "mapping.json"),
+                                  os.path.join(self.directory.name, "cache"))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def cold(self):
+        return [(input_file.name, kind, items)
+                for input_file, kind, items in read_batches(self.engine, input_files_in(self.inputs))]
+
+    def cached(self, cache, patients=None):
+        return [(input_file.name, kind, items) for input_file, kind, items in cache.batches(patients)]
+
+    def test_same_batches_as_a_cold_read(self):
+        cache = InputCache(self.engine, self.inputs)
+        patients, errors = cache.refresh(Changes(sorted(os.listdir(self.inputs)), [], []))
+        self.assertEqual((len(patients), errors), (20, []))
+        self.assertEqual(self.cached(cache), self.cold())
+
+        with open(os.path.join(self.inputs, "death.csv"), "a") as f:
+            f.write("P019,Death,Other,1/1/2019 00:00:00\n")
+        os.remove(os.path.join(self.inputs, "tis.csv"))
+        patients, errors = cache.refresh(Changes([], ["death.csv"], ["tis.csv"]))
+        self.assertEqual(len(patients), 20)
+        self.assertEqual(self.cached(cache), self.cold())
+        self.assertEqual(len(cache), 6)
+
+    def test_batches_of_some_patients(self):
+        cache = InputCache(self.engine, self.inputs)
+        cache.refresh(Changes(sorted(os.listdir(self.inputs)), [], []))
+        batches = self.cached(cache, {"P005"})
+        rows = [row for _, _, items in self.cold() for row in items if row["Subject"] == "P005"]
+        self.assertEqual([row for _, _, items in batches for row in items], rows)
+        self.assertEqual(len(batches), len(self.cold()))
+
+        with open(os.path.join(self.inputs, "fu.csv"), "a") as f:
+            f.write("P099,Follow-up Patient Status,Other,01/01/2019,NED\n")
+        patients, _ = cache.refresh(Changes([], ["fu.csv"], []))
+        self.assertIn("P099", patients)
+        # only fu.csv has rows for P099
+        self.assertEqual([os.path.basename(name) for name, _, _ in self.cached(cache, {"P099"})], ["fu.csv"])
+
+
+class StubWatcher(object):
+    """
+    Reports the changes made by each of <steps>, one at a time, keeping
+    the output written after each of them.
+    """
+    uses_inotify = False
+
+    def __init__(self, steps, output):
+        self._steps = steps
+        self._output = output
+        self.outputs = []
+
+    def batches(self):
+        for step in self._steps:
+            yield step()
+            with open(self._output) as f:
+                self.outputs.append(json.load(f)["metadata"])
+
+    def close(self):
+        pass
+
+
+class WatchInputsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.inputs = os.path.join(self.directory.name, "comparison")
+        shutil.copytree(COMPARISON, self.inputs)
+        self.output = os.path.join(self.directory.name, "out.json")
+        spec = importlib.util.spec_from_file_location("data_ingest", os.path.join(ROOT, "COMPARISON",
+                                                                                  "data_ingest.py"))
+        self.script = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(self.script)
+        self.sigterm = signal.getsignal(signal.SIGTERM)
+
+    def tearDown(self):
+        signal.signal(signal.SIGTERM, self.sigterm)
+        self.directory.cleanup()
+
+    def engine(self):
+        return load_engine(os.path.join(ROOT, "COMPARISON", "mapping.json"), os.path.join(self.directory.name, "cache"))
+
+    def cold(self):
+        engine = self.engine()
+        self.script.read_input_files(engine, input_files_in(self.inputs), pipelined=False)
+        self.script.finalize_vital_status(engine)
+        return sorted(engine.metadata(), key=lambda entry: entry["Patient"]["patientId"])
+
+    def append(self, name, line, changes):
+        with open(os.path.join(self.inputs, name), "a") as f:
+            f.write(line)
+        return changes
+
+    def test_patients_of_changed_files_mapped_again(self):
+        expected = []
+
+        def step(change):
+            def run():
+                changes = change()
+                expected.append(self.cold())
+                return changes
+            return run
+
+        steps = [step(lambda: Changes(sorted(os.listdir(self.inputs)), [], [])),
+                 step(lambda: self.append("death.csv", "P019,Death,Other,1/1/2019 00:00:00\n",
+                                          Changes([], ["death.csv"], []))),
+                 step(lambda: self.append("extra.csv", "Subject,DataPageName,Site,FU_STATUS_DT,DISEASE_STATUS\n"
+                                          "P099,Follow-up Patient Status,Other,01/01/2019,NED\n",
+                                          Changes(["extra.csv"], [], []))),
+                 step(lambda: (os.remove(os.path.join(self.inputs, "extra.csv")), Changes([], [], ["extra.csv"]))[1])]
+        watcher = StubWatcher(steps, self.output)
+        messages = io.StringIO()
+        with contextlib.redirect_stderr(messages):
+            watch_inputs(self.engine(), self.inputs, self.output, self.script.map_batches,
+                         self.script.finalize_vital_status, watcher=watcher)
+
+        # the records of a cold run, localIds and vital status included
+        self.assertEqual([sorted(output, key=lambda entry: entry["Patient"]["patientId"])
+                          for output in watcher.outputs], expected)
+        # the seven patients who died and P019, then P099, then no one once P099 is gone
+        self.assertEqual([line.split(" patients mapped")[0].rsplit(" ", 1)[1]
+                          for line in messages.getvalue().splitlines() if "patients mapped" in line],
+                         ["20", "8", "1", "0"])
+        self.assertEqual(watcher.outputs[-1][-1]["Patient"]["patientId"], "P019")
+
+
+if __name__ == '__main__':
+    unittest.main()